@@ -11,8 +11,11 @@ import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 from uuid import uuid4
 
+from Analysis_core.event_detection import find_anomalies, find_glitches, find_warming, mask_from_spans
+from Analysis_core.event_plots import EventPlotRenderer, plot_job, window
+
 class Analyzer:
-    def __init__(self, folder_path, column_index, sensor_name, debug_mode=False):
+    def __init__(self, folder_path, column_index, sensor_name, debug_mode=False, lazy_plots=False):
         self.folder_path = folder_path
         self.column_index = column_index
         self.sensor_name = f"T{column_index}"
@@ -53,6 +56,8 @@ class Analyzer:
         self.sampling_interval = None
         self.avg_pre_warming = None
         self.sigma_pre_warming = None
+        # Миниатюры событий рисуются после обнаружения, пачкой в пуле процессов (или по запросу)
+        self.plot_renderer = EventPlotRenderer(lazy=lazy_plots)
 
     def create_folders(self):
         os.makedirs(self.anomalies_folder, exist_ok=True)
@@ -122,51 +127,26 @@ class Analyzer:
 
     def remove_glitches(self, threshold_delta=50, max_glitch_duration=10):
         max_glitch_points = int(max_glitch_duration / self.sampling_interval)
-        diffs = np.abs(np.diff(self.values))
-        glitch_starts = np.where(diffs > threshold_delta)[0] + 1
-        mask_good = np.ones(len(self.values), dtype=bool)
-
-        for idx, start in enumerate(glitch_starts):
-            end = start
-            base_value = self.values[start - 1] if start > 0 else self.values[0]
-            while end < len(self.values) and (end - start) <= max_glitch_points and abs(self.values[end] - base_value) > threshold_delta:
-                end += 1
-            if (end - start) <= max_glitch_points and end < len(self.values):
-                if abs(self.values[end] - base_value) <= 5:
-                    mask_good[start:end] = False
-                    glitch_start_time = self.times[start]
-                    glitch_end_time = self.times[end]
-                    glitch_mask = (self.times >= glitch_start_time - timedelta(minutes=5)) & (self.times <= glitch_end_time + timedelta(minutes=5))
-                    times_glitch = self.times[glitch_mask]
-                    values_glitch = self.values[glitch_mask]
-                    fig, ax = plt.subplots(figsize=(8, 4))
-                    ax.plot(times_glitch, values_glitch, label=f'{self.sensor_name}', color='blue')
-                    ax.axvspan(glitch_start_time, glitch_end_time, color='red', alpha=0.3)
-                    ax.set_xlabel("Время")
-                    ax.set_ylabel("Температура (К)")
-                    ax.set_title(f"Глюк датчика {self.sensor_name} с {glitch_start_time.strftime('%Y-%m-%d %H:%M:%S')}")
-                    ax.grid(True)
-                    ax.legend()
-                    locator = mdates.AutoDateLocator()
-                    formatter = mdates.AutoDateFormatter(locator)
-                    formatter.scaled[1/24] = '%H:%M'
-                    formatter.scaled[1] = '%d %b %H:%M'
-                    ax.xaxis.set_major_locator(locator)
-                    ax.xaxis.set_major_formatter(formatter)
-                    plt.xticks(rotation=45)
-                    plt.tight_layout()
-                    glitch_filename = f"glitch_{idx}_{glitch_start_time.strftime('%Y%m%d_%H%M%S')}.png"
-                    glitch_filepath = os.path.join(self.glitches_folder, glitch_filename)
-                    plt.savefig(glitch_filepath)
-                    plt.close()
-                    glitch_info = {
-                        "start_time": glitch_start_time.strftime('%Y-%m-%d %H:%M:%S'),
-                        "end_time": glitch_end_time.strftime('%Y-%m-%d %H:%M:%S'),
-                        "plot_file": glitch_filepath
-                    }
-                    self.results["glitches"].append(glitch_info)
-                    if self.debug_mode:
-                        print(f"Обнаружен глюк датчика с {glitch_start_time.strftime('%Y-%m-%d %H:%M:%S')} до {glitch_end_time.strftime('%Y-%m-%d %H:%M:%S')}, удален. График сохранен: {glitch_filepath}")
+        glitches = find_glitches(self.values, threshold_delta, max_glitch_points)
+        mask_good = ~mask_from_spans(len(self.values), [start for _, start, _ in glitches], [end for _, _, end in glitches])
+
+        for idx, start, end in glitches:
+            glitch_start_time = self.times[start]
+            glitch_end_time = self.times[end]
+            around = window(self.times, glitch_start_time, glitch_end_time, timedelta(minutes=5))
+            glitch_filename = f"glitch_{idx}_{glitch_start_time.strftime('%Y%m%d_%H%M%S')}.png"
+            glitch_filepath = self.plot_renderer.submit(plot_job(
+                os.path.join(self.glitches_folder, glitch_filename), self.times[around], self.values[around],
+                f"Глюк датчика {self.sensor_name} с {glitch_start_time.strftime('%Y-%m-%d %H:%M:%S')}", self.sensor_name,
+                span=(glitch_start_time, glitch_end_time), span_color='red'))
+            glitch_info = {
+                "start_time": glitch_start_time.strftime('%Y-%m-%d %H:%M:%S'),
+                "end_time": glitch_end_time.strftime('%Y-%m-%d %H:%M:%S'),
+                "plot_file": glitch_filepath
+            }
+            self.results["glitches"].append(glitch_info)
+            if self.debug_mode:
+                print(f"Обнаружен глюк датчика с {glitch_start_time.strftime('%Y-%m-%d %H:%M:%S')} до {glitch_end_time.strftime('%Y-%m-%d %H:%M:%S')}, удален. График: {glitch_filepath}")
 
         self.times_filtered = self.times[mask_good]
         self.values_filtered = self.values[mask_good]
@@ -263,23 +243,13 @@ class Analyzer:
         hold_points = int((hold_duration_minutes * 60) // self.sampling_interval)
         if self.debug_mode:
             print(f"Hold points: {hold_points}")
-        start_warming_idx = None
-        for i in range(len(self.values_filtered) - hold_points):
-            if self.values_filtered[i] >= warm_threshold:
-                sustain_segment = self.values_filtered[i:i + hold_points]
-                if np.mean(sustain_segment) >= sustain_threshold:
-                    start_warming_idx = i
-                    break
+        start_warming_idx, actual_start_idx = find_warming(
+            self.values_filtered, self.avg_pre_warming, warm_threshold, sustain_threshold, hold_points, tolerance=0.1
+        )
 
         warming_start_time = None
         warming_end_time = None
         if start_warming_idx is not None:
-            tolerance = 0.1
-            actual_start_idx = None
-            for i in range(start_warming_idx, -1, -1):
-                if abs(self.values_filtered[i] - self.avg_pre_warming) <= tolerance:
-                    actual_start_idx = i
-                    break
             if actual_start_idx is not None:
                 warming_start_time = self.times_filtered[actual_start_idx]
                 warming_end_time = self.times_filtered[start_warming_idx + hold_points - 1] if start_warming_idx + hold_points - 1 < len(self.times_filtered) else self.times_filtered[-1]
@@ -293,115 +263,38 @@ class Analyzer:
         jump_threshold = jump_threshold_factor * self.sigma_pre_warming
         return_threshold = return_threshold_factor * self.sigma_pre_warming
         values = self.values_filtered if use_anomalies else self.values_filtered_no_anomalies
-        deviations = np.abs(values - self.avg_pre_warming)
-        jump_points = np.where(deviations >= jump_threshold)[0]
         anomalies = []
 
-        i = 0
-        while i < len(jump_points):
-            start_jump = jump_points[i]
-            j = i
-            while j < len(jump_points) - 1 and jump_points[j + 1] == jump_points[j] + 1:
-                j += 1
-            segment_end = jump_points[j] if j < len(jump_points) else len(values) - 1
-            peak_idx = start_jump + np.argmax(values[start_jump:segment_end + 1])
-            
-            start_idx = start_jump
-            for k in range(peak_idx - 1, -1, -1):
-                if abs(values[k] - self.avg_pre_warming) <= return_threshold:
-                    start_idx = k
-                    break
-            
-            end_idx = peak_idx
-            for k in range(peak_idx + 1, len(values)):
-                if abs(values[k] - self.avg_pre_warming) <= return_threshold:
-                    end_idx = k
-                    break
-            
+        for start_idx, peak_idx, end_idx in find_anomalies(values, self.avg_pre_warming, jump_threshold, return_threshold):
             duration_points = end_idx - start_idx
             anomaly_start_time = self.times_filtered[start_idx]
             anomaly_end_time = self.times_filtered[end_idx]
-            
+
             if warming_start_time and warming_end_time:
-                if not (anomaly_end_time >= warming_start_time and anomaly_start_time <= warming_end_time):
-                    if duration_points >= min_anomaly_points:
-                        amplitude = values[peak_idx] - self.avg_pre_warming
-                        anomaly_info = {
-                            "start_time": anomaly_start_time.strftime('%Y-%m-%d %H:%M:%S'),
-                            "end_time": anomaly_end_time.strftime('%Y-%m-%d %H:%M:%S'),
-                            "amplitude": float(amplitude)
-                        }
-                        if not use_anomalies:
-                            anomaly_mask = (self.times_filtered >= anomaly_start_time - timedelta(minutes=5)) & (self.times_filtered <= anomaly_end_time + timedelta(minutes=5))
-                            times_anomaly = self.times_filtered[anomaly_mask]
-                            values_anomaly = values[anomaly_mask]
-                            fig, ax = plt.subplots(figsize=(8, 4))
-                            ax.plot(times_anomaly, values_anomaly, label=f'{self.sensor_name}', color='blue')
-                            ax.axvspan(anomaly_start_time, anomaly_end_time, color='yellow', alpha=0.3)
-                            ax.set_xlabel("Время")
-                            ax.set_ylabel("Температура (К)")
-                            ax.set_title(f"Аномалия датчика {self.sensor_name} с {anomaly_start_time.strftime('%Y-%m-%d %H:%M:%S')}")
-                            ax.grid(True)
-                            ax.legend()
-                            locator = mdates.AutoDateLocator()
-                            formatter = mdates.AutoDateFormatter(locator)
-                            formatter.scaled[1/24] = '%H:%M'
-                            formatter.scaled[1] = '%d %b %H:%M'
-                            ax.xaxis.set_major_locator(locator)
-                            ax.xaxis.set_major_formatter(formatter)
-                            plt.xticks(rotation=45)
-                            plt.tight_layout()
-                            anomaly_filename = f"anomaly_{len(anomalies)}_{anomaly_start_time.strftime('%Y%m%d_%H%M%S')}.png"
-                            anomaly_filepath = os.path.join(self.anomalies_folder, anomaly_filename)
-                            plt.savefig(anomaly_filepath)
-                            plt.close()
-                            anomaly_info["plot_file"] = anomaly_filepath
-                            self.results["anomalies"].append(anomaly_info)
-                        else:
-                            self.results["anomalies_with"].append(anomaly_info)
-                        anomalies.append((start_idx, end_idx))
-                        if self.debug_mode:
-                            print(f"Обнаружена аномалия: с {anomaly_start_time.strftime('%Y-%m-%d %H:%M:%S')} до {anomaly_end_time.strftime('%Y-%m-%d %H:%M:%S')}, амплитуда {amplitude:.2f} K")
-            elif duration_points >= min_anomaly_points:
-                amplitude = values[peak_idx] - self.avg_pre_warming
-                anomaly_info = {
-                    "start_time": anomaly_start_time.strftime('%Y-%m-%d %H:%M:%S'),
-                    "end_time": anomaly_end_time.strftime('%Y-%m-%d %H:%M:%S'),
-                    "amplitude": float(amplitude)
-                }
-                if not use_anomalies:
-                    anomaly_mask = (self.times_filtered >= anomaly_start_time - timedelta(minutes=5)) & (self.times_filtered <= anomaly_end_time + timedelta(minutes=5))
-                    times_anomaly = self.times_filtered[anomaly_mask]
-                    values_anomaly = values[anomaly_mask]
-                    fig, ax = plt.subplots(figsize=(8, 4))
-                    ax.plot(times_anomaly, values_anomaly, label=f'{self.sensor_name}', color='blue')
-                    ax.axvspan(anomaly_start_time, anomaly_end_time, color='yellow', alpha=0.3)
-                    ax.set_xlabel("Время")
-                    ax.set_ylabel("Температура (К)")
-                    ax.set_title(f"Аномалия датчика {self.sensor_name} с {anomaly_start_time.strftime('%Y-%m-%d %H:%M:%S')}")
-                    ax.grid(True)
-                    ax.legend()
-                    locator = mdates.AutoDateLocator()
-                    formatter = mdates.AutoDateFormatter(locator)
-                    formatter.scaled[1/24] = '%H:%M'
-                    formatter.scaled[1] = '%d %b %H:%M'
-                    ax.xaxis.set_major_locator(locator)
-                    ax.xaxis.set_major_formatter(formatter)
-                    plt.xticks(rotation=45)
-                    plt.tight_layout()
-                    anomaly_filename = f"anomaly_{len(anomalies)}_{anomaly_start_time.strftime('%Y%m%d_%H%M%S')}.png"
-                    anomaly_filepath = os.path.join(self.anomalies_folder, anomaly_filename)
-                    plt.savefig(anomaly_filepath)
-                    plt.close()
-                    anomaly_info["plot_file"] = anomaly_filepath
-                    self.results["anomalies"].append(anomaly_info)
-                else:
-                    self.results["anomalies_with"].append(anomaly_info)
-                anomalies.append((start_idx, end_idx))
-                if self.debug_mode:
-                    print(f"Обнаружена аномалия: с {anomaly_start_time.strftime('%Y-%m-%d %H:%M:%S')} до {anomaly_end_time.strftime('%Y-%m-%d %H:%M:%S')}, амплитуда {amplitude:.2f} K")
-            
-            i = j + 1
+                if anomaly_end_time >= warming_start_time and anomaly_start_time <= warming_end_time:
+                    continue
+            if duration_points < min_anomaly_points:
+                continue
+            amplitude = values[peak_idx] - self.avg_pre_warming
+            anomaly_info = {
+                "start_time": anomaly_start_time.strftime('%Y-%m-%d %H:%M:%S'),
+                "end_time": anomaly_end_time.strftime('%Y-%m-%d %H:%M:%S'),
+                "amplitude": float(amplitude)
+            }
+            if not use_anomalies:
+                around = window(self.times_filtered, anomaly_start_time, anomaly_end_time, timedelta(minutes=5))
+                anomaly_filename = f"anomaly_{len(anomalies)}_{anomaly_start_time.strftime('%Y%m%d_%H%M%S')}.png"
+                anomaly_info["plot_file"] = self.plot_renderer.submit(plot_job(
+                    os.path.join(self.anomalies_folder, anomaly_filename), self.times_filtered[around], values[around],
+                    f"Аномалия датчика {self.sensor_name} с {anomaly_start_time.strftime('%Y-%m-%d %H:%M:%S')}",
+                    self.sensor_name, span=(anomaly_start_time, anomaly_end_time), span_color='yellow'))
+                self.results["anomalies"].append(anomaly_info)
+            else:
+                self.results["anomalies_with"].append(anomaly_info)
+            anomalies.append((start_idx, end_idx))
+            if self.debug_mode:
+                print(f"Обнаружена аномалия: с {anomaly_start_time.strftime('%Y-%m-%d %H:%M:%S')} до {anomaly_end_time.strftime('%Y-%m-%d %H:%M:%S')}, амплитуда {amplitude:.2f} K")
+
         return anomalies
 
     def evaluate_anomaly_accuracy(self, ground_truth_anomalies):
@@ -630,29 +523,12 @@ class Analyzer:
             warm_value = values_plot_no_anomalies[actual_start_idx]
             warm_value = max(min(warm_value, y_max2), y_min2)
 
-            warm_mask = (self.times_filtered >= warm_time - timedelta(minutes=30)) & (self.times_filtered <= warm_time + timedelta(minutes=30))
-            times_warm = self.times_filtered[warm_mask]
-            values_warm = self.values_filtered[warm_mask]
-            fig_warm, ax_warm = plt.subplots(figsize=(8, 4))
-            ax_warm.plot(times_warm, values_warm, label=f'{self.sensor_name}', color='blue')
-            ax_warm.axvline(warm_time, color='green', linestyle='--')
-            ax_warm.set_xlabel("Время")
-            ax_warm.set_ylabel("Температура (К)")
-            ax_warm.set_title(f"Отогрев датчика {self.sensor_name} с {warm_time.strftime('%Y-%m-%d %H:%M:%S')}")
-            ax_warm.grid(True)
-            ax_warm.legend(loc='upper right')
-            locator = mdates.AutoDateLocator()
-            formatter = mdates.AutoDateFormatter(locator)
-            formatter.scaled[1/24] = '%H:%M'
-            formatter.scaled[1] = '%d %b %H:%M'
-            ax_warm.xaxis.set_major_locator(locator)
-            ax_warm.xaxis.set_major_formatter(formatter)
-            plt.xticks(rotation=45)
-            plt.tight_layout()
+            around = window(self.times_filtered, warm_time, warm_time, timedelta(minutes=30))
             warm_filename = f"warming_{warm_time.strftime('%Y%m%d_%H%M%S')}.png"
-            warm_filepath = os.path.join(self.warming_folder, warm_filename)
-            plt.savefig(warm_filepath)
-            plt.close(fig_warm)
+            warm_filepath = self.plot_renderer.submit(plot_job(
+                os.path.join(self.warming_folder, warm_filename), self.times_filtered[around], self.values_filtered[around],
+                f"Отогрев датчика {self.sensor_name} с {warm_time.strftime('%Y-%m-%d %H:%M:%S')}", self.sensor_name,
+                marker=warm_time, marker_color='green', legend_loc='upper right'))
             self.results["warming"] = {
                 "start_time": warm_time.strftime('%Y-%m-%d %H:%M:%S'),
                 "type": "confirmed",
@@ -684,29 +560,12 @@ class Analyzer:
                     warm_time = times_plot[i]
                     warm_value = values_plot_no_anomalies[i]
                     warm_value = max(min(warm_value, y_max2), y_min2)
-                    warm_mask = (self.times_filtered >= warm_time - timedelta(minutes=30)) & (self.times_filtered <= warm_time + timedelta(minutes=30))
-                    times_warm = self.times_filtered[warm_mask]
-                    values_warm = self.values_filtered[warm_mask]
-                    fig_warm, ax_warm = plt.subplots(figsize=(8, 4))
-                    ax_warm.plot(times_warm, values_warm, label=f'{self.sensor_name}', color='blue')
-                    ax_warm.axvline(warm_time, color='orange', linestyle='--')
-                    ax_warm.set_xlabel("Время")
-                    ax_warm.set_ylabel("Температура (К)")
-                    ax_warm.set_title(f"Возможный отогрев датчика {self.sensor_name} с {warm_time.strftime('%Y-%m-%d %H:%M:%S')}")
-                    ax_warm.grid(True)
-                    ax_warm.legend(loc='upper right')
-                    locator = mdates.AutoDateLocator()
-                    formatter = mdates.AutoDateFormatter(locator)
-                    formatter.scaled[1/24] = '%H:%M'
-                    formatter.scaled[1] = '%d %b %H:%M'
-                    ax_warm.xaxis.set_major_locator(locator)
-                    ax_warm.xaxis.set_major_formatter(formatter)
-                    plt.xticks(rotation=45)
-                    plt.tight_layout()
+                    around = window(self.times_filtered, warm_time, warm_time, timedelta(minutes=30))
                     warm_filename = f"warming_{warm_time.strftime('%Y%m%d_%H%M%S')}.png"
-                    warm_filepath = os.path.join(self.warming_folder, warm_filename)
-                    plt.savefig(warm_filepath)
-                    plt.close(fig_warm)
+                    warm_filepath = self.plot_renderer.submit(plot_job(
+                        os.path.join(self.warming_folder, warm_filename), self.times_filtered[around], self.values_filtered[around],
+                        f"Возможный отогрев датчика {self.sensor_name} с {warm_time.strftime('%Y-%m-%d %H:%M:%S')}",
+                        self.sensor_name, marker=warm_time, marker_color='orange', legend_loc='upper right'))
                     self.results["warming"] = {
                         "start_time": warm_time.strftime('%Y-%m-%d %H:%M:%S'),
                         "type": "possible",
@@ -792,6 +651,7 @@ class Analyzer:
             print(f"Найдено аномалий (без искусственных): {len(anomalies)}")
         
         self.plot_results(warming_start_time, warming_end_time)
+        self.plot_renderer.flush()
         self.save_results()
 
 if __name__ == "__main__":
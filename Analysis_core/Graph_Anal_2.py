@@ -10,10 +10,12 @@ matplotlib.use('TkAgg')
 from datetime import datetime, timedelta
 import numpy as np
 from dateutil.tz import tzutc
-from tqdm import tqdm
+
+from Analysis_core.event_detection import find_glitches, find_transitions, find_zscore_anomalies, mask_from_spans
+from Analysis_core.event_plots import EventPlotRenderer, plot_job, window
 
 class AnomalyDetector:
-    def __init__(self, folder_path, column_index, sensor_name, debug_mode=False, glitches_folder="glitches"):
+    def __init__(self, folder_path, column_index, sensor_name, debug_mode=False, glitches_folder="glitches", lazy_plots=False):
         self.folder_path = folder_path
         self.column_index = column_index
         self.sensor_name = sensor_name
@@ -27,6 +29,7 @@ class AnomalyDetector:
         self.values_filtered = None
         self.sampling_interval = 3600
         self.results = {"glitches": []}
+        self.plot_renderer = EventPlotRenderer(lazy=lazy_plots)
 
     def load_data(self):
         self.raw_data = []
@@ -118,128 +121,69 @@ class AnomalyDetector:
     def remove_glitches(self, threshold_delta=50, max_glitch_duration=10):
         os.makedirs(self.glitches_folder, exist_ok=True)
         max_glitch_points = int(max_glitch_duration / self.sampling_interval)
-        diffs = np.abs(np.diff(self.values))
-        glitch_starts = np.where(diffs > threshold_delta)[0] + 1
-        mask_good = np.ones(len(self.values), dtype=bool)
-
-        for idx, start in enumerate(glitch_starts):
-            end = start
-            base_value = self.values[start - 1] if start > 0 else self.values[0]
-            while end < len(self.values) and (end - start) <= max_glitch_points and abs(self.values[end] - base_value) > threshold_delta:
-                end += 1
-            if (end - start) <= max_glitch_points and end < len(self.values):
-                if abs(self.values[end] - base_value) <= 5:
-                    mask_good[start:end] = False
-                    glitch_start_time = self.times[start]
-                    glitch_end_time = self.times[end]
-                    glitch_mask = (self.times >= glitch_start_time - timedelta(minutes=5)) & (self.times <= glitch_end_time + timedelta(minutes=5))
-                    times_glitch = self.times[glitch_mask]
-                    values_glitch = self.values[glitch_mask]
-                    fig, ax = plt.subplots(figsize=(8, 4))
-                    ax.plot(times_glitch, values_glitch, label=f'{self.sensor_name}', color='blue')
-                    ax.axvspan(glitch_start_time, glitch_end_time, color='red', alpha=0.3)
-                    ax.set_xlabel("Время")
-                    ax.set_ylabel("Температура (К)")
-                    ax.set_title(f"Глюк датчика {self.sensor_name} с {glitch_start_time.strftime('%Y-%m-%d %H:%M:%S')}")
-                    ax.grid(True)
-                    ax.legend()
-                    locator = mdates.AutoDateLocator()
-                    formatter = mdates.AutoDateFormatter(locator)
-                    formatter.scaled[1/24] = '%H:%M'
-                    formatter.scaled[1] = '%d %b %H:%M'
-                    ax.xaxis.set_major_locator(locator)
-                    ax.xaxis.set_major_formatter(formatter)
-                    plt.xticks(rotation=45)
-                    plt.tight_layout()
-                    glitch_filename = f"glitch_{idx}_{glitch_start_time.strftime('%Y%m%d_%H%M%S')}.png"
-                    glitch_filepath = os.path.join(self.glitches_folder, glitch_filename)
-                    plt.savefig(glitch_filepath)
-                    plt.close()
-                    glitch_info = {
-                        "start_time": glitch_start_time.strftime('%Y-%m-%d %H:%M:%S'),
-                        "end_time": glitch_end_time.strftime('%Y-%m-%d %H:%M:%S'),
-                        "plot_file": glitch_filepath
-                    }
-                    self.results["glitches"].append(glitch_info)
-                    if self.debug_mode:
-                        print(f"Обнаружен глюк датчика с {glitch_start_time.strftime('%Y-%m-%d %H:%M:%S')} до {glitch_end_time.strftime('%Y-%m-%d %H:%M:%S')}, удален. График сохранен: {glitch_filepath}")
+        glitches = find_glitches(self.values, threshold_delta, max_glitch_points)
+        mask_good = ~mask_from_spans(len(self.values), [start for _, start, _ in glitches], [end for _, _, end in glitches])
+
+        for idx, start, end in glitches:
+            glitch_start_time = self.times[start]
+            glitch_end_time = self.times[end]
+            around = window(self.times, glitch_start_time, glitch_end_time, timedelta(minutes=5))
+            glitch_filename = f"glitch_{idx}_{glitch_start_time.strftime('%Y%m%d_%H%M%S')}.png"
+            glitch_filepath = self.plot_renderer.submit(plot_job(
+                os.path.join(self.glitches_folder, glitch_filename), self.times[around], self.values[around],
+                f"Глюк датчика {self.sensor_name} с {glitch_start_time.strftime('%Y-%m-%d %H:%M:%S')}", self.sensor_name,
+                span=(glitch_start_time, glitch_end_time), span_color='red'))
+            glitch_info = {
+                "start_time": glitch_start_time.strftime('%Y-%m-%d %H:%M:%S'),
+                "end_time": glitch_end_time.strftime('%Y-%m-%d %H:%M:%S'),
+                "plot_file": glitch_filepath
+            }
+            self.results["glitches"].append(glitch_info)
+            if self.debug_mode:
+                print(f"Обнаружен глюк датчика с {glitch_start_time.strftime('%Y-%m-%d %H:%M:%S')} до {glitch_end_time.strftime('%Y-%m-%d %H:%M:%S')}, удален. График: {glitch_filepath}")
 
         self.times_filtered = self.times[mask_good]
         self.values_filtered = self.values[mask_good]
 
     def detect_transitions(self, target_values=[20, 80, 300], tolerance=10, min_duration=300):
-        transitions = []
-        in_transition = False
-        start_idx = 0
-        working_levels = sorted(target_values)
         min_points = int(min_duration / self.sampling_interval)
+        transitions = []
+        for start_idx, end_idx in find_transitions(self.values_filtered, target_values, tolerance, min_points):
+            prev_value = self.values_filtered[end_idx - 1]
+            curr_value = self.values_filtered[end_idx]
+            transition_type = "отогрев" if curr_value > prev_value else "охлаждение"
+            transitions.append({
+                "start_time": self.times_filtered[start_idx],
+                "end_time": self.times_filtered[end_idx],
+                "start_value": prev_value,
+                "end_value": curr_value,
+                "start_idx": start_idx,
+                "end_idx": end_idx,
+                "type": transition_type
+            })
+        if self.debug_mode:
+            print(f"Обнаружено переходов: {len(transitions)}")
+        return transitions
 
-        for i in tqdm(range(1, len(self.values_filtered)), desc="Обнаружение переходов"):
-            prev_value = self.values_filtered[i-1]
-            curr_value = self.values_filtered[i]
-            
-            # Определяем ближайший уровень для предыдущего и текущего значения
-            prev_level = min(working_levels, key=lambda x: abs(prev_value - x)) if any(abs(prev_value - level) <= tolerance for level in working_levels) else None
-            curr_level = min(working_levels, key=lambda x: abs(curr_value - x)) if any(abs(curr_value - level) <= tolerance for level in working_levels) else None
-            
-            # Начало перехода: выход из текущего уровня
-            if not in_transition and prev_level and (abs(curr_value - prev_value) > tolerance):
-                in_transition = True
-                start_idx = i - 1
-            # Конец перехода: стабилизация на новом уровне
-            elif in_transition and curr_level and (abs(curr_value - self.values_filtered[max(0, i-10):i+1].mean()) < tolerance) and (i - start_idx >= min_points):
-                in_transition = False
-                end_idx = i
-                transition_type = "отогрев" if curr_value > prev_value else "охлаждение"
-                transitions.append({
+    def detect_general_anomalies(self, z_threshold=5, window_size=30):
+        anomalies = []
+        spans, rolling_mean = find_zscore_anomalies(self.values_filtered, z_threshold, window_size)
+        for start_idx, end_idx in spans:
+            peak_value = np.max(self.values_filtered[start_idx:end_idx + 1])
+            baseline = rolling_mean[start_idx]
+            amplitude = peak_value - baseline
+            if amplitude > 20:  # Минимальная амплитуда
+                anomalies.append({
                     "start_time": self.times_filtered[start_idx],
                     "end_time": self.times_filtered[end_idx],
-                    "start_value": prev_value,
-                    "end_value": curr_value,
+                    "amplitude": amplitude,
+                    "peak_value": peak_value,
                     "start_idx": start_idx,
                     "end_idx": end_idx,
-                    "type": transition_type
+                    "type": "general"
                 })
-
-        return transitions
-
-    def detect_general_anomalies(self, z_threshold=5, window_size=30):
-        anomalies = []
-        in_anomaly = False
-        start_idx = 0
-
-        window = np.ones(window_size) / window_size
-        rolling_mean = np.convolve(self.values_filtered, window, mode='valid')
-        rolling_std = np.sqrt(np.convolve((self.values_filtered - np.convolve(self.values_filtered, window, mode='same'))**2, window, mode='valid') / window_size)
-        pad_left = (window_size - 1) // 2
-        pad_right = window_size - 1 - pad_left
-        rolling_mean = np.pad(rolling_mean, (pad_left, pad_right), mode='edge')
-        rolling_std = np.pad(rolling_std, (pad_left, pad_right), mode='edge')
-        z_scores = np.abs((self.values_filtered - rolling_mean) / rolling_std)
-
-        for i in tqdm(range(len(self.values_filtered)), desc="Обнаружение аномалий"):
-            current_value = self.values_filtered[i]
-            is_peak = i > 0 and abs(current_value - self.values_filtered[i-1]) > 30  # Резкий скачок более 30 К
-            is_outside = current_value < 0 or current_value > 350  # Выход за пределы
-            if not in_anomaly and (z_scores[i] > z_threshold or is_peak or is_outside):
-                in_anomaly = True
-                start_idx = i
-            elif in_anomaly and (z_scores[i] < z_threshold and not is_peak and not is_outside):
-                in_anomaly = False
-                peak_value = np.max(self.values_filtered[start_idx:i+1])
-                baseline = rolling_mean[start_idx]
-                amplitude = peak_value - baseline
-                if amplitude > 20:  # Минимальная амплитуда
-                    anomalies.append({
-                        "start_time": self.times_filtered[start_idx],
-                        "end_time": self.times_filtered[i],
-                        "amplitude": amplitude,
-                        "peak_value": peak_value,
-                        "start_idx": start_idx,
-                        "end_idx": i,
-                        "type": "general"
-                    })
-
+        if self.debug_mode:
+            print(f"Обнаружено аномалий: {len(anomalies)}")
         return anomalies
 
     def plot_anomalies(self, anomalies, transitions, output_dir="anomaly_plots"):
@@ -267,32 +211,18 @@ class AnomalyDetector:
         plt.show()
 
         for i, anomaly in enumerate(anomalies):
-            plt.figure(figsize=(8, 4))
-            mask = (self.times_filtered >= anomaly["start_time"]) & (self.times_filtered <= anomaly["end_time"])
-            plt.plot(self.times_filtered[mask], self.values_filtered[mask], label=f'{self.sensor_name}', color='red')
-            plt.xlabel("Время")
-            plt.ylabel("Температура (К)")
-            plt.title(f"Аномалия {i+1}: Амплитуда = {anomaly['amplitude']:.1f} К, Пик = {anomaly['peak_value']:.1f} К")
-            plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%d %b %H:%M'))
-            plt.xticks(rotation=45)
-            plt.grid()
-            plt.tight_layout()
-            plt.savefig(f"{output_dir}/anomaly_{i+1}.png")
-            plt.show()
+            span = window(self.times_filtered, anomaly["start_time"], anomaly["end_time"], timedelta(0))
+            anomaly["plot_file"] = self.plot_renderer.submit(plot_job(
+                f"{output_dir}/anomaly_{i+1}.png", self.times_filtered[span], self.values_filtered[span],
+                f"Аномалия {i+1}: Амплитуда = {anomaly['amplitude']:.1f} К, Пик = {anomaly['peak_value']:.1f} К",
+                self.sensor_name, color='red'))
 
         for i, transition in enumerate(transitions):
-            plt.figure(figsize=(8, 4))
-            mask = (self.times_filtered >= transition["start_time"]) & (self.times_filtered <= transition["end_time"])
-            plt.plot(self.times_filtered[mask], self.values_filtered[mask], label=f'{self.sensor_name}', color='orange' if transition["type"] == "отогрев" else 'blue')
-            plt.xlabel("Время")
-            plt.ylabel("Температура (К)")
-            plt.title(f"{transition['type'].capitalize()} {i+1}: От {transition['start_value']:.1f} К до {transition['end_value']:.1f} К")
-            plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%d %b %H:%M'))
-            plt.xticks(rotation=45)
-            plt.grid()
-            plt.tight_layout()
-            plt.savefig(f"{output_dir}/{transition['type']}_{i+1}.png")
-            plt.show()
+            span = window(self.times_filtered, transition["start_time"], transition["end_time"], timedelta(0))
+            transition["plot_file"] = self.plot_renderer.submit(plot_job(
+                f"{output_dir}/{transition['type']}_{i+1}.png", self.times_filtered[span], self.values_filtered[span],
+                f"{transition['type'].capitalize()} {i+1}: От {transition['start_value']:.1f} К до {transition['end_value']:.1f} К",
+                self.sensor_name, color='orange' if transition["type"] == "отогрев" else 'blue'))
 
     def run(self):
         if not self.load_data():
@@ -303,6 +233,7 @@ class AnomalyDetector:
         anomalies = self.detect_general_anomalies(z_threshold=5, window_size=30)
         transitions = self.detect_transitions(target_values=[20, 80, 300], tolerance=10, min_duration=300)
         self.plot_anomalies(anomalies, transitions)
+        self.plot_renderer.flush()
         return True
 
 if __name__ == "__main__":
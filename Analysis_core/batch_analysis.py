@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+"""Пакетный анализ многих датчиков за один проход по merged.db.
+
+Analyzer и AnomalyDetector читают по одному столбцу и для каждого датчика заново проходят по всем
+базам. Здесь нужные столбцы читаются одним запросом (или несколькими группами, если они не
+помещаются в лимит памяти), а анализ каждого датчика — ресемплинг, глюки, переходы и аномалии
+из event_detection — выполняется в пуле процессов. Результаты собираются в один отчёт,
+который сохраняется в JSON и/или SQLite.
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from Analysis_core.event_detection import find_glitches, find_transitions, find_zscore_anomalies, mask_from_spans
+
+CONFIG = {
+    "workers": os.cpu_count() or 1,     # Процессов анализа; 0 — без пула, в текущем процессе
+    "max_memory_mb": 1024,              # Лимит на загруженные столбцы; больше — чтение группами столбцов
+    "fetch_rows": 50000,                # Строк за один fetchmany
+    "resample_seconds": 60,             # Усреднение по сетке, как resample('1min') в AnomalyDetector; None — без него
+    "glitch_threshold": 50,
+    "glitch_max_seconds": 120,          # Не меньше шага ресемплинга, иначе глюк в одну точку не найдётся
+    "levels": (20, 80, 300),
+    "level_tolerance": 10,
+    "transition_min_seconds": 300,
+    "z_threshold": 5,
+    "z_window": 30,
+    "min_anomaly_amplitude": 20,
+    "sensor_pattern": r"^T\d{2}\b",     # Датчики полного обхода по умолчанию: термопары T01–T24
+}
+
+TIME_COLUMN = "time@timestamp"
+# Столбцов памяти на одну задачу в работе: копии времени и значений датчика плюс их сериализованный вид для пула
+TASK_COLUMNS = 4
+
+
+def sensors_from_info(sensor_info: Dict[str, Dict[str, Any]], pattern: str = CONFIG["sensor_pattern"]) -> Dict[str, int]:
+    """Имя -> индекс для датчиков, чьё имя подходит под pattern; алиасы одного индекса — один датчик."""
+    selected: Dict[str, int] = {}
+    seen = set()
+    for name, sensor in sensor_info.items():
+        if re.match(pattern, name) and sensor["index"] not in seen:
+            seen.add(sensor["index"])
+            selected[name] = sensor["index"]
+    return selected
+
+
+def resample_mean(times: np.ndarray, values: np.ndarray, step: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Средние по ячейкам сетки step секунд от первой до последней точки; пустые ячейки — NaN."""
+    bins = np.floor(times / step).astype(np.int64)
+    offsets = bins - bins[0]
+    size = int(offsets[-1]) + 1
+    sums = np.bincount(offsets, weights=values, minlength=size)
+    counts = np.bincount(offsets, minlength=size)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+    return (bins[0] + np.arange(size)) * float(step), means
+
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(float(ts), tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def analyze_sensor(task: Dict[str, Any]) -> Dict[str, Any]:
+    """Анализ одного датчика; выполняется в процессе пула, поэтому на входе и выходе — простые типы.
+
+    task: sensor_name, sensor_index, times и values (массивы без NaN, по возрастанию времени), options.
+    Ошибка анализа не прерывает обход остальных датчиков: она записывается в поле error результата.
+    """
+    result = {"sensor_name": task["sensor_name"], "sensor_index": task["sensor_index"],
+              "points": int(len(task["values"])), "stats": None, "events": [], "error": None}
+    try:
+        _analyze(task["times"], task["values"], task["options"], result)
+    except Exception as e:
+        result["events"] = []
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def _analyze(times: np.ndarray, values: np.ndarray, options: Dict[str, Any], result: Dict[str, Any]) -> None:
+    if not len(values):
+        return
+    result["stats"] = {
+        "start_time": _iso(times[0]), "end_time": _iso(times[-1]),
+        "mean": float(np.mean(values)), "std": float(np.std(values)),
+        "min": float(np.min(values)), "max": float(np.max(values)),
+    }
+    if options["resample_seconds"]:
+        times, values = resample_mean(times, values, options["resample_seconds"])
+        # Пустые ячейки отбрасываются: NaN в окне скользящего среднего гасит z-оценки всего окна
+        filled = ~np.isnan(values)
+        times, values = times[filled], values[filled]
+        interval = float(options["resample_seconds"])
+    else:
+        interval = float(np.median(np.diff(times))) if len(times) > 1 else 60.0
+    events = result["events"]
+
+    def add(event_type: str, start: int, end: int, amplitude: float, **details) -> None:
+        events.append(dict(type=event_type, start_ts=float(times[start]), end_ts=float(times[end]),
+                           start_time=_iso(times[start]), end_time=_iso(times[end]),
+                           amplitude=float(amplitude), **details))
+
+    glitches = find_glitches(values, options["glitch_threshold"], int(options["glitch_max_seconds"] / interval))
+    for _, start, end in glitches:
+        base = values[start - 1]
+        segment = values[start:end]
+        peak = segment[np.nanargmax(np.abs(segment - base))]
+        add("glitch", start, end, peak - base, base=float(base), peak=float(peak))
+    good = ~mask_from_spans(len(values), [start for _, start, _ in glitches], [end for _, _, end in glitches])
+    times, values = times[good], values[good]
+
+    for start, end in find_transitions(values, options["levels"], options["level_tolerance"],
+                                       int(options["transition_min_seconds"] / interval)):
+        kind = "отогрев" if values[end] > values[start] else "охлаждение"
+        add("transition", start, end, values[end] - values[start], kind=kind,
+            start_value=float(values[start]), end_value=float(values[end]))
+
+    # Ряд короче окна (короткий период, редкий датчик) — скользящей базы нет, z-оценки не считаются
+    if len(values) >= options["z_window"]:
+        spans, rolling = find_zscore_anomalies(values, options["z_threshold"], options["z_window"])
+        for start, end in spans:
+            peak = float(np.nanmax(values[start:end + 1]))
+            amplitude = peak - rolling[start]
+            if amplitude > options["min_anomaly_amplitude"]:
+                add("anomaly", start, end, amplitude, peak=peak, baseline=float(rolling[start]))
+    events.sort(key=lambda event: event["start_ts"])
+
+
+class BatchAnalysisRunner:
+    """Полный обход датчиков merged.db: одно чтение на группу столбцов, анализ в пуле процессов."""
+
+    def __init__(self, merged_db_path: str, workers: int = CONFIG["workers"],
+                 max_memory_mb: float = CONFIG["max_memory_mb"], options: Optional[Dict[str, Any]] = None,
+                 logger: logging.Logger = None):
+        self.merged_db_path = merged_db_path
+        self.workers = workers
+        self.max_memory_mb = max_memory_mb
+        self.options = {key: value for key, value in dict(CONFIG, **(options or {})).items()
+                        if key not in ("workers", "max_memory_mb", "fetch_rows", "sensor_pattern")}
+        self.fetch_rows = (options or {}).get("fetch_rows", CONFIG["fetch_rows"])
+        self.logger = logger or logging.getLogger(__name__)
+        self.stats = {"passes": 0, "rows_read": 0, "read_seconds": 0.0, "analysis_seconds": 0.0}
+
+    def _where(self, start_ts: Optional[float], end_ts: Optional[float]) -> Tuple[str, list]:
+        conditions, params = [], []
+        if start_ts is not None:
+            conditions.append(f'"{TIME_COLUMN}" >= ?')
+            params.append(start_ts)
+        if end_ts is not None:
+            conditions.append(f'"{TIME_COLUMN}" <= ?')
+            params.append(end_ts)
+        return (" WHERE " + " AND ".join(conditions)) if conditions else "", params
+
+    def _in_flight(self) -> int:
+        """Сколько задач анализа одновременно держится в памяти."""
+        return self.workers if self.workers and self.workers > 0 else 1
+
+    def _groups(self, rows: int, indices: List[int]) -> List[List[int]]:
+        """Делит столбцы на группы так, чтобы в max_memory_mb помещались таблица группы со столбцом
+        времени и задачи, одновременно переданные в пул (TASK_COLUMNS столбцов на задачу)."""
+        column_bytes = max(rows, 1) * 8
+        budget = int(self.max_memory_mb * 1024 * 1024 // column_bytes)
+        per_group = max(1, budget - 1 - TASK_COLUMNS * self._in_flight())
+        return [indices[i:i + per_group] for i in range(0, len(indices), per_group)]
+
+    def _read_group(self, conn: sqlite3.Connection, rows: int, indices: List[int], where: str,
+                    params: list) -> np.ndarray:
+        """Одним запросом читает время и столбцы группы в массив (строки x (1 + столбцы)), NULL -> NaN."""
+        columns = ", ".join([f'"{TIME_COLUMN}"'] + [f'"data_format_{index}"' for index in indices])
+        cursor = conn.execute(f'SELECT {columns} FROM data{where} ORDER BY "{TIME_COLUMN}"', params)
+        # Массив выделяется сразу под все строки: без склейки кусков пик памяти не удваивается
+        table = np.empty((rows, len(indices) + 1))
+        filled = 0
+        while True:
+            batch = cursor.fetchmany(self.fetch_rows)
+            if not batch:
+                break
+            table[filled:filled + len(batch)] = np.array(batch, dtype=float)
+            filled += len(batch)
+        self.stats["passes"] += 1
+        self.stats["rows_read"] += filled
+        return table[:filled]
+
+    def _tasks(self, table: np.ndarray, group: List[Tuple[str, int]]) -> Iterable[Dict[str, Any]]:
+        times = table[:, 0]
+        for position, (name, index) in enumerate(group, start=1):
+            column = table[:, position]
+            present = ~np.isnan(column) & ~np.isnan(times)
+            yield {"sensor_name": name, "sensor_index": index, "times": times[present], "values": column[present],
+                   "options": self.options}
+
+    def _map(self, executor: Optional[ProcessPoolExecutor], tasks: Iterable[Dict[str, Any]]) -> Iterable[Dict[str, Any]]:
+        """Как executor.map, но задачи создаются и отправляются в пул не больше чем по _in_flight() за раз."""
+        if executor is None:
+            yield from map(analyze_sensor, tasks)
+            return
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(analyze_sensor, task))
+            del task
+            if len(pending) >= self._in_flight():
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def run(self, sensors: Dict[str, int], start_time: Optional[datetime] = None,
+            end_time: Optional[datetime] = None) -> Dict[str, Any]:
+        """Анализирует датчики {имя: индекс} за период и возвращает сводный отчёт."""
+        if not sensors:
+            raise ValueError("Не выбрано ни одного датчика")
+        started = time.perf_counter()
+        start_ts = start_time.timestamp() if start_time else None
+        end_ts = end_time.timestamp() if end_time else None
+        where, params = self._where(start_ts, end_ts)
+        items = list(sensors.items())
+        results: Dict[str, Dict[str, Any]] = {}
+        executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers and self.workers > 0 else None
+        try:
+            with closing(sqlite3.connect(f"file:{self.merged_db_path}?mode=ro", uri=True, timeout=30)) as conn:
+                # Подсчёт и чтение всех групп — в одной транзакции чтения: строки, которые follow_ingestion
+                # дописывает в merged.db во время обхода (WAL), не попадают ни в одну из групп
+                conn.execute("BEGIN")
+                rows = conn.execute(f"SELECT COUNT(*) FROM data{where}", params).fetchone()[0]
+                groups = self._groups(rows, [index for _, index in items])
+                position = 0
+                for group_indices in groups:
+                    group = items[position:position + len(group_indices)]
+                    position += len(group_indices)
+                    read_started = time.perf_counter()
+                    table = self._read_group(conn, rows, group_indices, where, params)
+                    self.stats["read_seconds"] += time.perf_counter() - read_started
+                    analysis_started = time.perf_counter()
+                    for output in self._map(executor, self._tasks(table, group)):
+                        if output["error"]:
+                            self.logger.error("Ошибка анализа датчика %s: %s", output["sensor_name"], output["error"])
+                        results[output["sensor_name"]] = output
+                    self.stats["analysis_seconds"] += time.perf_counter() - analysis_started
+                    del table
+                conn.rollback()
+        except Exception as e:
+            self.logger.error("Ошибка пакетного анализа датчиков: %s", e)
+            self.logger.error("Трассировка стека: %s", traceback.format_exc())
+            raise
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        elapsed = time.perf_counter() - started
+        self.logger.info("Пакетный анализ %d датчиков: %d проход(ов) по данным, %.2f с",
+                         len(results), self.stats["passes"], elapsed)
+        return {
+            "created_at": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+            "source": str(self.merged_db_path),
+            "period": {"start_time": _iso(start_ts) if start_ts is not None else None,
+                       "end_time": _iso(end_ts) if end_ts is not None else None},
+            "options": {key: list(value) if isinstance(value, tuple) else value for key, value in self.options.items()},
+            "run_stats": dict(self.stats, workers=self.workers, seconds=elapsed),
+            "sensors": results,
+        }
+
+
+def save_json(report: Dict[str, Any], path: str) -> str:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def save_sqlite(report: Dict[str, Any], db_path: str) -> int:
+    """Сохраняет отчёт в таблицы analysis_runs и analysis_events; возвращает id запуска."""
+    with sqlite3.connect(db_path, timeout=10) as conn:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS analysis_runs (id INTEGER PRIMARY KEY AUTOINCREMENT, created_at TEXT NOT NULL,"
+            " source TEXT, period TEXT, options TEXT, run_stats TEXT, sensor_stats TEXT)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS analysis_events (run_id INTEGER NOT NULL, sensor_index INTEGER NOT NULL,"
+            " sensor_name TEXT, event_type TEXT NOT NULL, start_ts REAL NOT NULL, end_ts REAL, amplitude REAL,"
+            " details TEXT)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_events_run ON analysis_events(run_id, sensor_index)")
+        sensor_stats = {name: {"points": sensor["points"], "error": sensor.get("error"), **(sensor["stats"] or {})}
+                        for name, sensor in report["sensors"].items()}
+        run_id = conn.execute(
+            "INSERT INTO analysis_runs (created_at, source, period, options, run_stats, sensor_stats)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (report["created_at"], report["source"], json.dumps(report["period"]), json.dumps(report["options"]),
+             json.dumps(report["run_stats"]), json.dumps(sensor_stats, ensure_ascii=False))
+        ).lastrowid
+        rows = []
+        for sensor in report["sensors"].values():
+            for event in sensor["events"]:
+                details = {key: value for key, value in event.items()
+                           if key not in ("type", "start_ts", "end_ts", "start_time", "end_time", "amplitude")}
+                rows.append((run_id, sensor["sensor_index"], sensor["sensor_name"], event["type"], event["start_ts"],
+                             event["end_ts"], event["amplitude"], json.dumps(details, ensure_ascii=False)))
+        conn.executemany("INSERT INTO analysis_events VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    return run_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетный анализ датчиков merged.db")
+    parser.add_argument("merged_db", help="Путь к merged.db")
+    parser.add_argument("--pattern", default=CONFIG["sensor_pattern"], help="Регулярное выражение имён датчиков")
+    parser.add_argument("--workers", type=int, default=CONFIG["workers"])
+    parser.add_argument("--max-memory-mb", type=float, default=CONFIG["max_memory_mb"])
+    parser.add_argument("--json", help="Сохранить отчёт в JSON")
+    parser.add_argument("--sqlite", help="Сохранить отчёт в SQLite")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="- %(levelname)s - %(message)s")
+
+    sensor_info = {}
+    with sqlite3.connect(f"file:{args.merged_db}?mode=ro", uri=True) as conn:
+        for comment, index, _ in conn.execute("SELECT comment, data_format_index, data_type FROM data_format"):
+            for name in (comment or "").split("|"):
+                if name.strip():
+                    sensor_info.setdefault(name.strip(), {"index": int(index)})
+    sensors = sensors_from_info(sensor_info, args.pattern)
+    report = BatchAnalysisRunner(args.merged_db, workers=args.workers, max_memory_mb=args.max_memory_mb).run(sensors)
+    if args.json:
+        save_json(report, args.json)
+    if args.sqlite:
+        save_sqlite(report, args.sqlite)
+    for name, sensor in report["sensors"].items():
+        if sensor["error"]:
+            print(f"{name}: ошибка анализа: {sensor['error']}")
+        else:
+            print(f"{name}: точек {sensor['points']}, событий {len(sensor['events'])}")
+
+
+if __name__ == "__main__":
+    main()
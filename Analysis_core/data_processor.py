@@ -2,7 +2,7 @@ import json
 import random
 from pathlib import Path
 from datetime import datetime, timedelta, timezone
-from typing import List, Optional, Tuple, Union, Dict
+from typing import Callable, List, Optional, Tuple, Union, Dict
 import numpy as np
 import pyqtgraph as pg
 from pyqtgraph import DateAxisItem
@@ -400,7 +400,8 @@ class DataProcessor:
         start_time: Optional[datetime] = None,
         end_time: Optional[datetime] = None,
         output_dir: str = "reports",
-        logger: logging.Logger = None
+        logger: logging.Logger = None,
+        progress: Optional[Callable[[str, int, int], None]] = None
     ) -> Tuple[List[Path], Path, Path]:
         """
         Генерирует отчёт с 5 фиксированными графиками (LS01, T01, P11, T06, P12).
@@ -411,6 +412,8 @@ class DataProcessor:
             end_time: datetime (UTC)
             output_dir: Папка для графиков и отчётов
             logger: Логгер
+            progress: progress(этап, сделано, всего) — вызывается перед каждым графиком и
+                вокруг сборки PDF/DOCX; исключение из него прерывает генерацию (отмена задачи)
         Returns:
             (plot_paths, pdf_path, Path)
         """
@@ -430,11 +433,14 @@ class DataProcessor:
         ]
         plot_paths = []
         image_paths_dict = {}
+        total_plots = len(FIXED_SENSORS) + 1  # + SUM_BALLS
+        report_progress = progress or (lambda stage, done, total: None)
         try:
             reader = self.reader
             sensor_info = reader.get_sensor_info()
             # === 1. Строим 5 графиков ===
             for idx, (sensor_name, description, y_label, y_units) in enumerate(FIXED_SENSORS, start=1):
+                report_progress("plot", idx - 1, total_plots)
                 if sensor_name not in sensor_info:
                     logger.warning(f"Датчик {sensor_name} не найден — пропуск")
                     plot_paths.append(None)
@@ -499,6 +505,7 @@ class DataProcessor:
                 ]
             }
             # === 5. Генерация отчёта ===
+            report_progress("report", 0, 1)
             full_data = self.build_report_data(minimal_data)
             start_short = start_local.strftime("%d%m%y")
             end_short = end_local.strftime("%d%m%y")
@@ -512,8 +519,10 @@ class DataProcessor:
             )
             logger.info(f"PDF: {pdf_out}")
             logger.info(f"DOCX: {docx_out}")
+            report_progress("report", 1, 1)
             # === 6. Дополнительный график SUM_BALLS ===
             sum_balls_sensor_name = "SUM_BALLS"
+            report_progress("plot", len(FIXED_SENSORS), total_plots)
             if sum_balls_sensor_name in sensor_info:
                 sensor = sensor_info[sum_balls_sensor_name]
                 logger.debug("Получение данных для: %s", sum_balls_sensor_name)
@@ -543,6 +552,7 @@ class DataProcessor:
             else:
                 logger.warning(f"Датчик {sum_balls_sensor_name} не найден — пропуск")
                 plot_paths.append(None)
+            report_progress("plot", total_plots, total_plots)
             return plot_paths, Path(pdf_out), Path(docx_out)
         except Exception as e:
             logger.error(f"Ошибка в generate_report: {e}")
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 import sqlite3
-from typing import List, Dict, Any, Tuple, Iterator, Optional, Union
+from typing import List, Dict, Any, Tuple, Iterator, Optional, Union, Callable
 from pathlib import Path
 from datetime import datetime
 from dateutil.tz import tzutc
@@ -26,13 +26,19 @@ from datetime import datetime
 import logging
 import os
 
+from Utils.sensor_index import SensorIndex
+
 
 
 class DatabaseMerger:
-    def __init__(self, folder_path: str, merged_db_path: str = "merged.db", logger=None):
+    def __init__(self, folder_path: str, merged_db_path: str = "merged.db", logger=None,
+                 on_rows: Optional[Callable[[List[str], List[tuple]], Any]] = None):
         self.folder_path = Path(folder_path)
         self.merged_db_path = Path(merged_db_path)
         self.logger = logger or logging.getLogger(__name__)
+        # on_rows(колонки, строки) вызывается для каждого пакета после commit файла (потоковый анализ)
+        self.on_rows = on_rows
+        self.last_merged_rows = 0
 
         self.index_mapping = {}
         self.global_to_names = defaultdict(set)
@@ -213,11 +219,13 @@ class DatabaseMerger:
                     src.close()
                     continue
 
-                query = f"SELECT {', '.join(select_parts)} FROM data {where_clause}"
+                # Порядок по времени нужен подписчику on_rows: потоковый анализ отбрасывает строки старше обработанных
+                query = f"SELECT {', '.join(select_parts)} FROM data {where_clause} ORDER BY [time@timestamp]"
                 src_cur.execute(query, params)
 
                 batch_size = 10000
                 batch = src_cur.fetchmany(batch_size)
+                written: List[List[tuple]] = []  # Пакеты для on_rows: подписчик видит строки только после commit
 
                 while batch:
                     dst.executemany(
@@ -225,9 +233,13 @@ class DatabaseMerger:
                         batch
                     )
                     total_new_rows += len(batch)
+                    if self.on_rows is not None:
+                        written.append(batch)
                     batch = src_cur.fetchmany(batch_size)
 
                 dst.commit()
+                for batch in written:
+                    self._notify_rows(placeholders, batch)
 
                 # Обновляем состояние
                 row_count = src.execute("SELECT COUNT(*) FROM data").fetchone()[0]
@@ -265,8 +277,19 @@ class DatabaseMerger:
             if 'dst' in locals():
                 dst.close()
 
+        self.last_merged_rows = total_new_rows
         return self.merged_db_path
 
+    def _notify_rows(self, placeholders: List[str], batch: List[tuple]) -> None:
+        """Передаёт записанный пакет подписчику; его ошибки не прерывают объединение."""
+        if self.on_rows is None:
+            return
+        try:
+            self.on_rows([p.strip('"') for p in placeholders], batch)
+        except Exception as e:
+            self.logger.error("Ошибка обработчика новых строк: %s", e)
+            self.logger.error("Трассировка стека: %s", traceback.format_exc())
+
     # Вспомогательный метод для финализации (чтобы не дублировать код)
     def _finalize_temp_db(self, temp_db: Path):
         self.logger.info("Финализируем merged.db: сбрасываем WAL и заменяем файл")
@@ -416,22 +439,65 @@ class DatabaseMerger:
 
 
 
+SENSOR_INFO_LAYOUT = 2  # Компактная раскладка sensor_info в кеше: общая запись на индекс + алиасы
+
+
+def pack_sensor_info(sensor_info: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Сжимает sensor_info для кеша: поля, общие для всех алиасов одного датчика, хранятся один раз."""
+    records: List[Dict[str, Any]] = []
+    positions: Dict[str, int] = {}
+    aliases: Dict[str, int] = {}
+    for name, sensor in sensor_info.items():
+        record = {field: value for field, value in sensor.items() if field != "sensor_name"}
+        key = repr(sorted(record.items()))
+        if key not in positions:
+            positions[key] = len(records)
+            records.append(record)
+        aliases[name] = positions[key]
+    return {"layout": SENSOR_INFO_LAYOUT, "records": records, "aliases": aliases}
+
+
+def unpack_sensor_info(packed: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Восстанавливает sensor_info из раскладки pack_sensor_info; списки алиасов одного датчика общие."""
+    if packed.get("layout") != SENSOR_INFO_LAYOUT:
+        return packed  # Прежний формат: словарь name -> sensor
+    records = packed["records"]
+    return {name: {"sensor_name": name, **records[pos]} for name, pos in packed["aliases"].items()}
+
+
 class DataReader:
     """Класс для чтения данных из баз SQLite с использованием HistoryManager для кэширования."""
 
-    def __init__(self, folder_path: str, history_manager=None, debug_mode: bool = False, logger: logging.Logger = None):
+    def __init__(self, folder_path: str, history_manager=None, debug_mode: bool = False, logger: logging.Logger = None,
+                 anomaly_engine=None):
         """Инициализация DataReader."""
         self.folder_path: Path = Path(folder_path)
         self.debug_mode: bool = debug_mode
         self.logger = logger or logging.getLogger(__name__)
         self.history_manager = history_manager  # Добавляем HistoryManager
+        # StreamingAnomalyEngine: получает строки, дописываемые в merged.db
+        self.anomaly_engine = anomaly_engine
         self.db_files: List[Path] = []
         self.sensor_info: Dict[str, Dict[str, Any]] = {}  # Dict[name -> sensor]
+        self._sensor_info_cached: Optional[Dict[str, Any]] = None  # Объект из кеша, из которого развёрнут sensor_info
+        self._sensor_index: Optional[SensorIndex] = None
+        self._sensor_index_names: Tuple[str, ...] = ()
         self.time_period: Dict[str, str] = {"start_time": None, "end_time": None}
         self.bytes_per_row = 32
         self.logger.debug("Инициализация DataReader с путем: %s", folder_path)
+        if self.history_manager:
+            self.history_manager.add_cache_invalidation_hook(self._on_cache_invalidated)
         self._initialize()
 
+    def _on_cache_invalidated(self, key: Optional[str]) -> None:
+        """Сбрасывает локальные копии при явной инвалидации кеша HistoryManager."""
+        if key in (None, "sensor_info"):
+            self.sensor_info = {}
+            self._sensor_info_cached = None
+            self.logger.debug("Локальный sensor_info сброшен после инвалидации кеша")
+        if key in (None, "time_period"):
+            self.time_period = {"start_time": None, "end_time": None}
+
     def _initialize(self) -> None:
         """Инициализация настроек."""
         try:
@@ -453,7 +519,7 @@ class DataReader:
 
             if need_rebuild:
                 self.logger.info("Запуск объединения всех .db файлов в один merged.db...")
-                merger = DatabaseMerger(self.folder_path, merged_db_path, logger=self.logger)
+                merger = DatabaseMerger(self.folder_path, merged_db_path, logger=self.logger, on_rows=self._on_rows)
                 merger.merge_databases(force_rebuild=True)
                 self.logger.info("Объединение успешно завершено!")
 
@@ -472,6 +538,32 @@ class DataReader:
             self.logger.error("Трассировка стека: %s", traceback.format_exc())
             raise 
 
+    def _on_rows(self, columns: List[str], rows: List[tuple]) -> None:
+        if self.anomaly_engine is not None:
+            self.anomaly_engine.consume(columns, rows)
+
+    def refresh(self) -> int:
+        """Дописывает в merged.db новые строки исходных баз; возвращает их число.
+
+        Новые строки сразу получает anomaly_engine, кеш временного периода сбрасывается.
+        """
+        merged_db_path = self.folder_path / "merged.db"
+        merger = DatabaseMerger(self.folder_path, merged_db_path, logger=self.logger, on_rows=self._on_rows)
+        if merger._is_merge_up_to_date():
+            return 0
+        try:
+            merger.merge_databases()
+        except Exception as e:
+            self.logger.error("Ошибка дозаписи merged.db: %s", e)
+            self.logger.error("Трассировка стека: %s", traceback.format_exc())
+            raise
+        if merger.last_merged_rows:
+            self.time_period = {"start_time": None, "end_time": None}
+            if self.history_manager:
+                self.history_manager.clear_cache("time_period")
+            self.logger.info("merged.db дополнена: %d новых строк", merger.last_merged_rows)
+        return merger.last_merged_rows
+
     def _load_db_files(self) -> None:
         """Загрузка файлов .db."""
         self.logger.debug("Загрузка файлов .db из %s", self.folder_path)
@@ -580,13 +672,15 @@ class DataReader:
         """Получение информации о датчиках — упрощённая версия для merged.db"""
         self.logger.debug("Получение информации о датчиках (режим merged.db)")
 
-        # Кэширование через HistoryManager
+        # Кэширование через HistoryManager: повторные вызовы обслуживает его кеш в памяти
         if self.history_manager:
             cached = self.history_manager.get_cache("sensor_info")
             if cached:
-                self.sensor_info = cached
-                self.logger.debug("sensor_info загружен из кэша HistoryManager: %d датчиков", len(cached))
-                return cached
+                if cached is not self._sensor_info_cached:
+                    self.sensor_info = unpack_sensor_info(cached)
+                    self._sensor_info_cached = cached
+                    self.logger.debug("sensor_info загружен из кэша HistoryManager: %d датчиков", len(self.sensor_info))
+                return self.sensor_info
 
         if self.sensor_info:
             return self.sensor_info
@@ -626,11 +720,22 @@ class DataReader:
 
         # Сохраняем в кэш
         if self.history_manager:
-            self.history_manager.set_cache("sensor_info", self.sensor_info, ttl_seconds=86400)
+            packed = pack_sensor_info(self.sensor_info)
+            self.history_manager.set_cache("sensor_info", packed, ttl_seconds=86400)
+            self._sensor_info_cached = packed
 
         self.logger.debug("Загружено %d уникальных имён датчиков из merged.db", len(self.sensor_info))
         return self.sensor_info
 
+    def get_sensor_index(self) -> SensorIndex:
+        """Индекс для нечёткого поиска датчиков; перестраивается только при изменении набора имён."""
+        sensor_info = self.get_sensor_info()
+        names = tuple(sensor_info)
+        if self._sensor_index is None or names != self._sensor_index_names:
+            self._sensor_index = SensorIndex(sensor_info, logger=self.logger)
+            self._sensor_index_names = names
+        return self._sensor_index
+
 
     def get_data_stream(self, sensor_name: str, start_time: Optional[datetime] = None, end_time: Optional[datetime] = None) -> Union[Iterator[Tuple[List[datetime], List[float]]], Tuple[List[datetime], List[float]]]:
         """Получение потоков данных для датчика по имени (оригинальный интерфейс для новых вызовов)."""
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""Векторные детекторы событий временного ряда: глюки, отогрев, аномалии, переходы между уровнями.
+
+Функции работают с массивами NumPy и возвращают индексы событий; построение графиков и
+оформление результатов остаются на стороне Analyzer / AnomalyDetector. Результаты совпадают
+с прежними поэлементными циклами, включая обработку NaN.
+"""
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+def runs(mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Серии подряд идущих True: массивы индексов начала и конца (включительно)."""
+    mask = np.asarray(mask, dtype=bool)
+    if not mask.size:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    edges = np.diff(mask.astype(np.int8), prepend=np.int8(0), append=np.int8(0))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1) - 1
+
+
+def mask_from_spans(length: int, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Маска, True на полуинтервалах [start, end)."""
+    delta = np.zeros(length + 1, dtype=np.int64)
+    np.add.at(delta, np.asarray(starts, dtype=np.intp), 1)
+    np.add.at(delta, np.asarray(ends, dtype=np.intp), -1)
+    return np.cumsum(delta[:-1]) > 0
+
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """Среднее по окнам values[i:i + window] для i = 0..len - window через накопленные суммы.
+
+    Окна с NaN дают NaN, как np.mean на срезе.
+    """
+    values = np.asarray(values, dtype=float)
+    nan = np.isnan(values)
+    sums = np.concatenate(([0.0], np.cumsum(np.where(nan, 0.0, values))))
+    nans = np.concatenate(([0], np.cumsum(nan)))
+    means = (sums[window:] - sums[:-window]) / window
+    means[(nans[window:] - nans[:-window]) > 0] = np.nan
+    return means
+
+
+def _next_after(points: np.ndarray, positions: np.ndarray, missing) -> np.ndarray:
+    """Для каждой позиции — первая точка из отсортированного points строго после неё (или missing)."""
+    found = np.searchsorted(points, positions, side="right")
+    if not points.size:
+        return np.broadcast_to(missing, positions.shape).copy()
+    return np.where(found < points.size, points[np.minimum(found, points.size - 1)], missing)
+
+
+def _last_before(points: np.ndarray, positions: np.ndarray, missing) -> np.ndarray:
+    """Для каждой позиции — последняя точка из отсортированного points строго до неё (или missing)."""
+    found = np.searchsorted(points, positions, side="left") - 1
+    if not points.size:
+        return np.broadcast_to(missing, positions.shape).copy()
+    return np.where(found >= 0, points[np.maximum(found, 0)], missing)
+
+
+def find_glitches(values: np.ndarray, threshold_delta: float, max_glitch_points: int,
+                  return_tolerance: float = 5) -> List[Tuple[int, int, int]]:
+    """Кратковременные выбросы: скачок больше threshold_delta и возврат не позже max_glitch_points точек.
+
+    Возвращает (номер скачка, начало, конец): точки [начало, конец) — глюк, конец — первая точка
+    после возврата. Номер скачка — порядковый номер среди всех скачков (для имён файлов).
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    jumps = np.flatnonzero(np.abs(np.diff(values)) > threshold_delta) + 1
+    if not jumps.size or max_glitch_points < 0:
+        return []
+    base = values[jumps - 1]
+    # Окно поиска возврата для каждого скачка: jumps[k] .. jumps[k] + max_glitch_points
+    offsets = np.arange(max_glitch_points + 1)
+    index = jumps[:, None] + offsets[None, :]
+    inside = index < n
+    window = values[np.minimum(index, n - 1)]
+    # «Вернулся» — всё, что не дальше порога (NaN тоже останавливает поиск, как в исходном цикле)
+    stopped = inside & ~(np.abs(window - base[:, None]) > threshold_delta)
+    found = stopped.any(axis=1)
+    ends = jumps + np.argmax(stopped, axis=1)
+    ok = found & (np.abs(values[np.minimum(ends, n - 1)] - base) <= return_tolerance)
+    numbers = np.flatnonzero(ok)
+    return [(int(k), int(jumps[k]), int(ends[k])) for k in numbers]
+
+
+def find_warming(values: np.ndarray, baseline: float, warm_threshold: float, sustain_threshold: float,
+                 hold_points: int, tolerance: float = 0.1) -> Tuple[Optional[int], Optional[int]]:
+    """Начало отогрева.
+
+    Возвращает (индекс первой точки >= warm_threshold, за которой среднее hold_points точек
+    >= sustain_threshold; индекс последней перед ней точки в пределах tolerance от baseline).
+    Любой элемент может быть None.
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    if hold_points <= 0 or n - hold_points <= 0:
+        return None, None
+    means = rolling_mean(values, hold_points)[:n - hold_points]
+    # Накопленные суммы дают погрешность округления: отбираем кандидатов с запасом
+    # и проверяем их точно тем же np.mean, что и раньше
+    slack = n * np.finfo(float).eps * np.nansum(np.abs(values)) / hold_points
+    candidates = np.flatnonzero((values[:n - hold_points] >= warm_threshold) & (means >= sustain_threshold - slack))
+    start = next(
+        (int(i) for i in candidates if np.mean(values[i:i + hold_points]) >= sustain_threshold), None
+    )
+    if start is None:
+        return None, None
+    near = np.flatnonzero(np.abs(values[:start + 1] - baseline) <= tolerance)
+    return start, (int(near[-1]) if near.size else None)
+
+
+def find_anomalies(values: np.ndarray, baseline: float, jump_threshold: float,
+                   return_threshold: float) -> List[Tuple[int, int, int]]:
+    """Отклонения от baseline не меньше jump_threshold.
+
+    Для каждой серии таких точек возвращает (начало, пик, конец). Начало — последняя точка перед
+    пиком в пределах return_threshold от baseline, конец — первая такая точка после пика.
+    """
+    values = np.asarray(values, dtype=float)
+    deviations = np.abs(values - baseline)
+    run_starts, run_ends = runs(deviations >= jump_threshold)
+    if not run_starts.size:
+        return []
+    points = np.flatnonzero(deviations >= jump_threshold)
+    offsets = np.concatenate(([0], np.cumsum(run_ends - run_starts + 1)[:-1]))
+    peaks_value = np.maximum.reduceat(values[points], offsets)
+    # Первая точка серии, где достигается максимум (как np.argmax)
+    is_peak = values[points] == np.repeat(peaks_value, run_ends - run_starts + 1)
+    peaks = np.minimum.reduceat(np.where(is_peak, points, len(values)), offsets)
+
+    returns = np.flatnonzero(deviations <= return_threshold)
+    starts = _last_before(returns, peaks, missing=run_starts)
+    ends = _next_after(returns, peaks, missing=peaks)
+    return [(int(s), int(p), int(e)) for s, p, e in zip(starts, peaks, ends)]
+
+
+def nearest_level(values: np.ndarray, levels) -> Tuple[np.ndarray, np.ndarray]:
+    """Ближайший уровень для каждой точки и расстояние до него; при равенстве — меньший уровень."""
+    values = np.asarray(values, dtype=float)
+    levels = np.asarray(sorted(levels), dtype=float)
+    right = np.clip(np.searchsorted(levels, values), 0, len(levels) - 1)
+    left = np.clip(right - 1, 0, len(levels) - 1)
+    use_left = np.abs(values - levels[left]) <= np.abs(values - levels[right])
+    nearest = np.where(use_left, levels[left], levels[right])
+    return nearest, np.abs(values - nearest)
+
+
+def _trailing_mean(values: np.ndarray, points: int) -> np.ndarray:
+    """Среднее values[max(0, i - points):i + 1] для каждого i; окна с NaN дают NaN."""
+    nan = np.isnan(values)
+    sums = np.concatenate(([0.0], np.cumsum(np.where(nan, 0.0, values))))
+    nans = np.concatenate(([0], np.cumsum(nan)))
+    index = np.arange(len(values))
+    left = np.maximum(0, index - points)
+    means = (sums[index + 1] - sums[left]) / (index + 1 - left)
+    means[(nans[index + 1] - nans[left]) > 0] = np.nan
+    return means
+
+
+def find_transitions(values: np.ndarray, levels, tolerance: float, min_points: int,
+                     settle_points: int = 10) -> List[Tuple[int, int]]:
+    """Переходы между рабочими уровнями: (начало, конец).
+
+    Переход начинается скачком больше tolerance из точки на уровне и заканчивается не раньше чем
+    через min_points точек в точке на уровне, близкой к среднему последних settle_points + 1 точек.
+    Конечный автомат идёт по индексам событий, а не по каждой точке.
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    if n < 2:
+        return []
+    nearest, distance = nearest_level(values, levels)
+    # Уровень 0 в исходной проверке считался «нет уровня» (проверка на истинность)
+    on_level = (distance <= tolerance) & (nearest != 0)
+    jumps = np.abs(np.diff(values)) > tolerance
+    # Итерация i начинает переход, если точка i - 1 на уровне и скачок к i больше tolerance
+    start_iterations = np.flatnonzero(on_level[:-1] & jumps) + 1
+    # Кандидаты в концы с запасом на погрешность накопленных сумм; точная проверка — ниже
+    trailing = _trailing_mean(values, settle_points)
+    slack = n * np.finfo(float).eps * np.nansum(np.abs(values))
+    end_candidates = np.flatnonzero(on_level & (np.abs(values - trailing) < tolerance + slack))
+    end_candidates = end_candidates[end_candidates >= 1]
+
+    transitions = []
+    position = 1
+    while True:
+        k = np.searchsorted(start_iterations, position)
+        if k == len(start_iterations):
+            break
+        start = int(start_iterations[k]) - 1
+        end = None
+        c = np.searchsorted(end_candidates, start + max(2, min_points))
+        while c < len(end_candidates):
+            i = int(end_candidates[c])
+            if abs(values[i] - values[max(0, i - settle_points):i + 1].mean()) < tolerance:
+                end = i
+                break
+            c += 1
+        if end is None:
+            break
+        transitions.append((start, end))
+        position = end + 1
+    return transitions
+
+
+def find_zscore_anomalies(values: np.ndarray, z_threshold: float, window_size: int, peak_delta: float = 30,
+                          lower: float = 0, upper: float = 350) -> Tuple[List[Tuple[int, int]], np.ndarray]:
+    """Участки с |z| > z_threshold относительно скользящего среднего, резким скачком или выходом за пределы.
+
+    Возвращает список (начало, конец) — конец в первой точке, где все условия сняты, — и скользящее
+    среднее (база для амплитуды).
+    """
+    values = np.asarray(values, dtype=float)
+    window = np.ones(window_size) / window_size
+    rolling = np.convolve(values, window, mode='valid')
+    rolling_std = np.sqrt(np.convolve((values - np.convolve(values, window, mode='same'))**2, window, mode='valid') / window_size)
+    pad_left = (window_size - 1) // 2
+    pad_right = window_size - 1 - pad_left
+    rolling = np.pad(rolling, (pad_left, pad_right), mode='edge')
+    rolling_std = np.pad(rolling_std, (pad_left, pad_right), mode='edge')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z_scores = np.abs((values - rolling) / rolling_std)
+
+    is_peak = np.concatenate(([False], np.abs(np.diff(values)) > peak_delta))
+    is_outside = (values < lower) | (values > upper)
+    triggers = np.flatnonzero((z_scores > z_threshold) | is_peak | is_outside)
+    releases = np.flatnonzero((z_scores < z_threshold) & ~is_peak & ~is_outside)
+
+    if not triggers.size:
+        return [], rolling
+    # Конец участка — первое снятие условий после его начала. Точка не бывает одновременно
+    # срабатыванием и снятием, поэтому срабатывание открывает новый участок, только если
+    # предыдущее срабатывание уже закрылось раньше него
+    ends = _next_after(releases, triggers, missing=-1)
+    opens = np.concatenate(([True], (ends[:-1] >= 0) & (ends[:-1] < triggers[1:])))
+    closed = opens & (ends >= 0)
+    return [(int(a), int(b)) for a, b in zip(triggers[closed], ends[closed])], rolling
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Отрисовка миниатюр событий (глюки, аномалии, переходы) отдельно от их обнаружения.
+
+Детекторы Analyzer / AnomalyDetector только описывают график — задание с фрагментом ряда,
+выделенным интервалом и подписями, — а EventPlotRenderer рисует задания пачкой в пуле процессов.
+Рисование идёт через Figure и FigureCanvasAgg без pyplot: не зависит от выбранного в скрипте
+интерактивного backend (TkAgg) и не трогает глобальное состояние pyplot. В ленивом режиме
+задания копятся и рисуются только по запросу (ensure) или при flush().
+"""
+import logging
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+CONFIG = {
+    "workers": min(4, os.cpu_count() or 1),     # 0 — рисовать в текущем процессе
+    "lazy": False,                              # True — рисовать только по запросу
+    "figsize": (8, 4),
+    "dpi": 100,
+}
+
+
+def window(times: np.ndarray, start: Any, end: Any, padding: timedelta) -> slice:
+    """Срез отсортированного times от start - padding до end + padding включительно (бинарный поиск)."""
+    lo = np.searchsorted(times, start - padding, side="left")
+    hi = np.searchsorted(times, end + padding, side="right")
+    return slice(int(lo), int(hi))
+
+
+def plot_job(path: str, times: np.ndarray, values: np.ndarray, title: str, label: str,
+             span: Optional[tuple] = None, span_color: str = "red", marker: Any = None, marker_color: str = "green",
+             color: str = "blue", ylabel: str = "Температура (К)", legend_loc: str = "best") -> Dict[str, Any]:
+    """Описание миниатюры события: только данные, без обращения к matplotlib."""
+    return {
+        "path": path, "times": np.asarray(times), "values": np.asarray(values), "title": title, "label": label,
+        "span": span, "span_color": span_color, "marker": marker, "marker_color": marker_color,
+        "color": color, "ylabel": ylabel, "legend_loc": legend_loc,
+    }
+
+
+def render_plot(job: Dict[str, Any]) -> str:
+    """Рисует одно задание в PNG; выполняется в процессе пула."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    import matplotlib.dates as mdates
+
+    fig = Figure(figsize=CONFIG["figsize"], dpi=CONFIG["dpi"])
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.plot(job["times"], job["values"], label=job["label"], color=job["color"])
+    if job["span"] is not None:
+        ax.axvspan(job["span"][0], job["span"][1], color=job["span_color"], alpha=0.3)
+    if job["marker"] is not None:
+        ax.axvline(job["marker"], color=job["marker_color"], linestyle='--')
+    ax.set_xlabel("Время")
+    ax.set_ylabel(job["ylabel"])
+    ax.set_title(job["title"])
+    ax.grid(True)
+    ax.legend(loc=job["legend_loc"])
+    locator = mdates.AutoDateLocator()
+    formatter = mdates.AutoDateFormatter(locator)
+    formatter.scaled[1/24] = '%H:%M'
+    formatter.scaled[1] = '%d %b %H:%M'
+    ax.xaxis.set_major_locator(locator)
+    ax.xaxis.set_major_formatter(formatter)
+    for tick in ax.get_xticklabels():
+        tick.set_rotation(45)
+    fig.tight_layout()
+    os.makedirs(os.path.dirname(job["path"]) or ".", exist_ok=True)
+    fig.savefig(job["path"])
+    return job["path"]
+
+
+class EventPlotRenderer:
+    """Очередь миниатюр событий: пачкой в пуле процессов или лениво, по одной по запросу."""
+
+    def __init__(self, workers: int = CONFIG["workers"], lazy: bool = CONFIG["lazy"], logger: logging.Logger = None):
+        self.workers = workers
+        self.lazy = lazy
+        self.logger = logger or logging.getLogger(__name__)
+        self._pending: Dict[str, Dict[str, Any]] = {}
+
+    def submit(self, job: Dict[str, Any]) -> str:
+        """Ставит задание в очередь и возвращает путь, по которому появится файл."""
+        self._pending[job["path"]] = job
+        return job["path"]
+
+    @property
+    def pending(self) -> List[str]:
+        return list(self._pending)
+
+    def ensure(self, path: str) -> Optional[str]:
+        """Рисует отложенное задание path, если файла ещё нет; None — задание неизвестно."""
+        job = self._pending.pop(path, None)
+        if job is None:
+            return path if os.path.exists(path) else None
+        return render_plot(job)
+
+    def flush(self) -> List[str]:
+        """Рисует все отложенные задания; в ленивом режиме ничего не делает."""
+        if self.lazy or not self._pending:
+            return []
+        return self.render(self._pending.pop(path) for path in list(self._pending))
+
+    def render(self, jobs: Iterable[Dict[str, Any]]) -> List[str]:
+        jobs = list(jobs)
+        if not jobs:
+            return []
+        try:
+            if self.workers and self.workers > 1 and len(jobs) > 1:
+                with ProcessPoolExecutor(max_workers=min(self.workers, len(jobs))) as executor:
+                    paths = list(executor.map(render_plot, jobs))
+            else:
+                paths = [render_plot(job) for job in jobs]
+        except Exception as e:
+            self.logger.error("Ошибка отрисовки графиков событий: %s", e)
+            self.logger.error("Трассировка стека: %s", traceback.format_exc())
+            raise
+        self.logger.debug("Нарисовано графиков событий: %d", len(paths))
+        return paths
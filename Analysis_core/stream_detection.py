@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+"""Потоковое обнаружение событий по мере дозаписи строк в merged.db.
+
+В отличие от Analyzer / AnomalyDetector, которые перечитывают всю историю, движок получает только
+новые строки от DatabaseMerger и держит на каждый датчик небольшое состояние: скользящие
+статистики (Уэлфорд, EWMA) и конечные автоматы глюков, переходов между уровнями и аномалий.
+События сразу пишутся в таблицу events, состояние — в stream_state, так что после перезапуска
+анализ продолжается с последней обработанной метки времени.
+"""
+import copy
+import json
+import logging
+import math
+import sqlite3
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+CONFIG = {
+    "ewma_alpha": 0.05,             # Вес новой точки в EWMA среднего и дисперсии
+    "warmup_points": 30,            # Точек до первой проверки z-оценки
+    "z_threshold": 5.0,             # Как в AnomalyDetector.detect_general_anomalies
+    "min_std": 0.1,                 # Нижняя граница σ: почти постоянный сигнал не даёт ложных z
+    "bounds": None,                 # (нижняя, верхняя): значения вне пределов — аномалия сразу
+    "glitch_delta": 50.0,           # Скачок, после которого точки проверяются на глюк
+    "glitch_max_seconds": 10.0,     # Глюк — возврат не позже чем через столько секунд
+    "glitch_return_tolerance": 5.0,
+    "levels": (20.0, 80.0, 300.0),  # Рабочие уровни для переходов (как detect_transitions)
+    "level_tolerance": 10.0,
+    "transition_min_seconds": 300.0,
+    "settle_points": 10,            # Конец перехода — точка у уровня, близкая к среднему последних точек
+    "sensor_overrides": {},         # Индекс датчика -> ключи выше, заменяющие общие значения
+    "query_limit": 50,
+}
+
+TIME_COLUMN = "time@timestamp"
+SENSOR_PREFIX = "data_format_"
+GLITCH, TRANSITION, ANOMALY = "glitch", "transition", "anomaly"
+EVENT_TYPES = (GLITCH, TRANSITION, ANOMALY)
+
+
+class _SensorState:
+    """Состояние одного датчика между пакетами строк; сериализуется в JSON для stream_state."""
+
+    __slots__ = ("last_ts", "prev", "prev_ts", "prev_level", "count", "mean", "m2", "ewma", "ewvar", "ew_count",
+                 "recent", "glitch", "transition", "anomaly")
+
+    def __init__(self, settle_points: int):
+        self.last_ts: Optional[float] = None      # Последняя метка времени (включая точки глюка)
+        self.prev: Optional[float] = None         # Последнее принятое значение
+        self.prev_ts: Optional[float] = None
+        self.prev_level: Optional[float] = None   # Уровень, на котором была предыдущая точка
+        self.count = 0                            # Уэлфорд: число точек, среднее, сумма квадратов отклонений
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.ewma = 0.0
+        self.ewvar = 0.0
+        self.ew_count = 0
+        self.recent = deque(maxlen=settle_points + 1)
+        self.glitch: Optional[Dict[str, Any]] = None      # Подозрение на глюк: база, пик, отложенные точки
+        self.transition: Optional[Dict[str, Any]] = None  # Начатый переход
+        self.anomaly: Optional[Dict[str, Any]] = None     # Открытая аномалия (id строки в events)
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        state = {name: getattr(self, name) for name in self.__slots__}
+        state["recent"] = list(self.recent)
+        return state
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], settle_points: int) -> "_SensorState":
+        state = cls(settle_points)
+        for name in cls.__slots__:
+            if name == "recent":
+                state.recent.extend(data.get("recent", []))
+            elif name in data:
+                setattr(state, name, data[name])
+        return state
+
+
+class StreamingAnomalyEngine:
+    """Инкрементальный детектор глюков, переходов и аномалий по новым строкам merged.db.
+
+    consume(columns, rows) принимает пакет строк в раскладке DatabaseMerger ("time@timestamp",
+    "data_format_N", ...). Строки с меткой не новее уже обработанной для датчика пропускаются,
+    поэтому повторная подача тех же данных (полная пересборка merged.db) событий не дублирует.
+    Аномалия записывается в момент начала (end_ts пустой) и закрывается, когда сигнал вернулся.
+    """
+
+    def __init__(self, db_path: str, config: Optional[Dict[str, Any]] = None, logger: logging.Logger = None):
+        self.db_path = db_path
+        self.config = dict(CONFIG, **(config or {}))
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._states: Dict[int, _SensorState] = {}
+        self._options: Dict[int, Dict[str, Any]] = {}
+        self._stats = Counter()
+        with self._connection() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sensor_index INTEGER NOT NULL,
+                    event_type TEXT NOT NULL,
+                    start_ts REAL NOT NULL,
+                    end_ts REAL,
+                    amplitude REAL,
+                    details TEXT,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_events_sensor ON events(sensor_index, start_ts)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_events_start ON events(start_ts)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS stream_state (sensor_index INTEGER PRIMARY KEY, state TEXT NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            for sensor_index, state in conn.execute("SELECT sensor_index, state FROM stream_state"):
+                options = self._sensor_options(sensor_index)
+                self._states[sensor_index] = _SensorState.from_dict(json.loads(state), options["settle_points"])
+        self.logger.debug("StreamingAnomalyEngine инициализирован: %s, состояний датчиков: %d", db_path, len(self._states))
+
+    def _get_connection(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        conn = self._get_connection()
+        try:
+            with self._lock, conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _sensor_options(self, sensor_index: int) -> Dict[str, Any]:
+        options = self._options.get(sensor_index)
+        if options is None:
+            overrides = self.config["sensor_overrides"]
+            options = dict(self.config, **overrides.get(sensor_index, overrides.get(str(sensor_index), {})))
+            self._options[sensor_index] = options
+        return options
+
+    # --- Приём строк -----------------------------------------------------------------------
+
+    def consume(self, columns: Sequence[str], rows: Iterable[Sequence[Any]]) -> int:
+        """Обрабатывает пакет строк merged.db; возвращает число новых событий."""
+        columns = [column.strip('"') for column in columns]
+        if TIME_COLUMN not in columns:
+            raise ValueError(f"В пакете нет колонки {TIME_COLUMN}")
+        time_pos = columns.index(TIME_COLUMN)
+        sensors = []
+        for pos, column in enumerate(columns):
+            if column.startswith(SENSOR_PREFIX):
+                try:
+                    sensors.append((pos, int(column[len(SENSOR_PREFIX):])))
+                except ValueError:
+                    continue
+        rows = rows if isinstance(rows, list) else list(rows)
+        before = self._stats["events"]
+        stats = self._stats.copy()
+        # Пакет обрабатывается на копиях состояний: они заменяют текущие только после фиксации транзакции,
+        # иначе при откате (например, "database is locked") память ушла бы вперёд базы
+        working: Dict[int, _SensorState] = {}
+        try:
+            with self._connection() as conn:
+                for pos, sensor_index in sensors:
+                    points = [(row[time_pos], row[pos]) for row in rows
+                              if row[pos] is not None and row[time_pos] is not None]
+                    if points:
+                        working[sensor_index] = self._consume_sensor(conn, sensor_index, points)
+                now = time.time()
+                for sensor_index, state in working.items():
+                    if state.anomaly:
+                        conn.execute("UPDATE events SET amplitude = ?, details = ? WHERE id = ?",
+                                     (state.anomaly["amplitude"], json.dumps(self._anomaly_details(state.anomaly)),
+                                      state.anomaly["id"]))
+                    conn.execute("INSERT OR REPLACE INTO stream_state (sensor_index, state, updated_at) VALUES (?, ?, ?)",
+                                 (sensor_index, json.dumps(state.to_dict()), now))
+        except Exception as e:
+            self._stats = stats
+            self.logger.error("Ошибка потокового анализа пакета строк: %s", e)
+            self.logger.error("Трассировка стека: %s", traceback.format_exc())
+            raise
+        self._states.update(working)
+        self._stats["rows"] += len(rows)
+        self._stats["batches"] += 1
+        found = self._stats["events"] - before
+        if found:
+            self.logger.info("Потоковый анализ: новых событий %d в пакете из %d строк", found, len(rows))
+        return found
+
+    def _consume_sensor(self, conn: sqlite3.Connection, sensor_index: int, points: List[tuple]) -> _SensorState:
+        """Прогоняет точки датчика через копию его состояния и возвращает её."""
+        options = self._sensor_options(sensor_index)
+        state = self._states.get(sensor_index)
+        state = copy.deepcopy(state) if state is not None else _SensorState(options["settle_points"])
+        delta = options["glitch_delta"]
+        for ts, value in points:
+            ts, value = float(ts), float(value)
+            if state.last_ts is not None and ts <= state.last_ts:
+                self._stats["late_rows"] += 1
+                continue
+            state.last_ts = ts
+            if math.isnan(value):
+                continue
+            glitch = state.glitch
+            if glitch is not None:
+                glitch["points"].append((ts, value))
+                distance = abs(value - glitch["base"])
+                if distance <= delta:
+                    state.glitch = None
+                    if distance <= options["glitch_return_tolerance"]:
+                        # Сигнал вернулся к базе: точки выброса в статистику не попадают
+                        self._emit(conn, sensor_index, GLITCH, glitch["start_ts"], ts, glitch["peak"] - glitch["base"],
+                                   {"base": glitch["base"], "peak": glitch["peak"], "points": len(glitch["points"]) - 1})
+                        self._accept(conn, sensor_index, state, options, ts, value)
+                    else:
+                        self._replay(conn, sensor_index, state, options, glitch["points"])
+                elif ts - glitch["start_ts"] > options["glitch_max_seconds"]:
+                    # Не вернулся вовремя — это не глюк, а настоящее изменение сигнала
+                    state.glitch = None
+                    self._replay(conn, sensor_index, state, options, glitch["points"])
+                elif distance > abs(glitch["peak"] - glitch["base"]):
+                    glitch["peak"] = value
+                continue
+            if state.prev is not None and abs(value - state.prev) > delta:
+                state.glitch = {"start_ts": ts, "base": state.prev, "peak": value, "points": [(ts, value)]}
+                continue
+            self._accept(conn, sensor_index, state, options, ts, value)
+        return state
+
+    def _replay(self, conn, sensor_index: int, state: _SensorState, options: Dict[str, Any], points) -> None:
+        for ts, value in points:
+            self._accept(conn, sensor_index, state, options, ts, value)
+
+    def _accept(self, conn, sensor_index: int, state: _SensorState, options: Dict[str, Any],
+                ts: float, value: float) -> None:
+        """Учитывает точку в статистиках и автоматах переходов и аномалий."""
+        # Уэлфорд: среднее и дисперсия за всю историю датчика
+        state.count += 1
+        diff = value - state.mean
+        state.mean += diff / state.count
+        state.m2 += diff * (value - state.mean)
+
+        # z-оценка относительно EWMA до учёта текущей точки
+        if state.ew_count >= options["warmup_points"]:
+            std = max(math.sqrt(state.ewvar), options["min_std"])
+            z_score = abs(value - state.ewma) / std
+            bounds = options["bounds"]
+            triggered = z_score > options["z_threshold"] or (
+                bounds is not None and not bounds[0] <= value <= bounds[1])
+            self._track_anomaly(conn, sensor_index, state, ts, value, z_score, triggered)
+
+        # EWMA среднего и дисперсии
+        if state.ew_count == 0:
+            state.ewma, state.ewvar = value, 0.0
+        else:
+            diff = value - state.ewma
+            increment = options["ewma_alpha"] * diff
+            state.ewma += increment
+            state.ewvar = (1 - options["ewma_alpha"]) * (state.ewvar + diff * increment)
+        state.ew_count += 1
+
+        # Переходы между уровнями
+        state.recent.append(value)
+        level = self._nearest_level(value, options)
+        transition = state.transition
+        if transition is None:
+            if state.prev_level is not None and abs(value - state.prev) > options["level_tolerance"]:
+                state.transition = {"start_ts": state.prev_ts, "from_level": state.prev_level, "from_value": state.prev}
+        elif (level is not None and ts - transition["start_ts"] >= options["transition_min_seconds"]
+              and abs(value - sum(state.recent) / len(state.recent)) < options["level_tolerance"]):
+            self._emit(conn, sensor_index, TRANSITION, transition["start_ts"], ts, value - transition["from_value"],
+                       {"from_level": transition["from_level"], "to_level": level})
+            state.transition = None
+        state.prev, state.prev_ts, state.prev_level = value, ts, level
+
+    @staticmethod
+    def _nearest_level(value: float, options: Dict[str, Any]) -> Optional[float]:
+        """Ближайший рабочий уровень в пределах допуска (при равенстве — меньший) или None."""
+        levels = options["levels"]
+        if not levels:
+            return None
+        level = min(sorted(levels), key=lambda candidate: abs(value - candidate))
+        return level if abs(value - level) <= options["level_tolerance"] and level != 0 else None
+
+    def _track_anomaly(self, conn, sensor_index: int, state: _SensorState, ts: float, value: float,
+                       z_score: float, triggered: bool) -> None:
+        anomaly = state.anomaly
+        if anomaly is None:
+            if triggered:
+                anomaly = {"base": state.ewma, "peak": value, "amplitude": value - state.ewma, "z_max": z_score,
+                           "start_ts": ts}
+                anomaly["id"] = self._emit(conn, sensor_index, ANOMALY, ts, None, anomaly["amplitude"],
+                                           self._anomaly_details(anomaly))
+                state.anomaly = anomaly
+            return
+        if triggered:
+            if abs(value - anomaly["base"]) > abs(anomaly["amplitude"]):
+                anomaly["peak"] = value
+                anomaly["amplitude"] = value - anomaly["base"]
+            anomaly["z_max"] = max(anomaly["z_max"], z_score)
+            return
+        conn.execute("UPDATE events SET end_ts = ?, amplitude = ?, details = ? WHERE id = ?",
+                     (ts, anomaly["amplitude"], json.dumps(self._anomaly_details(anomaly)), anomaly["id"]))
+        state.anomaly = None
+
+    @staticmethod
+    def _anomaly_details(anomaly: Dict[str, Any]) -> Dict[str, Any]:
+        return {"base": anomaly["base"], "peak": anomaly["peak"], "z_max": round(anomaly["z_max"], 2)}
+
+    def _emit(self, conn, sensor_index: int, event_type: str, start_ts: float, end_ts: Optional[float],
+              amplitude: float, details: Dict[str, Any]) -> int:
+        cursor = conn.execute(
+            "INSERT INTO events (sensor_index, event_type, start_ts, end_ts, amplitude, details, created_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (sensor_index, event_type, start_ts, end_ts, amplitude, json.dumps(details), time.time())
+        )
+        self._stats["events"] += 1
+        self._stats[event_type] += 1
+        return cursor.lastrowid
+
+    # --- Запросы ---------------------------------------------------------------------------
+
+    def query_events(self, sensor_index: Optional[int] = None, event_type: Optional[str] = None,
+                     since: Optional[float] = None, until: Optional[float] = None,
+                     limit: int = CONFIG["query_limit"]) -> List[Dict[str, Any]]:
+        """События, пересекающиеся с [since, until], от новых к старым; открытые аномалии — с end_ts None."""
+        if event_type is not None and event_type not in EVENT_TYPES:
+            raise ValueError(f"Неизвестный тип события: {event_type}")
+        conditions, params = [], []
+        if sensor_index is not None:
+            conditions.append("sensor_index = ?")
+            params.append(sensor_index)
+        if event_type is not None:
+            conditions.append("event_type = ?")
+            params.append(event_type)
+        if since is not None:
+            conditions.append("(end_ts IS NULL OR end_ts >= ?)")
+            params.append(since)
+        if until is not None:
+            conditions.append("start_ts <= ?")
+            params.append(until)
+        sql = "SELECT * FROM events"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY start_ts DESC, id DESC LIMIT ?"
+        with self._connection() as conn:
+            rows = conn.execute(sql, params + [limit]).fetchall()
+        events = []
+        for row in rows:
+            event = dict(row)
+            event["details"] = json.loads(event["details"]) if event["details"] else {}
+            events.append(event)
+        return events
+
+    def sensor_stats(self, sensor_index: int) -> Optional[Dict[str, Any]]:
+        """Текущие скользящие статистики датчика или None, если строк по нему ещё не было."""
+        state = self._states.get(sensor_index)
+        if state is None:
+            return None
+        return {
+            "last_ts": state.last_ts, "count": state.count, "mean": state.mean, "std": state.std,
+            "ewma": state.ewma, "ewstd": math.sqrt(state.ewvar), "anomaly_open": state.anomaly is not None,
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self._stats, sensors=len(self._states))
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+import json
+import sqlite3
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+import Analysis_core.batch_analysis as batch_analysis
+from Analysis_core.batch_analysis import (
+    BatchAnalysisRunner, analyze_sensor, resample_mean, save_json, save_sqlite, sensors_from_info
+)
+
+POINTS = 3000
+
+
+@pytest.fixture
+def merged_db(tmp_path):
+    rng = np.random.default_rng(0)
+    times = 1_700_000_000 + np.arange(POINTS) * 60.0
+    t1 = 20 + rng.normal(0, 0.5, POINTS)
+    t1[1000] = 200                                  # Глюк в одну точку
+    t2 = np.where(np.arange(POINTS) < 1500, 20.0, 80.0) + rng.normal(0, 0.5, POINTS)  # Переход 20 -> 80
+    t3 = 100 + rng.normal(0, 0.5, POINTS)
+    t3[2000:2010] += 60                             # Аномалия
+    t3[::7] = np.nan                                # Пропуски (NULL)
+    path = tmp_path / "merged.db"
+    with sqlite3.connect(path) as conn:
+        conn.execute('CREATE TABLE data (data_index INTEGER PRIMARY KEY, "time@timestamp" REAL, '
+                     'data_format_0 REAL, data_format_1 REAL, data_format_2 REAL)')
+        rows = [(ts, a, b, None if np.isnan(c) else c) for ts, a, b, c in zip(times, t1, t2, t3)]
+        conn.executemany('INSERT INTO data ("time@timestamp", data_format_0, data_format_1, data_format_2)'
+                         ' VALUES (?, ?, ?, ?)', rows[::-1])  # Порядок вставки не должен влиять
+        conn.execute("CREATE TABLE data_format (comment TEXT, data_format_index INTEGER PRIMARY KEY, data_type TEXT)")
+    return str(path)
+
+
+SENSORS = {"T01 (DT51)": 0, "T02 (DT52)": 1, "T03 (DT53)": 2}
+
+
+def by_type(report, sensor, event_type):
+    return [e for e in report["sensors"][sensor]["events"] if e["type"] == event_type]
+
+
+def test_single_pass_finds_events_per_sensor(merged_db):
+    runner = BatchAnalysisRunner(merged_db, workers=0)
+    report = runner.run(SENSORS)
+    assert runner.stats["passes"] == 1
+    assert runner.stats["rows_read"] == POINTS
+    assert len(by_type(report, "T01 (DT51)", "glitch")) == 1
+    [transition] = by_type(report, "T02 (DT52)", "transition")
+    assert transition["kind"] == "отогрев"
+    [anomaly] = by_type(report, "T03 (DT53)", "anomaly")
+    assert anomaly["amplitude"] > 30  # База — скользящее среднее, часть скачка входит в него
+    assert report["sensors"]["T03 (DT53)"]["points"] == POINTS - len(range(0, POINTS, 7))
+
+
+def test_process_pool_and_memory_groups_match_inline(merged_db):
+    inline = BatchAnalysisRunner(merged_db, workers=0).run(SENSORS)
+    limited = BatchAnalysisRunner(merged_db, workers=2, max_memory_mb=POINTS * 8 * 2 / 1024 / 1024)
+    pooled = limited.run(SENSORS)
+    assert limited.stats["passes"] == 3  # В лимит помещается время и один столбец
+    assert pooled["sensors"] == inline["sensors"]
+
+
+def test_period_filter(merged_db):
+    start = 1_700_000_000 + 1200 * 60
+    report = BatchAnalysisRunner(merged_db, workers=0).run(
+        SENSORS, start_time=datetime.fromtimestamp(start, tz=timezone.utc))
+    assert report["sensors"]["T01 (DT51)"]["points"] == POINTS - 1200
+    assert by_type(report, "T01 (DT51)", "glitch") == []
+
+
+def test_reports_saved(merged_db, tmp_path):
+    report = BatchAnalysisRunner(merged_db, workers=0).run(SENSORS)
+    path = save_json(report, str(tmp_path / "report.json"))
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f)["sensors"].keys() == SENSORS.keys()
+    db = str(tmp_path / "report.db")
+    run_id = save_sqlite(report, db)
+    with sqlite3.connect(db) as conn:
+        count = conn.execute("SELECT COUNT(*) FROM analysis_events WHERE run_id = ?", (run_id,)).fetchone()[0]
+    assert count == sum(len(s["events"]) for s in report["sensors"].values())
+
+
+def test_resample_mean_matches_bins():
+    times = np.array([0, 10, 59, 130, 170], dtype=float)
+    values = np.array([1, 2, 3, 10, 20], dtype=float)
+    grid, means = resample_mean(times, values, 60)
+    assert grid.tolist() == [0, 60, 120]
+    assert means[0] == 2 and np.isnan(means[1]) and means[2] == 15
+
+
+def test_empty_sensor_and_selection():
+    info = {"T01 (DT51)": {"index": 0}, "DT51": {"index": 0}, "T02": {"index": 1}, "P11 (ВД22)": {"index": 5}}
+    assert sensors_from_info(info) == {"T01 (DT51)": 0, "T02": 1}
+    result = analyze_sensor({"sensor_name": "x", "sensor_index": 1, "times": np.array([]), "values": np.array([]),
+                             "options": {}})
+    assert result["points"] == 0 and result["events"] == []
+
+
+def test_series_shorter_than_z_window(merged_db):
+    start = 1_700_000_000 + (POINTS - 20) * 60  # Последние 20 минут — короче окна z-оценок
+    report = BatchAnalysisRunner(merged_db, workers=0).run(
+        SENSORS, start_time=datetime.fromtimestamp(start, tz=timezone.utc))
+    for sensor in report["sensors"].values():
+        assert sensor["error"] is None
+        assert sensor["points"] > 0
+        assert [e for e in sensor["events"] if e["type"] == "anomaly"] == []
+
+
+def test_sensor_error_does_not_abort_run(merged_db, monkeypatch):
+    real = batch_analysis.find_transitions
+
+    def failing(values, *args, **kwargs):
+        if np.nanmean(values) > 90:  # Только T03
+            raise RuntimeError("сбой детектора")
+        return real(values, *args, **kwargs)
+
+    monkeypatch.setattr(batch_analysis, "find_transitions", failing)
+    report = BatchAnalysisRunner(merged_db, workers=0).run(SENSORS)
+    assert report["sensors"]["T03 (DT53)"]["error"] == "RuntimeError: сбой детектора"
+    assert report["sensors"]["T03 (DT53)"]["events"] == []
+    assert len(by_type(report, "T01 (DT51)", "glitch")) == 1
+    assert report["sensors"]["T02 (DT52)"]["error"] is None
+
+
+def test_rows_appended_during_run_are_not_read(merged_db, monkeypatch):
+    with sqlite3.connect(merged_db) as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+    runner = BatchAnalysisRunner(merged_db, workers=0, max_memory_mb=POINTS * 8 * 2 / 1024 / 1024)
+    groups = runner._groups
+
+    def groups_then_ingest(rows, indices):
+        # Дозапись merged.db между подсчётом строк и чтением групп
+        with sqlite3.connect(merged_db) as writer:
+            writer.executemany('INSERT INTO data ("time@timestamp", data_format_0, data_format_1, data_format_2)'
+                               ' VALUES (?, 20, 20, 100)', [(2_000_000_000 + i,) for i in range(500)])
+        return groups(rows, indices)
+
+    monkeypatch.setattr(runner, "_groups", groups_then_ingest)
+    report = runner.run(SENSORS)
+    assert runner.stats["passes"] == 3
+    assert runner.stats["rows_read"] == 3 * POINTS
+    assert all(sensor["points"] <= POINTS for sensor in report["sensors"].values())
+
+
+def test_groups_reserve_memory_for_tasks_in_flight():
+    column_mb = 1000 * 8 / 1024 / 1024
+    runner = BatchAnalysisRunner("unused.db", workers=2, max_memory_mb=12 * column_mb)
+    # 12 столбцов: время + 3 столбца группы + 2 задачи по 4 столбца
+    assert runner._groups(1000, list(range(7))) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert BatchAnalysisRunner("unused.db", workers=0, max_memory_mb=12 * column_mb)._groups(1000, list(range(7))) \
+        == [[0, 1, 2, 3, 4, 5, 6]]
@@ -8,7 +8,7 @@ from datetime import datetime
 from unittest.mock import patch, MagicMock
 import psutil
 
-from Analysis_core.data_reader import DataReader
+from Analysis_core.data_reader import DataReader, pack_sensor_info, unpack_sensor_info
 
 # Вспомогательный контекст-менеджер для sqlite3.connect
 class DummyCM:
@@ -191,4 +191,21 @@ def test_get_data_stream_generator(data_reader):
 def test_get_data_stream_sensor_not_found(data_reader):
     with patch.object(data_reader, "get_sensor_info", return_value=[]):
         with pytest.raises(ValueError, match="Датчик с индексом 999 не найден"):
-            data_reader.get_data_stream(999)
\ No newline at end of file
+            data_reader.get_data_stream(999)
+
+
+def test_sensor_info_packing_roundtrip():
+    names = ["T01", "Температура 1"]
+    sensor_info = {
+        name: {"sensor_name": name, "index": 1, "data_type": 8, "source_files": ["merged.db"],
+               "folder": ".", "all_names": names}
+        for name in names
+    }
+    sensor_info["P02"] = {"sensor_name": "P02", "index": 2, "data_type": 8, "source_files": ["merged.db"],
+                          "folder": ".", "all_names": ["P02"]}
+    packed = pack_sensor_info(sensor_info)
+    assert len(packed["records"]) == 2
+    unpacked = unpack_sensor_info(packed)
+    assert unpacked == sensor_info
+    assert unpacked["T01"]["all_names"] is unpacked["Температура 1"]["all_names"]
+    assert unpack_sensor_info(sensor_info) is sensor_info  # Прежний формат кеша
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from Analysis_core.event_detection import (
+    find_anomalies, find_glitches, find_transitions, find_warming, find_zscore_anomalies, nearest_level, rolling_mean, runs
+)
+
+
+# Эталонные поэлементные реализации из Graph.Analyzer (до векторизации)
+
+def reference_glitches(values, threshold_delta, max_glitch_points):
+    diffs = np.abs(np.diff(values))
+    glitch_starts = np.where(diffs > threshold_delta)[0] + 1
+    found = []
+    for idx, start in enumerate(glitch_starts):
+        end = start
+        base_value = values[start - 1] if start > 0 else values[0]
+        while end < len(values) and (end - start) <= max_glitch_points and abs(values[end] - base_value) > threshold_delta:
+            end += 1
+        if (end - start) <= max_glitch_points and end < len(values):
+            if abs(values[end] - base_value) <= 5:
+                found.append((idx, start, end))
+    return found
+
+
+def reference_warming(values, avg, warm_threshold, sustain_threshold, hold_points):
+    start_warming_idx = None
+    for i in range(len(values) - hold_points):
+        if values[i] >= warm_threshold:
+            if np.mean(values[i:i + hold_points]) >= sustain_threshold:
+                start_warming_idx = i
+                break
+    actual_start_idx = None
+    if start_warming_idx is not None:
+        for i in range(start_warming_idx, -1, -1):
+            if abs(values[i] - avg) <= 0.1:
+                actual_start_idx = i
+                break
+    return start_warming_idx, actual_start_idx
+
+
+def reference_anomalies(values, avg, jump_threshold, return_threshold):
+    deviations = np.abs(values - avg)
+    jump_points = np.where(deviations >= jump_threshold)[0]
+    found = []
+    i = 0
+    while i < len(jump_points):
+        start_jump = jump_points[i]
+        j = i
+        while j < len(jump_points) - 1 and jump_points[j + 1] == jump_points[j] + 1:
+            j += 1
+        segment_end = jump_points[j]
+        peak_idx = start_jump + np.argmax(values[start_jump:segment_end + 1])
+        start_idx = start_jump
+        for k in range(peak_idx - 1, -1, -1):
+            if abs(values[k] - avg) <= return_threshold:
+                start_idx = k
+                break
+        end_idx = peak_idx
+        for k in range(peak_idx + 1, len(values)):
+            if abs(values[k] - avg) <= return_threshold:
+                end_idx = k
+                break
+        found.append((start_idx, peak_idx, end_idx))
+        i = j + 1
+    return found
+
+
+def noisy_series(seed, n=5000, with_nan=False):
+    rng = np.random.default_rng(seed)
+    values = 80 + rng.normal(0, 1, n)
+    # Глюки: короткие выбросы с возвратом и без
+    for start in rng.integers(1, n - 20, 40):
+        values[start:start + rng.integers(1, 8)] += rng.choice([-1, 1]) * rng.uniform(60, 200)
+    # Аномалии: гладкие горбы
+    for start in rng.integers(0, n - 200, 8):
+        width = rng.integers(20, 150)
+        values[start:start + width] += rng.uniform(5, 40) * np.hanning(width)
+    # Отогрев в конце
+    values[-800:] = np.linspace(80, 300, 800) + rng.normal(0, 0.5, 800)
+    if with_nan:
+        values[rng.integers(0, n, 30)] = np.nan
+    return values
+
+
+def test_runs():
+    starts, ends = runs(np.array([0, 1, 1, 0, 1, 0, 0, 1], dtype=bool))
+    assert starts.tolist() == [1, 4, 7]
+    assert ends.tolist() == [2, 4, 7]
+    assert runs(np.zeros(0, dtype=bool))[0].size == 0
+
+
+def test_rolling_mean_matches_slices():
+    values = noisy_series(0, with_nan=True)[:500]
+    means = rolling_mean(values, 7)
+    expected = np.array([np.mean(values[i:i + 7]) for i in range(len(values) - 6)])
+    assert np.allclose(means, expected, equal_nan=True)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("with_nan", [False, True])
+@pytest.mark.parametrize("max_points", [0, 3, 10])
+def test_glitches_match_reference(seed, with_nan, max_points):
+    values = noisy_series(seed, with_nan=with_nan)
+    assert find_glitches(values, 50, max_points) == reference_glitches(values, 50, max_points)
+
+
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")  # np.mean пустого среза в эталоне при hold_points=0
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("with_nan", [False, True])
+def test_warming_matches_reference(seed, with_nan):
+    values = noisy_series(seed, with_nan=with_nan)
+    for hold_points in (0, 1, 30, 300, 10000):
+        start, actual = find_warming(values, 80.0, 290, 290, hold_points)
+        assert (start, actual) == reference_warming(values, 80.0, 290, 290, hold_points)
+    # Порог, ровно равный среднему окна: решение то же, что у np.mean
+    values = np.full(100, 290.1)
+    assert find_warming(values, 290.1, 290.1, 290.1, 30) == reference_warming(values, 290.1, 290.1, 290.1, 30)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("with_nan", [False, True])
+def test_anomalies_match_reference(seed, with_nan):
+    values = noisy_series(seed, with_nan=with_nan)[:-800]
+    for jump, ret in ((5, 1), (10, 2), (3, 0.5)):
+        assert find_anomalies(values, 80.0, jump, ret) == reference_anomalies(values, 80.0, jump, ret)
+
+
+def test_anomaly_without_return_points():
+    values = np.array([0.0, 10, 12, 11])
+    assert find_anomalies(values, 0.0, 5, 0.5) == reference_anomalies(values, 0.0, 5, 0.5) == [(0, 2, 2)]
+    values = np.array([10.0, 12, 11])
+    assert find_anomalies(values, 0.0, 5, 0.5) == reference_anomalies(values, 0.0, 5, 0.5) == [(0, 1, 1)]
+
+
+# Эталоны из Graph_Anal_2.AnomalyDetector (до векторизации, без tqdm)
+
+def reference_transitions(values, target_values, tolerance, min_points):
+    transitions = []
+    in_transition = False
+    start_idx = 0
+    working_levels = sorted(target_values)
+    for i in range(1, len(values)):
+        prev_value = values[i - 1]
+        curr_value = values[i]
+        prev_level = min(working_levels, key=lambda x: abs(prev_value - x)) if any(abs(prev_value - level) <= tolerance for level in working_levels) else None
+        curr_level = min(working_levels, key=lambda x: abs(curr_value - x)) if any(abs(curr_value - level) <= tolerance for level in working_levels) else None
+        if not in_transition and prev_level and (abs(curr_value - prev_value) > tolerance):
+            in_transition = True
+            start_idx = i - 1
+        elif in_transition and curr_level and (abs(curr_value - values[max(0, i - 10):i + 1].mean()) < tolerance) and (i - start_idx >= min_points):
+            in_transition = False
+            transitions.append((start_idx, i))
+    return transitions
+
+
+def reference_general_anomalies(values, z_threshold, window_size):
+    window = np.ones(window_size) / window_size
+    rolling_mean = np.convolve(values, window, mode='valid')
+    rolling_std = np.sqrt(np.convolve((values - np.convolve(values, window, mode='same'))**2, window, mode='valid') / window_size)
+    pad_left = (window_size - 1) // 2
+    pad_right = window_size - 1 - pad_left
+    rolling_mean = np.pad(rolling_mean, (pad_left, pad_right), mode='edge')
+    rolling_std = np.pad(rolling_std, (pad_left, pad_right), mode='edge')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z_scores = np.abs((values - rolling_mean) / rolling_std)
+    spans = []
+    in_anomaly = False
+    start_idx = 0
+    for i in range(len(values)):
+        current_value = values[i]
+        is_peak = i > 0 and abs(current_value - values[i - 1]) > 30
+        is_outside = current_value < 0 or current_value > 350
+        if not in_anomaly and (z_scores[i] > z_threshold or is_peak or is_outside):
+            in_anomaly = True
+            start_idx = i
+        elif in_anomaly and (z_scores[i] < z_threshold and not is_peak and not is_outside):
+            in_anomaly = False
+            spans.append((start_idx, i))
+    return spans, rolling_mean
+
+
+def cooldown_cycles(seed, n=6000, with_nan=False):
+    """Ступени 300 → 80 → 20 → 300 К с плавными переходами, шумом и выбросами."""
+    rng = np.random.default_rng(seed)
+    levels = [300, 80, 20, 300, 80, 0]
+    values = []
+    for a, b in zip(levels, levels[1:]):
+        values.extend(np.full(rng.integers(200, 600), a) + rng.normal(0, 1, 1)[0])
+        values.extend(np.linspace(a, b, rng.integers(20, 400)))
+    values = np.array(values[:n], dtype=float) + rng.normal(0, 0.8, min(len(values), n))
+    for start in rng.integers(1, len(values) - 5, 15):
+        values[start] += rng.choice([-1, 1]) * rng.uniform(40, 120)
+    if with_nan:
+        values[rng.integers(0, len(values), 20)] = np.nan
+    return values
+
+
+def test_nearest_level_prefers_lower_on_tie():
+    nearest, distance = nearest_level(np.array([50.0, 81, 400, -5]), [80, 20, 300])
+    assert nearest.tolist() == [20, 80, 300, 20]
+    assert distance.tolist() == [30, 1, 100, 25]
+
+
+@pytest.mark.parametrize("seed", range(6))
+@pytest.mark.parametrize("with_nan", [False, True])
+def test_transitions_match_reference(seed, with_nan):
+    values = cooldown_cycles(seed, with_nan=with_nan)
+    for levels, tolerance, min_points in (([20, 80, 300], 10, 5), ([20, 80, 300], 10, 0), ([0, 20, 80, 300], 5, 30)):
+        expected = reference_transitions(values, levels, tolerance, min_points)
+        assert find_transitions(values, levels, tolerance, min_points) == expected
+
+
+@pytest.mark.parametrize("seed", range(6))
+@pytest.mark.parametrize("with_nan", [False, True])
+def test_general_anomalies_match_reference(seed, with_nan):
+    values = cooldown_cycles(seed, with_nan=with_nan)
+    for z_threshold, window_size in ((5, 30), (2, 10), (3, 31)):
+        spans, rolling = find_zscore_anomalies(values, z_threshold, window_size)
+        expected_spans, expected_rolling = reference_general_anomalies(values, z_threshold, window_size)
+        assert spans == expected_spans
+        assert np.array_equal(rolling, expected_rolling, equal_nan=True)
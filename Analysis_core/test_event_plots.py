@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from Analysis_core.event_plots import EventPlotRenderer, plot_job, window
+
+START = datetime(2025, 1, 1, tzinfo=timezone.utc)
+TIMES = np.array([START + timedelta(minutes=i) for i in range(60)])
+VALUES = np.linspace(20, 80, 60)
+
+
+def job(path, start=10, end=12):
+    around = window(TIMES, TIMES[start], TIMES[end], timedelta(minutes=5))
+    return plot_job(str(path), TIMES[around], VALUES[around], "Глюк", "T01", span=(TIMES[start], TIMES[end]))
+
+
+def test_window_matches_mask():
+    for start, end in [(0, 0), (10, 12), (55, 59)]:
+        around = window(TIMES, TIMES[start], TIMES[end], timedelta(minutes=5))
+        mask = (TIMES >= TIMES[start] - timedelta(minutes=5)) & (TIMES <= TIMES[end] + timedelta(minutes=5))
+        assert TIMES[around].tolist() == TIMES[mask].tolist()
+
+
+def test_lazy_renderer_defers_until_requested(tmp_path):
+    renderer = EventPlotRenderer(workers=0, lazy=True)
+    path = renderer.submit(job(tmp_path / "glitch_0.png"))
+    assert renderer.pending == [path]
+    assert renderer.flush() == []
+    assert not (tmp_path / "glitch_0.png").exists()
+    assert renderer.ensure(str(tmp_path / "unknown.png")) is None
+
+
+def test_pool_renders_all_pending(tmp_path):
+    pytest.importorskip("matplotlib")
+    renderer = EventPlotRenderer(workers=2)
+    paths = [renderer.submit(job(tmp_path / f"anomaly_{i}.png", 5 * i, 5 * i + 2)) for i in range(4)]
+    assert sorted(renderer.flush()) == sorted(paths)
+    assert renderer.pending == []
+    assert all((tmp_path / f"anomaly_{i}.png").stat().st_size > 0 for i in range(4))
+
+
+def test_ensure_renders_single_plot(tmp_path):
+    pytest.importorskip("matplotlib")
+    renderer = EventPlotRenderer(workers=0, lazy=True)
+    first = renderer.submit(job(tmp_path / "a.png"))
+    renderer.submit(job(tmp_path / "b.png", 30, 31))
+    assert renderer.ensure(first) == first
+    assert (tmp_path / "a.png").exists() and not (tmp_path / "b.png").exists()
+    assert renderer.ensure(first) == first  # Повторный запрос — готовый файл
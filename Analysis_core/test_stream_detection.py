@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+import math
+import random
+import sqlite3
+
+import pytest
+
+from Analysis_core.stream_detection import StreamingAnomalyEngine
+
+COLUMNS = ['"time@timestamp"', '"data_format_3"']
+
+
+@pytest.fixture
+def engine(tmp_path):
+    return StreamingAnomalyEngine(str(tmp_path / "events.db"), config={"levels": ()})
+
+
+def series(values, start=0.0, step=1.0):
+    return [(start + i * step, value) for i, value in enumerate(values)]
+
+
+def noisy(n, level=100.0, seed=1):
+    rng = random.Random(seed)
+    return [level + rng.gauss(0, 1) for _ in range(n)]
+
+
+def test_glitch_detected_and_excluded_from_stats(engine):
+    values = noisy(50) + [300.0, 310.0] + noisy(20, seed=2)
+    engine.consume(COLUMNS, series(values))
+    events = engine.query_events(sensor_index=3)
+    assert [e["event_type"] for e in events] == ["glitch"]
+    assert events[0]["start_ts"] == 50 and events[0]["end_ts"] == 52
+    assert events[0]["details"]["points"] == 2
+    stats = engine.sensor_stats(3)
+    assert stats["count"] == 70
+    assert abs(stats["mean"] - 100) < 1
+
+
+def test_long_jump_is_not_glitch(engine):
+    values = noisy(50) + [200.0] * 30
+    engine.consume(COLUMNS, series(values))
+    types = {e["event_type"] for e in engine.query_events()}
+    assert "glitch" not in types
+    assert "anomaly" in types
+    assert engine.sensor_stats(3)["count"] == 80
+
+
+def test_anomaly_is_open_immediately_and_closes(engine):
+    engine.consume(COLUMNS, series(noisy(60)))
+    engine.consume(COLUMNS, series([130.0, 135.0], start=60))
+    [event] = engine.query_events(event_type="anomaly")
+    assert event["end_ts"] is None
+    assert event["amplitude"] == pytest.approx(35, abs=2)
+    engine.consume(COLUMNS, series(noisy(5, seed=3), start=62))
+    [event] = engine.query_events(event_type="anomaly")
+    assert event["end_ts"] == 62
+    assert event["details"]["peak"] == 135.0
+
+
+def test_batches_match_single_pass(tmp_path):
+    values = noisy(100) + [300.0] + noisy(50, seed=4) + [160.0] * 5 + noisy(100, seed=5)
+    rows = series(values)
+    whole = StreamingAnomalyEngine(str(tmp_path / "whole.db"))
+    whole.consume(COLUMNS, rows)
+    parts = StreamingAnomalyEngine(str(tmp_path / "parts.db"))
+    for i in range(0, len(rows), 7):
+        parts.consume(COLUMNS, rows[i:i + 7])
+    strip = lambda events: [(e["event_type"], e["start_ts"], e["end_ts"], e["amplitude"]) for e in events]
+    assert strip(whole.query_events()) == strip(parts.query_events())
+    assert whole.sensor_stats(3) == parts.sensor_stats(3)
+
+
+def test_state_survives_restart_and_late_rows_dropped(tmp_path):
+    path = str(tmp_path / "events.db")
+    values = noisy(50) + [300.0] + noisy(20, seed=2)
+    first = StreamingAnomalyEngine(path)
+    first.consume(COLUMNS, series(values[:51]))  # Рестарт посреди подозрения на глюк
+    second = StreamingAnomalyEngine(path)
+    second.consume(COLUMNS, series(values, start=0))  # Повторная подача старых строк
+    assert second.get_stats()["late_rows"] == 51
+    assert [e["event_type"] for e in second.query_events()] == ["glitch"]
+    assert second.sensor_stats(3)["count"] == 70
+
+
+def test_failed_batch_does_not_advance_state(tmp_path):
+    path = str(tmp_path / "events.db")
+    engine = StreamingAnomalyEngine(path)
+    engine.consume(COLUMNS, series(noisy(50)))
+    with sqlite3.connect(path) as conn:
+        # Запись состояния падает в конце пакета — транзакция откатывается целиком
+        conn.execute("CREATE TRIGGER fail BEFORE INSERT ON stream_state "
+                     "BEGIN SELECT RAISE(ABORT, 'database is locked'); END")
+    batch = series([300.0] + noisy(20, seed=2), start=50)
+    with pytest.raises(sqlite3.Error):
+        engine.consume(COLUMNS, batch)
+    assert engine.sensor_stats(3)["last_ts"] == 49
+    assert engine.query_events() == []
+    assert engine.get_stats().get("glitch", 0) == 0
+    with sqlite3.connect(path) as conn:
+        conn.execute("DROP TRIGGER fail")
+    engine.consume(COLUMNS, batch)  # Повторная подача после сбоя обрабатывается полностью
+    assert [e["event_type"] for e in engine.query_events()] == ["glitch"]
+    assert engine.get_stats().get("late_rows", 0) == 0
+    assert engine.sensor_stats(3)["count"] == 70
+
+
+def test_transition_between_levels(tmp_path):
+    engine = StreamingAnomalyEngine(str(tmp_path / "events.db"),
+                                    config={"transition_min_seconds": 60, "glitch_delta": 1000})
+    values = [20.0] * 30 + [35.0, 50.0, 65.0] + [80.0] * 40
+    engine.consume(COLUMNS, series(values, step=10))
+    [event] = engine.query_events(event_type="transition")
+    assert event["start_ts"] == 290
+    assert event["end_ts"] >= 290 + 60
+    assert event["details"] == {"from_level": 20.0, "to_level": 80.0}
+    assert event["amplitude"] == pytest.approx(60)
+
+
+def test_null_values_and_foreign_columns_ignored(engine):
+    columns = ['"time@timestamp"', '"data_format_3"', '"data_format_7"', '"comment"']
+    rows = [(float(i), None if i % 2 else 100.0, 5.0, "x") for i in range(10)]
+    engine.consume(columns, rows)
+    assert engine.sensor_stats(3)["count"] == 5
+    assert engine.sensor_stats(7)["count"] == 10
+    assert engine.get_stats()["sensors"] == 2
+    assert math.isclose(engine.sensor_stats(7)["std"], 0.0)
+
+
+def test_query_filters(engine):
+    engine.consume(COLUMNS, series(noisy(50) + [300.0] + noisy(50, seed=2)))
+    assert engine.query_events(since=1000) == []
+    assert engine.query_events(until=10) == []
+    assert len(engine.query_events(since=40, until=60)) == 1
+    with pytest.raises(ValueError):
+        engine.query_events(event_type="unknown")
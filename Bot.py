@@ -20,11 +20,15 @@ import traceback
 from Analysis_core.data_reader import DataReader
 from Analysis_core.data_processor import DataProcessor
 from Analysis_core.report_generator import generate_report, build_report_data
+from Analysis_core.stream_detection import StreamingAnomalyEngine
 from Bot_core.action_executor import ActionExecutor
 from Bot_core.llm_core import RequestFormalizer, create_request_formalizer
+from Bot_core.report_jobs import ReportJobQueue
 from User_core.history_manager import HistoryManager
 from User_core.telegram_bot import TelegramBot
 from User_core.speech_recognizer import SpeechRecognizer
+from Utils.correction_cache import CorrectionCache
+from Utils.transcription_cache import TranscriptionCache
 
 try:
     from Utils.error_corrector import ErrorCorrector
@@ -42,6 +46,18 @@ TEST_FILES = [
     # "Bot_core/test_llm_core.py",
 ]
 
+INGEST_INTERVAL = 60  # Секунд между проверками новых строк в исходных базах
+
+async def follow_ingestion(data_reader: DataReader, interval: float, logger: logging.Logger):
+    """Периодически дописывает merged.db; новые строки сразу анализирует потоковый детектор."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(data_reader.refresh)
+        except Exception as e:
+            logger.error("Ошибка дозаписи данных: %s", e)
+            logger.error("Трассировка стека: %s", traceback.format_exc())
+
 def setup_logging(debug_mode: bool) -> logging.Logger:
     if sys.platform == "win32":
         os.system("chcp 65001 > nul")
@@ -109,13 +125,16 @@ def run_tests(debug_mode: bool, logger: logging.Logger):
 async def run_bot(debug_mode: bool, data_path: str, logger: logging.Logger):
     try:
         logger.debug("Инициализация ErrorCorrector")
-        error_corrector = ErrorCorrector(debug_mode=debug_mode, logger=logger)
+        error_corrector = ErrorCorrector(debug_mode=debug_mode, logger=logger, cache=CorrectionCache("history.db", logger=logger))
         
         logger.debug("Инициализация HistoryManager")
         history_manager = HistoryManager("history.db", timeout_hours=24, max_history_size=50, logger=logger)
 
+        logger.debug("Инициализация потокового детектора событий")
+        anomaly_engine = StreamingAnomalyEngine("history.db", logger=logger)
+
         logger.debug("Инициализация DataReader с путем: %s", data_path)
-        data_reader = DataReader(data_path, history_manager, debug_mode, logger=logger)
+        data_reader = DataReader(data_path, history_manager, debug_mode, logger=logger, anomaly_engine=anomaly_engine)
 
         # Получение available_sensors и time_period
         logger.debug("Получение информации о датчиках")
@@ -135,7 +154,11 @@ async def run_bot(debug_mode: bool, data_path: str, logger: logging.Logger):
         data_processor = DataProcessor(data_reader, "Database", debug_mode, "Database", logger=logger, report_generator=generate_report, build_report_data=build_report_data)
 
         logger.debug("Инициализация ActionExecutor")
-        action_executor = ActionExecutor(data_processor, error_corrector, logger=logger, debug_mode=debug_mode)
+        action_executor = ActionExecutor(data_processor, error_corrector, logger=logger, debug_mode=debug_mode, defer_reports=True,
+                                         anomaly_engine=anomaly_engine)
+
+        logger.debug("Инициализация очереди отчётов")
+        report_jobs = ReportJobQueue("history.db", runner=action_executor.run_report_job, logger=logger)
 
         logger.debug("Создание RequestFormalizer")
         request_formalizer = create_request_formalizer(
@@ -148,7 +171,7 @@ async def run_bot(debug_mode: bool, data_path: str, logger: logging.Logger):
         )
 
         logger.debug("Инициализация SpeechRecognizer")
-        speech_recognizer = SpeechRecognizer(logger=logger)
+        speech_recognizer = SpeechRecognizer(logger=logger, cache=TranscriptionCache("history.db", logger=logger))
 
         token = os.getenv("TELEGRAM_TOKEN_Prod")
         logger.debug("Получен токен Telegram: %s", "установлен" if token else "не установлен")
@@ -168,11 +191,32 @@ async def run_bot(debug_mode: bool, data_path: str, logger: logging.Logger):
             action_executor=action_executor,
             speech_recognizer=speech_recognizer,
             debug_mode=debug_mode,
-            logger=logger
+            logger=logger,
+            report_jobs=report_jobs
         )
 
         logger.debug("Запуск бота")
-        await bot.run()
+        ingestion = asyncio.create_task(follow_ingestion(data_reader, INGEST_INTERVAL, logger))
+        try:
+            if bot.webhook_enabled:
+                # Вебхук принимает сервер дашборда; импорт здесь, чтобы polling-режим не требовал quart
+                from Dashboard.dashboard import Dashboard, serve_dashboard
+                dashboard = Dashboard(bot, history_manager)
+                server_stopped = asyncio.Event()
+                server = asyncio.create_task(serve_dashboard(dashboard, shutdown_trigger=server_stopped.wait))
+                try:
+                    await bot.run()
+                finally:
+                    server_stopped.set()
+                    await server
+            else:
+                await bot.run()
+        finally:
+            ingestion.cancel()
+            await asyncio.gather(ingestion, return_exceptions=True)
+            await report_jobs.stop()
+            await speech_recognizer.close()
+            history_manager.close()
     except Exception as e:
         logger.error("Ошибка при запуске бота: %s", e)
         logger.error("Трассировка стека: %s", traceback.format_exc())
@@ -2,11 +2,14 @@
 import json
 import logging
 import asyncio
-from typing import Dict, Any, Optional
+from typing import Callable, Dict, Any, Optional
 import traceback
 from datetime import datetime, timedelta
 from datetime import timezone, timedelta
 
+from Bot_core.report_jobs import JobCancelled
+from Utils.prompt_budget import PromptBudget
+
 moscow_tz = timezone(timedelta(hours=3))
 
 
@@ -27,6 +30,15 @@ CONFIG = {
             "Верни JSON: {{'is_valid': true, 'corrected_name': '{sensor_name}', 'reason': '', 'message': ''}} или "
             "{{'is_valid': false, 'corrected_name': '', 'reason': 'описание', 'message': 'текст для пользователя'}}"
         ),
+        "validate_batch": (
+            "Проверь и исправь сразу несколько полей одного запроса.\n"
+            "Для каждого поля ниже дана отдельная инструкция и значение:\n"
+            "{fields}\n\n"
+            "Верни один JSON-объект, где ключ — имя поля, а значение — JSON в формате из инструкции этого поля, например: "
+            "{{'sensor_name': {{'is_valid': true, 'corrected_name': '...', 'reason': '', 'message': ''}}, "
+            "'start_time': {{'is_valid': true, 'corrected_date': '...', 'reason': '', 'message': ''}}}}. "
+            "Не пропускай поля и не добавляй лишних."
+        ),
         "validate_start_time": (
             "Приведи дату '{0}' к формату 'YYYY-MM-DD HH:MM:SS', проверь диапазон {1}. "
             "Если HH:MM:SS не указаны, используй 00:00:00. "
@@ -116,7 +128,22 @@ CONFIG = {
                     "comment": "string"
                 },
                 "validations": ["action", "start_time", "end_time"]
-}
+},
+            "get_events": {
+                "description": "Показать события, найденные потоковым анализом: глюки, переходы между уровнями, аномалии",
+                "call_rule": "Датчик, период и тип события (glitch, transition, anomaly) — опционально. Без периода — последние события.",
+                "expected_json": {
+                    "action": "get_events",
+                    "parameters": {
+                        "sensor_name": "string (опционально)",
+                        "start_time": "string (YYYY-MM-DD HH:MM:SS, опционально)",
+                        "end_time": "string (YYYY-MM-DD HH:MM:SS, опционально)",
+                        "event_type": "string (glitch | transition | anomaly, опционально)"
+                    },
+                    "comment": "string"
+                },
+                "validations": ["action"]
+            }
         },
 
 
@@ -135,20 +162,129 @@ CONFIG = {
 
 
     },
-    "llm_timeout": 60
+    "event_names": {"glitch": "глюк", "transition": "переход", "anomaly": "аномалия"},
+    "llm_timeout": 60,
+    "batch_validation": True  # Все ошибочные поля исправляются одним запросом к LLM
 }
 
 class ActionExecutor:
     """Выполняет действия на основе формализованных запросов, возвращая JSON-ответ."""
 
-    def __init__(self, data_processor, error_corrector, logger: logging.Logger = None, debug_mode: bool = False):
+    def __init__(self, data_processor, error_corrector, logger: logging.Logger = None, debug_mode: bool = False,
+                 defer_reports: bool = False, anomaly_engine=None):
         self.data_processor = data_processor
+        self.anomaly_engine = anomaly_engine  # StreamingAnomalyEngine для get_events
         self.error_corrector = error_corrector
         self.logger = logger or logging.getLogger(__name__)
         self.supported_actions = list(CONFIG["prompts"]["supported_actions"].keys())
+        self.prompt_budget = PromptBudget(logger=self.logger)
         self.debug_mode = debug_mode
+        # При defer_reports generate_report только проверяет период и возвращает параметры задачи
+        # для очереди отчётов; сам отчёт собирается в run_report_job
+        self.defer_reports = defer_reports
         self.logger.debug("ActionExecutor инициализирован")
 
+    def build_report(self, start_dt: datetime, end_dt: datetime,
+                     progress: Optional[Callable[[str, int, int], None]] = None) -> Dict[str, Any]:
+        """Собирает отчёт КЗ201 за период и возвращает результат со списком файлов (блокирующий вызов)."""
+        try:
+            plot_paths, pdf_path, docx_path = self.data_processor.generate_report(
+                start_time=start_dt,
+                end_time=end_dt,
+                output_dir="Bot_Reports",
+                logger=self.logger,
+                progress=progress
+            )
+        except JobCancelled:
+            raise
+        except Exception as exc:
+            self.logger.error("Ошибка генерации отчёта КЗ201: %s", exc)
+            self.logger.error(traceback.format_exc())
+            raise RuntimeError(f"Не удалось сгенерировать отчёт: {exc}")
+
+        # === Собираем ВСЕ файлы для отправки ===
+        files_to_send = []
+
+        if pdf_path and pdf_path.exists():
+            files_to_send.append(("PDF", pdf_path))
+        if docx_path and docx_path.exists():
+            files_to_send.append(("DOCX", docx_path))
+        for i, plot_path in enumerate(plot_paths, 1):
+            if plot_path and plot_path.exists():
+                files_to_send.append((f"График {i}", plot_path))
+
+        # === Ответ боту ===
+        result = {
+            "result": {
+                "files": [
+                    {"type": file_type, "path": str(path)} for file_type, path in files_to_send
+                ],
+                "message": (
+                    f"**Отчёт КЗ201 готов** (7 файлов)\n"
+                    f"`{start_dt.strftime('%d.%m.%Y %H:%M')} — {end_dt.strftime('%d.%m.%Y %H:%M')}`\n"
+                    f"PDF + DOCX + 5 графиков"
+                )
+            }
+        }
+        self.logger.info("Отчёт КЗ201: подготовлено %d файлов", len(files_to_send))
+        return result
+
+    def _get_events(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """События потокового анализа по датчику и периоду (даты в UTC, как у generate_report)."""
+        if self.anomaly_engine is None:
+            raise RuntimeError("Потоковый анализ событий не подключён")
+        sensors = self.data_processor.reader.get_sensor_info()
+        sensor_index = None
+        if params.get("sensor_name"):
+            # Параметр не проходит проверку через LLM, поэтому неформальное имя ищется по индексу датчиков
+            name = params["sensor_name"]
+            if name not in sensors:
+                name = self.data_processor.reader.get_sensor_index().resolve(name) or name
+            sensor = sensors.get(name)
+            if not sensor:
+                raise ValueError(f"Датчик {params['sensor_name']} не найден")
+            sensor_index = sensor["index"]
+        bounds = {}
+        for field in ("start_time", "end_time"):
+            if params.get(field):
+                try:
+                    bounds[field] = datetime.strptime(params[field], "%Y-%m-%d %H:%M:%S") \
+                        .replace(tzinfo=timezone.utc).timestamp()
+                except ValueError:
+                    raise ValueError(f"Неверный формат {field}: '{params[field]}'. Ожидается: YYYY-MM-DD HH:MM:SS")
+        events = self.anomaly_engine.query_events(
+            sensor_index=sensor_index,
+            event_type=params.get("event_type") or None,
+            since=bounds.get("start_time"),
+            until=bounds.get("end_time")
+        )
+
+        names = {}
+        for name, sensor in sensors.items():
+            names.setdefault(sensor["index"], name)
+
+        def fmt(ts: Optional[float]) -> str:
+            return datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S") if ts else "продолжается"
+
+        lines = []
+        for event in events:
+            event["sensor_name"] = names.get(event["sensor_index"], f"#{event['sensor_index']}")
+            event["start_time"] = fmt(event["start_ts"])
+            event["end_time"] = fmt(event["end_ts"])
+            lines.append(
+                f"{CONFIG['event_names'].get(event['event_type'], event['event_type'])} {event['sensor_name']}: "
+                f"{event['start_time']} — {event['end_time']}, амплитуда {event['amplitude']:.1f}"
+            )
+        message = "\n".join(lines) if lines else "Событий не найдено"
+        self.logger.debug("Найдено событий: %d", len(events))
+        return {"result": {"events": events, "message": message}}
+
+    def run_report_job(self, params: Dict[str, Any], progress: Callable[[str, int, int], None]) -> Dict[str, Any]:
+        """Runner для ReportJobQueue: params — результат execute() для generate_report при defer_reports."""
+        start_dt = datetime.fromisoformat(params["start_time"])
+        end_dt = datetime.fromisoformat(params["end_time"])
+        return self.build_report(start_dt, end_dt, progress=progress)
+
     async def execute(self, formalized: Dict[str, Any]) -> Dict[str, Any]:
         """Выполняет действие на основе формализованного запроса, возвращая JSON-ответ."""
         self.logger.debug("Выполнение формализованного запроса: %s", formalized)
@@ -188,6 +324,7 @@ class ActionExecutor:
                 "plot_random_sensor": [],
                 "get_sensor_info": [],
                 "get_time_period": [],
+                "get_events": [],
                 "clarify": ["questions"]  # Добавлено для действия clarify
             }.get(action, [])
 
@@ -228,39 +365,51 @@ class ActionExecutor:
                 # Если требуется коррекция, вызываем error_corrector
                 if retry_count < max_retries:
                     self.logger.debug("Требуется коррекция (попытка %d/%d): %s", retry_count + 1, max_retries, correction_comments)
+                    corrections = {}
+                    if CONFIG["batch_validation"] and len(correction_data) > 1:
+                        corrections = await self._correct_batch(
+                            [dict(error, reason=correction_comments[i]) for i, error in enumerate(correction_data)],
+                            {"action": corrected_action, "parameters": corrected_params, "comment": comment},
+                            f"execution_correction_batch_{comment[:50]}_retry_{retry_count}"
+                        )
+
                     for error in correction_data:
                         field = error["field"]
                         value = error["value"]
                         prompt = error["prompt"]
-                        correction_input = json.dumps({
-                            "action": corrected_action,
-                            "parameters": corrected_params,
-                            "comment": comment,
-                            "error": {"field": field, "value": value, "prompt": prompt},
-                            "validation_comment": correction_comments[correction_data.index(error)]
-                        }, ensure_ascii=False)
-
-                        self.logger.debug("Отправка коррекции для поля %s: %s", field, correction_input)
-                        corrected = await self.error_corrector.correct(
-                            input_data=correction_input,
-                            prompt_addition=prompt,
-                            user_id=f"execution_correction_{field}_{comment[:50]}_retry_{retry_count}"
-                        )
-
-                        try:
-                            result = json.loads(corrected)
-                            self.logger.debug("Результат коррекции поля %s: %s", field, result)
-                            if field == "action":
-                                corrected_action = result.get("corrected_action", corrected_action)
-                            elif field == "sensor_name":
-                                corrected_params["sensor_name"] = result.get("corrected_name", value)
-                            elif field == "start_time":
-                                corrected_params["start_time"] = result.get("corrected_date", value)
-                            elif field == "end_time":
-                                corrected_params["end_time"] = result.get("corrected_date", value)
-                        except json.JSONDecodeError:
-                            self.logger.error("Ошибка парсинга ответа error_corrector для поля %s: %s", field, corrected)
-                            correction_comments.append(f"Ошибка формата JSON в ответе для поля {field}")
+                        if field in corrections:
+                            result = corrections[field]
+                        else:
+                            correction_input = json.dumps({
+                                "action": corrected_action,
+                                "parameters": corrected_params,
+                                "comment": comment,
+                                "error": {"field": field, "value": value, "prompt": prompt},
+                                "validation_comment": correction_comments[correction_data.index(error)]
+                            }, ensure_ascii=False)
+
+                            self.logger.debug("Отправка коррекции для поля %s: %s", field, correction_input)
+                            corrected = await self.error_corrector.correct(
+                                input_data=correction_input,
+                                prompt_addition=prompt,
+                                user_id=f"execution_correction_{field}_{comment[:50]}_retry_{retry_count}"
+                            )
+                            try:
+                                result = json.loads(corrected)
+                            except (TypeError, json.JSONDecodeError):
+                                self.logger.error("Ошибка парсинга ответа error_corrector для поля %s: %s", field, corrected)
+                                correction_comments.append(f"Ошибка формата JSON в ответе для поля {field}")
+                                continue
+
+                        self.logger.debug("Результат коррекции поля %s: %s", field, result)
+                        if field == "action":
+                            corrected_action = result.get("corrected_action", corrected_action)
+                        elif field == "sensor_name":
+                            corrected_params["sensor_name"] = result.get("corrected_name", value)
+                        elif field == "start_time":
+                            corrected_params["start_time"] = result.get("corrected_date", value)
+                        elif field == "end_time":
+                            corrected_params["end_time"] = result.get("corrected_date", value)
 
                     retry_count += 1
                     action = corrected_action
@@ -292,7 +441,7 @@ class ActionExecutor:
         """Валидирует действие и параметры, вызывая error_corrector только при необходимости."""
         self.logger.debug("Валидация действия %s с параметрами %s", action, params)
         validation_results = []
-        tasks = []
+        pending = []  # (значение, промпт, поле) для полей, требующих проверки через LLM
 
         try:
             if not isinstance(time_period, dict) or "start_time" not in time_period or "end_time" not in time_period:
@@ -309,9 +458,11 @@ class ActionExecutor:
             if action not in self.supported_actions:
                 prompt = CONFIG["prompts"]["validate_action"].format(
                     action=action,
-                    supported_actions=json.dumps(self.supported_actions, ensure_ascii=False)
+                    supported_actions=self.prompt_budget.static(
+                        "supported_actions", lambda: json.dumps(self.supported_actions, ensure_ascii=False))
                 )
-                tasks.append(self._correct_error(action, prompt, comment, "action"))
+                self.prompt_budget.measure("validate_action", prompt)
+                pending.append((action, prompt, "action"))
             else:
                 validation_results.append({
                     "is_valid": True,
@@ -326,11 +477,14 @@ class ActionExecutor:
             if "sensor_name" in validations:
                 sensor_name = params.get("sensor_name", "")
                 if sensor_name not in available_sensors:
+                    # В промпт уходят только ближайшие кандидаты, а не весь список датчиков
+                    candidates = self.prompt_budget.shortlist(sensor_name, available_sensors)
                     prompt = CONFIG["prompts"]["validate_sensor"].format(
                         sensor_name=sensor_name,
-                        available_sensors=json.dumps(available_sensors, ensure_ascii=False)
+                        available_sensors=json.dumps(candidates, ensure_ascii=False)
                     )
-                    tasks.append(self._correct_error(sensor_name, prompt, comment, "sensor_name"))
+                    self.prompt_budget.measure("validate_sensor", prompt)
+                    pending.append((sensor_name, prompt, "sensor_name"))
                 else:
                     validation_results.append({
                         "is_valid": True,
@@ -350,9 +504,10 @@ class ActionExecutor:
                         if not (start_range <= start_dt <= end_range):
                             prompt = CONFIG["prompts"]["validate_start_time"].format(
                                 start_time,
-                                f"{time_period['start_time']}–{time_period['end_time']}"
+                                f"{time_period['start_time']}–{time_period['end_time']}",
+                                **time_period
                             )
-                            tasks.append(self._correct_error(start_time, prompt, comment, "start_time"))
+                            pending.append((start_time, prompt, "start_time"))
                         else:
                             validation_results.append({
                                 "is_valid": True,
@@ -363,15 +518,17 @@ class ActionExecutor:
                     except ValueError:
                         prompt = CONFIG["prompts"]["validate_start_time"].format(
                             start_time,
-                            f"{time_period['start_time']}–{time_period['end_time']}"
+                            f"{time_period['start_time']}–{time_period['end_time']}",
+                            **time_period
                         )
-                        tasks.append(self._correct_error(start_time, prompt, comment, "start_time"))
+                        pending.append((start_time, prompt, "start_time"))
                 else:
                     prompt = CONFIG["prompts"]["validate_start_time"].format(
                         "",
-                        f"{time_period['start_time']}–{time_period['end_time']}"
+                        f"{time_period['start_time']}–{time_period['end_time']}",
+                        **time_period
                     )
-                    tasks.append(self._correct_error("", prompt, comment, "start_time"))
+                    pending.append(("", prompt, "start_time"))
 
             # Валидация конечной даты
             if "end_time" in validations:
@@ -384,9 +541,10 @@ class ActionExecutor:
                         if not (start_range <= end_dt <= end_range):
                             prompt = CONFIG["prompts"]["validate_end_time"].format(
                                 end_time,
-                                f"{time_period['start_time']}–{time_period['end_time']}"
+                                f"{time_period['start_time']}–{time_period['end_time']}",
+                                **time_period
                             )
-                            tasks.append(self._correct_error(end_time, prompt, comment, "end_time"))
+                            pending.append((end_time, prompt, "end_time"))
                         else:
                             validation_results.append({
                                 "is_valid": True,
@@ -397,18 +555,33 @@ class ActionExecutor:
                     except ValueError:
                         prompt = CONFIG["prompts"]["validate_end_time"].format(
                             end_time,
-                            f"{time_period['start_time']}–{time_period['end_time']}"
+                            f"{time_period['start_time']}–{time_period['end_time']}",
+                            **time_period
                         )
-                        tasks.append(self._correct_error(end_time, prompt, comment, "end_time"))
+                        pending.append((end_time, prompt, "end_time"))
                 else:
                     prompt = CONFIG["prompts"]["validate_end_time"].format(
                         "",
-                        f"{time_period['start_time']}–{time_period['end_time']}"
+                        f"{time_period['start_time']}–{time_period['end_time']}",
+                        **time_period
+                    )
+                    pending.append(("", prompt, "end_time"))
+
+            if pending:
+                results = []
+                if CONFIG["batch_validation"] and len(pending) > 1:
+                    batch = await self._correct_batch(
+                        [{"field": field, "value": value, "prompt": prompt} for value, prompt, field in pending],
+                        {"action": action, "parameters": params, "comment": comment},
+                        f"action_executor_batch_{comment[:50]}"
+                    )
+                    results = [(json.dumps(batch[field], ensure_ascii=False), field) for _, _, field in pending if field in batch]
+                    pending = [item for item in pending if item[2] not in batch]
+                if pending:
+                    results += await asyncio.gather(
+                        *(self._correct_error(value, prompt, comment, field) for value, prompt, field in pending),
+                        return_exceptions=True
                     )
-                    tasks.append(self._correct_error("", prompt, comment, "end_time"))
-
-            if tasks:
-                results = await asyncio.gather(*tasks, return_exceptions=True)
                 for task_result in results:
                     if isinstance(task_result, Exception):
                         self.logger.error("Ошибка валидации: %s", task_result)
@@ -448,6 +621,56 @@ class ActionExecutor:
                 "original_field": "general"
             }]
 
+    async def _correct_batch(self, fields: list, request: Dict[str, Any], user_id: str) -> Dict[str, Dict[str, Any]]:
+        """Исправляет несколько полей одним запросом к LLM.
+
+        Возвращает {поле: результат} только для полей с корректным ответом; остальные
+        вызывающий код исправляет по одному.
+        """
+        names = [item["field"] for item in fields]
+        self.logger.debug("Пакетная коррекция полей: %s", names)
+        prompt = CONFIG["prompts"]["validate_batch"].format(fields="\n".join(
+            f"- {item['field']} (значение: '{item['value']}'): {item['prompt']}" for item in fields
+        ))
+        self.prompt_budget.measure("validate_batch", prompt)
+        input_data = json.dumps(dict(request, fields=[
+            {key: item[key] for key in ("field", "value", "reason") if key in item} for item in fields
+        ]), ensure_ascii=False)
+        try:
+            async with asyncio.timeout(CONFIG["llm_timeout"]):
+                corrected = await self.error_corrector.correct(
+                    input_data=input_data,
+                    prompt_addition=prompt,
+                    user_id=user_id
+                )
+        except Exception as e:
+            self.logger.error("Ошибка пакетной коррекции: %s", e)
+            self.logger.error("Трассировка стека: %s", traceback.format_exc())
+            corrected = None
+
+        if not corrected:
+            # Корректор уже исчерпал свои повторы — по одному полю спрашивать бессмысленно
+            return {field: {
+                "is_valid": False,
+                "reason": f"Пустой ответ от корректора для {field}",
+                "message": "Ошибка обработки данных. Попробуйте снова"
+            } for field in names}
+
+        try:
+            parsed = json.loads(corrected)
+        except (TypeError, ValueError) as e:
+            self.logger.debug("Пакетный ответ не разобран, переход к коррекции по полям: %s", e)
+            return {}
+
+        if not isinstance(parsed, dict):
+            self.logger.debug("Пакетный ответ не является объектом, переход к коррекции по полям: %s", corrected)
+            return {}
+        results = {field: parsed[field] for field in names if isinstance(parsed.get(field), dict)}
+        missing = [field for field in names if field not in results]
+        if missing:
+            self.logger.debug("В пакетном ответе нет полей %s, они будут исправлены по отдельности", missing)
+        return results
+
     async def _correct_error(self, input_data: str, prompt_addition: str, comment: str, validation_type: str) -> tuple[Optional[str], str]:
         """Исправляет ошибку с помощью ErrorCorrector, возвращает результат и тип валидации."""
         self.logger.debug("Исправление ошибки: input=%s, type=%s", input_data, validation_type)
@@ -594,46 +817,14 @@ class ActionExecutor:
                 if start_dt >= end_dt:
                     raise ValueError("start_time должен быть раньше end_time")
 
-                # ───── Генерация отчёта ─────
-                try:
-                        plot_paths, pdf_path, docx_path = self.data_processor.generate_report(
-                            start_time=start_dt,
-                            end_time=end_dt,
-                            output_dir="Bot_Reports",
-                            logger=self.logger
-                        )
-                except Exception as exc:
-                    self.logger.error("Ошибка генерации отчёта КЗ201: %s", exc)
-                    self.logger.error(traceback.format_exc())
-                    raise RuntimeError(f"Не удалось сгенерировать отчёт: {exc}")
-
-                # === Собираем ВСЕ файлы для отправки ===
-                files_to_send = []
-
-                if pdf_path and pdf_path.exists():
-                    files_to_send.append(("PDF", pdf_path))
-                if docx_path and docx_path.exists():
-                    files_to_send.append(("DOCX", docx_path))
-                for i, plot_path in enumerate(plot_paths, 1):
-                    if plot_path and plot_path.exists():
-                        files_to_send.append((f"График {i}", plot_path))
-
-                # === Ответ боту ===
-                result = {
-                    "result": {
-                        "files": [
-                            {"type": file_type, "path": str(path)} for file_type, path in files_to_send
-                        ],
-                        "message": (
-                            f"**Отчёт КЗ201 готов** (7 файлов)\n"
-                            f"`{start_dt.strftime('%d.%m.%Y %H:%M')} — {end_dt.strftime('%d.%m.%Y %H:%M')}`\n"
-                            f"PDF + DOCX + 5 графиков"
-                        )
-                    }
-                }
-                self.logger.info("Отчёт КЗ201: подготовлено %d файлов", len(files_to_send))
-                return result
+                if self.defer_reports:
+                    result = {"result": {"report_job": {"start_time": start_dt.isoformat(), "end_time": end_dt.isoformat()}}}
+                    self.logger.debug("Отчёт КЗ201 передан в очередь задач: %s", result)
+                    return result
+                return self.build_report(start_dt, end_dt)
 
+            if action == "get_events":
+                return self._get_events(params)
 
             raise ValueError(f"Неизвестное действие: {action}")
         except Exception as e:
@@ -5,6 +5,8 @@ from datetime import datetime
 import traceback
 import g4f
 
+from Utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+
 
 
 CONFIG = {
@@ -44,6 +46,7 @@ SUPPORTED_ACTIONS = {
     "print_sensor_info": "Показать информацию о конкретном датчике",
     "get_time_period": "Показать временной диапазон данных",
     "generate_report": "Прислать отчёт по криогенному замедлителю за указанный период",
+    "get_events": "Показать найденные события (глюки, переходы, аномалии) по датчику или за период",
     "clarify": "Задать уточняющие вопросы при неполных данных"
 }
 
@@ -117,6 +120,7 @@ PROMPTS = {
 - Если запрос запрашивает график случайного датчика (например, 'случайный график', 'график любого датчика', 'случайного датчика'), используй действие 'plot_random_sensor' без параметров.
 - Если история переписки содержит уточнения (например, пользователь повторяет 'случайный' или 'любой' после запроса 'clarify'), интерпретируй это как подтверждение действия 'plot_random_sensor'.
 - Если запрос касается отчёта по криогенному замедлителю (например, 'отчёт', 'report', 'прислать отчёт', 'отчёт за период'), используй действие 'generate_report' с параметрами start_time и end_time (нормализуй даты по правилам периода). Если период не указан, используй дефолтный май текущего года. 
+- Если запрос про события, аномалии, глюки или скачки (например, 'были ли аномалии', 'что случилось с т1 вчера'), используй действие 'get_events'; sensor_name, start_time, end_time и event_type (glitch, transition, anomaly) указывай, только если они есть в запросе.
 
 
 ### Инструкции если ТЕБЯ оскорбляют
@@ -150,6 +154,7 @@ PROMPTS = {
 - "Как же меня достали эти тупые люди" -> {{"classification": "free", "action": "free_response", "parameters": {{}}, "response": "Понял тебя! Чем могу помочь с датчиками?", "comment": "Свободный запрос"}}
 - "Вот люди тупые реально, не то что ты"  -> {{"classification": "free", "action": "free_response", "parameters": {{}}, "response": "Конечно, я же не кожаный мешок!", "comment": "Свободный запрос"}}
 - "Пришли отчёт за май" -> {{"classification": "formal", "action": "generate_report", "parameters": {{"start_time": "2025-05-01 00:00:00", "end_time": "2025-05-31 23:59:59"}}, "comment": "Запрос отчёта по дефолтному периоду мая"}}
+- "Были аномалии на т1?" -> {{"classification": "formal", "action": "get_events", "parameters": {{"sensor_name": "T01 (DT51)", "event_type": "anomaly"}}, "comment": "Запрос аномалий датчика T01 (DT51)"}}
 - "Отчёт по криогенному замедлителю за 15-20 июня" -> {{"classification": "formal", "action": "generate_report", "parameters": {{"start_time": "2025-06-15 00:00:00", "end_time": "2025-06-20 23:59:59"}}, "comment": "Запрос отчёта за указанный период июня"}}
 
 
@@ -192,6 +197,7 @@ class RequestFormalizer:
         self.debug_mode = debug_mode
         self.logger = logger or logging.getLogger(__name__)
         self.supported_actions = SUPPORTED_ACTIONS
+        self.breaker = CircuitBreaker(CONFIG["llm_model"], max_timeout=CONFIG["llm_timeout"], logger=self.logger)
 
         # Проверка time_period
         try:
@@ -210,31 +216,38 @@ class RequestFormalizer:
         self.logger.debug("Запрос к LLM: %s", prompt)
         for attempt in range(CONFIG["retry_attempts"] + 1):
             try:
-                async with asyncio.timeout(CONFIG["llm_timeout"]):
-                    response = await asyncio.to_thread(
-                        g4f.ChatCompletion.create,
-                        model=CONFIG["llm_model"],
-                        messages=[{"role": "user", "content": prompt}],
-                        verify=False,
-                    )
-                    response = response.strip()
-                    if response.startswith("```json"):
-                        response = response.removeprefix("```json").removesuffix("```").strip()
-                    self.logger.debug("Сырой LLM ответ (попытка %d): %s", attempt + 1, response)
-                    return response
+                response = await self.breaker.call(lambda: asyncio.to_thread(
+                    g4f.ChatCompletion.create,
+                    model=CONFIG["llm_model"],
+                    messages=[{"role": "user", "content": prompt}],
+                    verify=False,
+                ))
+                response = response.strip()
+                if response.startswith("```json"):
+                    response = response.removeprefix("```json").removesuffix("```").strip()
+                self.logger.debug("Сырой LLM ответ (попытка %d): %s", attempt + 1, response)
+                return response
+            except CircuitOpenError:
+                # Бэкенд недоступен — отвечаем сразу, не тратя таймауты на повторы
+                self.logger.error("LLM %s временно недоступна, возвращается запасной ответ", CONFIG["llm_model"])
+                return self._fallback_response("LLM временно недоступна", "Сервис временно недоступен. Пожалуйста, повторите запрос чуть позже.")
             except Exception as e:
                 error_msg = f"{type(e).__name__}: {e}"
                 self.logger.error("Ошибка LLM (попытка %d/%d): %s", attempt + 1, CONFIG["retry_attempts"], error_msg)
-                if attempt < CONFIG["retry_attempts"]:
+                if attempt < CONFIG["retry_attempts"] and not self.breaker.is_open:
                     await asyncio.sleep(CONFIG["retry_interval"])
                 else:
-                    self.logger.critical("Не удалось получить ответ от LLM после %d попыток", CONFIG["retry_attempts"])
-                    return json.dumps({
-                        "classification": "formal",
-                        "action": "clarify",
-                        "parameters": {"questions": ["Пожалуйста, уточните запрос."]},
-                        "comment": "Ошибка LLM"
-                    })
+                    self.logger.critical("Не удалось получить ответ от LLM после %d попыток", attempt + 1)
+                    return self._fallback_response("Ошибка LLM")
+
+    @staticmethod
+    def _fallback_response(comment: str, question: str = "Пожалуйста, уточните запрос.") -> str:
+        return json.dumps({
+            "classification": "formal",
+            "action": "clarify",
+            "parameters": {"questions": [question]},
+            "comment": comment
+        }, ensure_ascii=False)
 
     def format_history(self, history: list[dict], max_chars: int = 2000) -> str:
         """Форматирует историю переписки с ограничением длины."""
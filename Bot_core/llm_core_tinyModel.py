@@ -7,6 +7,9 @@ import httpx
 from datetime import datetime
 import traceback
 
+from Utils.sensor_index import SensorIndex
+from Utils.prompt_budget import PromptBudget
+
 CONFIG = {
     "llm_model": "o4-mini",
     "llm_timeout": 60,
@@ -315,18 +318,21 @@ class ActionRevalidator:
             return {"is_valid": False, "corrected_action": "clarify", "comment": f"Ошибка обработки: {str(e)}"}
 
 class FieldFormalizer:
-    def __init__(self, llm_request_func, prompts: Dict[str, str], available_sensors: List[str], debug_mode: bool = False, logger: logging.Logger = None):
+    def __init__(self, llm_request_func, prompts: Dict[str, str], available_sensors: List[str], debug_mode: bool = False, logger: logging.Logger = None, prompt_budget: PromptBudget = None):
         self.llm_request_func = llm_request_func
         self.prompts = prompts
         self.available_sensors = available_sensors
         self.debug_mode = debug_mode
         self.logger = logger or logging.getLogger(__name__)
+        self.prompt_budget = prompt_budget or PromptBudget(logger=self.logger)
         self.logger.debug("FieldFormalizer инициализирован")
 
     async def formalize_sensor(self, message: str, context: str, draft_sensor: str, comment: str) -> Dict:
         self.logger.debug("Формализация датчика: %s", draft_sensor)
         try:
-            prompt = self.prompts["formalize_sensor"].format(message, context, draft_sensor, comment, ", ".join(self.available_sensors))
+            candidates = self.prompt_budget.shortlist(draft_sensor or message, self.available_sensors)
+            prompt = self.prompts["formalize_sensor"].format(message, context, draft_sensor, comment, ", ".join(candidates))
+            self.prompt_budget.measure("formalize_sensor", prompt)
             response = await self.llm_request_func(prompt, self.debug_mode, self.logger)
             result = json.loads(response)
             self.logger.debug("Результат формализации датчика: %s", result)
@@ -363,11 +369,12 @@ class FieldFormalizer:
             return {"end_time": "", "comment": f"Ошибка обработки: {str(e)}"}
 
 class FieldValidators:
-    def __init__(self, llm_request_func, prompts: Dict[str, str], debug_mode: bool = False, logger: logging.Logger = None):
+    def __init__(self, llm_request_func, prompts: Dict[str, str], debug_mode: bool = False, logger: logging.Logger = None, prompt_budget: PromptBudget = None):
         self.llm_request_func = llm_request_func
         self.prompts = prompts
         self.debug_mode = debug_mode
         self.logger = logger or logging.getLogger(__name__)
+        self.prompt_budget = prompt_budget or PromptBudget(logger=self.logger)
         self.logger.debug("FieldValidators инициализирован")
 
     async def validate_sensor(self, sensor_name: str, sensors: List[str]) -> Dict:
@@ -376,7 +383,8 @@ class FieldValidators:
             self.logger.debug("Не указан датчик")
             return {"is_valid": False, "corrected_name": "", "comment": "Не указан датчик"}
         try:
-            prompt = self.prompts["validate_sensor"].format(sensor_name, ", ".join(sensors))
+            prompt = self.prompts["validate_sensor"].format(sensor_name, ", ".join(self.prompt_budget.shortlist(sensor_name, sensors)))
+            self.prompt_budget.measure("validate_sensor", prompt)
             response = await self.llm_request_func(prompt, self.debug_mode, self.logger)
             result = json.loads(response)
             self.logger.debug("Результат валидации датчика: %s", result)
@@ -463,7 +471,8 @@ class RequestFormalizer:
         available_sensors: List[str],
         time_period: Dict[str, str],
         debug_mode: bool = False,
-        logger: logging.Logger = None
+        logger: logging.Logger = None,
+        prompt_budget: PromptBudget = None
     ):
         self.data_reader = data_reader
         self.error_corrector = error_corrector
@@ -481,6 +490,8 @@ class RequestFormalizer:
         self.time_period = time_period
         self.debug_mode = debug_mode
         self.logger = logger or logging.getLogger(__name__)
+        self.sensor_index = SensorIndex(available_sensors, logger=self.logger)
+        self.prompt_budget = prompt_budget or PromptBudget(logger=self.logger)
 
         try:
             if not all(key in time_period for key in ["start_time", "end_time"]):
@@ -493,10 +504,19 @@ class RequestFormalizer:
 
         self.logger.debug("RequestFormalizer инициализирован")
 
+    def _get_sensor_index(self, available_sensors: List[str]) -> SensorIndex:
+        """Возвращает индекс датчиков, перестраивая его только при смене списка."""
+        if self.sensor_index.names != list(available_sensors):
+            self.sensor_index = SensorIndex(available_sensors, logger=self.logger)
+        return self.sensor_index
+
     async def extract_draft_parameters(self, message: str) -> Dict:
         self.logger.debug("Черновое извлечение параметров из: %s", message)
         try:
-            sensor_prompt = self.prompts["extract_draft_sensor"].format(message, ", ".join(self.available_sensors))
+            sensor_prompt = self.prompts["extract_draft_sensor"].format(
+                message, ", ".join(self.prompt_budget.shortlist(message, self.available_sensors))
+            )
+            self.prompt_budget.measure("extract_draft_sensor", sensor_prompt)
             start_time_prompt = self.prompts["extract_draft_start_time"].format(message)
             end_time_prompt = self.prompts["extract_draft_end_time"].format(message)
             sensor_response, start_time_response, end_time_response = await asyncio.gather(
@@ -534,14 +554,17 @@ class RequestFormalizer:
                 user_id="empty_request"
             )
 
-        functions = "\n".join(f"{action}: {desc}" for action, desc in self.supported_actions.items())
+        functions = self.prompt_budget.static(
+            "functions", lambda: "\n".join(f"{action}: {desc}" for action, desc in self.supported_actions.items())
+        )
         history_str = "\n".join(f"{'Bot' if entry.get('is_bot', False) else 'User'}: {entry.get('message', '')}" for entry in history)
 
         try:
             # Этап 1: Параллельное выполнение classify, function, context, extract_draft
             classification_task = self.classifier.classify(message, history_str, functions)
             function_task = self.function_identifier.identify(message, functions)
-            context_task = self.context_extractor.extract(message, history_str, ", ".join(available_sensors), f"{time_period['start_time']}–{time_period['end_time']}")
+            context_sensors = ", ".join(self.prompt_budget.shortlist(message, available_sensors))
+            context_task = self.context_extractor.extract(message, history_str, context_sensors, f"{time_period['start_time']}–{time_period['end_time']}")
             draft_params_task = self.extract_draft_parameters(message)
             classification, function, context, draft_params = await asyncio.gather(
                 classification_task, function_task, context_task, draft_params_task
@@ -659,26 +682,8 @@ class RequestFormalizer:
                     # Предварительная попытка исправления имени датчика без LLM
                     corrected_sensor = None
                     if sensor_name:
-                        # Нормализация: убираем лишние пробелы, заменяем 'Т' на 'T', приводим к верхнему регистру
-                        normalized_sensor = sensor_name.strip().replace('Т', 'T').upper()
-                        # Проверяем возможные форматы и опечатки
-                        for available_sensor in available_sensors:
-                            main_sensor_part = available_sensor.split(' (')[0].strip().upper()
-                            alt_sensor_part = available_sensor[available_sensor.find('(')+1:available_sensor.find(')')].upper().replace(' ', '') if '(' in available_sensor else ''
-                            # Точное совпадение основной части (например, 'T08' из 'T08 (T34)')
-                            if normalized_sensor == main_sensor_part:
-                                corrected_sensor = available_sensor
-                                break
-                            # Совпадение альтернативного обозначения (например, 'T34' или 'T08T34' из 'T08 (T34)')
-                            if alt_sensor_part and (normalized_sensor == alt_sensor_part or normalized_sensor.replace(' ', '') == f"{main_sensor_part}{alt_sensor_part}"):
-                                corrected_sensor = available_sensor
-                                break
-                            # Совпадение с форматом T01-T24 (например, 'T8' -> 'T08')
-                            if normalized_sensor in [f"T{i:02d}" for i in range(1, 25)] or normalized_sensor.lstrip('T').zfill(2) in [f"{i:02d}" for i in range(1, 25)]:
-                                target_sensor = f"T{normalized_sensor.lstrip('T').zfill(2)}"
-                                corrected_sensor = next((s for s in available_sensors if s.split(' (')[0].strip().upper() == target_sensor), None)
-                                break
-
+                        # Поиск по индексу: гомоглифы (Т/T), ведущие нули, алиасы в скобках; похожие, но другие датчики не подставляются
+                        corrected_sensor = self._get_sensor_index(available_sensors).resolve(sensor_name)
                     if corrected_sensor and corrected_sensor in available_sensors:
                         final_parameters["sensor_name"] = corrected_sensor
                         comments.append(f"Датчик исправлен с '{sensor_name}' на '{corrected_sensor}' через предварительную нормализацию")
@@ -695,9 +700,11 @@ class RequestFormalizer:
                             correction_data.append({
                                 "field": "sensor_name",
                                 "value": sensor_name,
-                                "prompt": self.prompts["validate_sensor"].format(sensor_name, ", ".join(available_sensors))
+                                "prompt": self.prompts["validate_sensor"].format(
+                                    sensor_name, ", ".join(self.prompt_budget.shortlist(sensor_name, available_sensors))
+                                )
                             })
-                            correction_comments.append(f"Датчик '{sensor_name}' отсутствует в списке доступных: {', '.join(available_sensors)}")
+                            correction_comments.append(f"Датчик '{sensor_name}' отсутствует в списке доступных датчиков")
                             self.logger.debug("Датчик не исправлен через нормализацию или валидацию, передан на коррекцию: %s", sensor_name)
 
             # Проверка начальной даты
@@ -869,7 +876,10 @@ class RequestFormalizer:
                     correction_data.append({
                         "field": "sensor_name",
                         "value": parameters.get("sensor_name", ""),
-                        "prompt": self.prompts["validate_sensor"].format(parameters.get("sensor_name", ""), ", ".join(available_sensors))
+                        "prompt": self.prompts["validate_sensor"].format(
+                            parameters.get("sensor_name", ""),
+                            ", ".join(self.prompt_budget.shortlist(parameters.get("sensor_name", ""), available_sensors))
+                        )
                     })
                     correction_comments.append(f"Датчик {parameters.get('sensor_name', '')} отсутствует")
                 if "start_time" in required_params and parameters.get("start_time"):
@@ -974,14 +984,15 @@ def create_request_formalizer(
     llm_request_func = _llm_request
     prompts = PROMPTS
     supported_actions = SUPPORTED_ACTIONS
+    prompt_budget = PromptBudget(logger=logger)
 
     try:
         classifier = RequestClassifier(llm_request_func, prompts, debug_mode, logger)
         function_identifier = FunctionIdentifier(llm_request_func, prompts, debug_mode, logger)
         context_extractor = ContextExtractor(llm_request_func, prompts, debug_mode, logger)
         action_revalidator = ActionRevalidator(llm_request_func, prompts, debug_mode, logger)
-        field_formalizer = FieldFormalizer(llm_request_func, prompts, available_sensors, debug_mode, logger)
-        field_validators = FieldValidators(llm_request_func, prompts, debug_mode, logger)
+        field_formalizer = FieldFormalizer(llm_request_func, prompts, available_sensors, debug_mode, logger, prompt_budget)
+        field_validators = FieldValidators(llm_request_func, prompts, debug_mode, logger, prompt_budget)
         free_response = FreeResponseGenerator(llm_request_func, prompts, MESSAGES, debug_mode, logger)
 
         formalizer = RequestFormalizer(
@@ -1000,7 +1011,8 @@ def create_request_formalizer(
             available_sensors,
             time_period,
             debug_mode,
-            logger
+            logger,
+            prompt_budget
         )
         logger.debug("RequestFormalizer успешно создан")
         return formalizer
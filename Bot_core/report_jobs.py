@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+CONFIG = {
+    "workers": 1,                   # Одновременно собираемых отчётов
+    "max_active_per_user": 2,       # Задач пользователя в очереди и в работе; дальше — отказ
+    "progress_interval": 2.0,       # Секунд между правками статусного сообщения внутри одного этапа
+}
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+ACTIVE = (QUEUED, RUNNING)
+
+ProgressCallback = Callable[[str, int, int], None]
+
+
+class JobCancelled(Exception):
+    """Задача отменена пользователем; выбрасывается из колбэка прогресса внутри генерации."""
+
+
+class JobLimitError(Exception):
+    """У пользователя уже максимум активных задач."""
+
+
+class ReportJobQueue:
+    """Персистентная очередь задач генерации отчётов.
+
+    Задачи хранятся в SQLite и переживают перезапуск: при start() незавершённые задачи снова
+    ставятся в очередь. Пул воркеров выполняет runner(params, progress) в потоках, прогресс и
+    результат передаются асинхронным колбэкам бота. Отмена кооперативная: колбэк прогресса
+    выбрасывает JobCancelled на ближайшем этапе.
+    """
+
+    def __init__(self, db_path: str, runner: Callable[[Dict[str, Any], ProgressCallback], Dict[str, Any]],
+                 workers: int = CONFIG["workers"], max_active_per_user: int = CONFIG["max_active_per_user"],
+                 logger: logging.Logger = None):
+        self.db_path = db_path
+        self.runner = runner
+        self.workers = workers
+        self.max_active_per_user = max_active_per_user
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._cancel_events: Dict[str, threading.Event] = {}
+        self._on_progress = None
+        self._on_finished = None
+        with self._connection() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS report_jobs (
+                    id TEXT PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    chat_id INTEGER NOT NULL,
+                    status_message_id INTEGER,
+                    params TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    progress TEXT,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_report_jobs_status ON report_jobs(status, created_at)")
+        self.logger.debug("ReportJobQueue инициализирована: %s", db_path)
+
+    def _get_connection(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        conn = self._get_connection()
+        try:
+            with self._lock, conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _query(self, sql: str, params: tuple = ()) -> List[Dict[str, Any]]:
+        with self._connection() as conn:
+            return [dict(row) for row in conn.execute(sql, params).fetchall()]
+
+    def _update(self, job_id: str, expected: Optional[tuple] = None, **fields) -> bool:
+        """Обновляет поля задачи; при expected — только если её статус среди ожидаемых."""
+        fields["updated_at"] = time.time()
+        sql = "UPDATE report_jobs SET " + ", ".join(f"{name} = ?" for name in fields) + " WHERE id = ?"
+        params = tuple(fields.values()) + (job_id,)
+        if expected:
+            sql += " AND status IN (" + ", ".join("?" for _ in expected) + ")"
+            params += tuple(expected)
+        with self._connection() as conn:
+            return conn.execute(sql, params).rowcount == 1
+
+    # --- Публичный API ---------------------------------------------------------------------
+
+    def submit(self, user_id: int, chat_id: int, params: Dict[str, Any]) -> str:
+        """Создаёт задачу и ставит её в очередь; возвращает идентификатор задачи."""
+        job_id = uuid.uuid4().hex[:8]
+        now = time.time()
+        # Проверка лимита и вставка — один оператор: параллельные submit (в том числе из других
+        # процессов с той же БД) не проскочат лимит между подсчётом и записью
+        with self._connection() as conn:
+            inserted = conn.execute(
+                "INSERT INTO report_jobs (id, user_id, chat_id, params, status, created_at, updated_at)"
+                " SELECT ?, ?, ?, ?, ?, ?, ?"
+                " WHERE (SELECT COUNT(*) FROM report_jobs WHERE user_id = ? AND status IN (?, ?)) < ?",
+                (job_id, user_id, chat_id, json.dumps(params, ensure_ascii=False), QUEUED, now, now, user_id)
+                + ACTIVE + (self.max_active_per_user,)
+            ).rowcount
+        if not inserted:
+            raise JobLimitError(f"У пользователя уже {self.max_active_per_user} активных задач")
+        if self._queue is not None:
+            self._queue.put_nowait(job_id)
+        self.logger.info("Задача отчёта %s поставлена в очередь: user_id=%s, params=%s", job_id, user_id, params)
+        return job_id
+
+    def set_status_message(self, job_id: str, message_id: int) -> None:
+        """Запоминает сообщение, которое редактируется по ходу выполнения задачи."""
+        self._update(job_id, status_message_id=message_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        rows = self._query("SELECT * FROM report_jobs WHERE id = ?", (job_id,))
+        return rows[0] if rows else None
+
+    def active_jobs(self, user_id: int) -> List[Dict[str, Any]]:
+        return self._query(
+            "SELECT * FROM report_jobs WHERE user_id = ? AND status IN (?, ?) ORDER BY created_at", (user_id,) + ACTIVE
+        )
+
+    def cancel(self, user_id: int, job_id: Optional[str] = None) -> List[str]:
+        """Отменяет задачу пользователя (или все его активные задачи); возвращает отменённые id."""
+        cancelled = []
+        for job in self.active_jobs(user_id):
+            if job_id and job["id"] != job_id:
+                continue
+            if self._update(job["id"], expected=(QUEUED,), status=CANCELLED):
+                cancelled.append(job["id"])
+            elif job["id"] in self._cancel_events:
+                # Выполняющаяся задача остановится на ближайшем этапе
+                self._cancel_events[job["id"]].set()
+                cancelled.append(job["id"])
+        if cancelled:
+            self.logger.info("Отменены задачи пользователя %s: %s", user_id, cancelled)
+        return cancelled
+
+    # --- Воркеры ---------------------------------------------------------------------------
+
+    async def start(self, on_progress: Callable[[Dict[str, Any], str, int, int], Awaitable[Any]],
+                    on_finished: Callable[[Dict[str, Any]], Awaitable[Any]]) -> None:
+        """Запускает воркеры и возвращает в очередь задачи, не завершённые до перезапуска."""
+        if self._tasks:
+            return
+        self._on_progress = on_progress
+        self._on_finished = on_finished
+        self._queue = asyncio.Queue()
+        self._query("UPDATE report_jobs SET status = ? WHERE status = ?", (QUEUED, RUNNING))
+        pending = self._query("SELECT id FROM report_jobs WHERE status = ? ORDER BY created_at", (QUEUED,))
+        for row in pending:
+            self._queue.put_nowait(row["id"])
+        if self._queue.qsize():
+            self.logger.info("Возобновлено задач отчётов после перезапуска: %d", self._queue.qsize())
+        self._tasks = [asyncio.create_task(self._worker(n)) for n in range(self.workers)]
+
+    async def stop(self) -> None:
+        """Останавливает воркеры; выполнявшиеся задачи будут возобновлены при следующем start()."""
+        for event in self._cancel_events.values():
+            event.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self, number: int) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error("Ошибка воркера отчётов %d: %s", number, e)
+                self.logger.error("Трассировка стека: %s", traceback.format_exc())
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str) -> None:
+        if not self._update(job_id, expected=(QUEUED,), status=RUNNING):
+            return  # Отменена, пока ждала в очереди
+        job = self.get(job_id)
+        loop = asyncio.get_running_loop()
+        cancel_event = self._cancel_events[job_id] = threading.Event()
+        last = {"stage": None, "time": 0.0}
+
+        def progress(stage: str, done: int, total: int) -> None:
+            if cancel_event.is_set():
+                raise JobCancelled(job_id)
+            now = time.monotonic()
+            if stage == last["stage"] and done < total and now - last["time"] < CONFIG["progress_interval"]:
+                return
+            last.update(stage=stage, time=now)
+            self._update(job_id, progress=json.dumps({"stage": stage, "done": done, "total": total}))
+            asyncio.run_coroutine_threadsafe(self._notify_progress(job_id, stage, done, total), loop)
+
+        self.logger.debug("Старт задачи отчёта %s", job_id)
+        try:
+            result = await asyncio.to_thread(self.runner, json.loads(job["params"]), progress)
+            status = CANCELLED if cancel_event.is_set() else DONE
+            self._update(job_id, status=status, result=json.dumps(result, ensure_ascii=False))
+        except JobCancelled:
+            self._update(job_id, status=CANCELLED)
+        except asyncio.CancelledError:
+            # Остановка бота: задача останется running и будет возобновлена при следующем запуске
+            raise
+        except Exception as e:
+            self.logger.error("Задача отчёта %s завершилась ошибкой: %s", job_id, e)
+            self.logger.error("Трассировка стека: %s", traceback.format_exc())
+            self._update(job_id, status=FAILED, error=str(e))
+        finally:
+            self._cancel_events.pop(job_id, None)
+        job = self.get(job_id)
+        self.logger.info("Задача отчёта %s: %s", job_id, job["status"])
+        if self._on_finished:
+            try:
+                await self._on_finished(job)
+            except Exception as e:
+                self.logger.error("Ошибка доставки результата задачи %s: %s", job_id, e)
+                self.logger.error("Трассировка стека: %s", traceback.format_exc())
+
+    async def _notify_progress(self, job_id: str, stage: str, done: int, total: int) -> None:
+        if not self._on_progress:
+            return
+        try:
+            await self._on_progress(self.get(job_id), stage, done, total)
+        except Exception as e:
+            self.logger.error("Ошибка уведомления о прогрессе задачи %s: %s", job_id, e)
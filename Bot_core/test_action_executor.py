@@ -258,3 +258,37 @@ async def test_error_corrector_exception(action_executor, mock_error_corrector):
     })
     assert "validation_results" in res
     assert any("Ошибка валидации" in v["reason"] for v in res["validation_results"])
+
+@pytest.mark.asyncio
+async def test_validate_action_batches_invalid_fields(action_executor, mock_error_corrector):
+    mock_error_corrector.correct.side_effect = None
+    mock_error_corrector.correct.return_value = json.dumps({
+        "sensor_name": {"is_valid": True, "corrected_name": "TemperatureSensor1", "reason": "", "message": ""},
+        "start_time": {"is_valid": True, "corrected_date": "2023-05-01 00:00:00", "reason": "", "message": ""}
+    })
+    results = await action_executor._validate_action(
+        "plot_selected_sensor",
+        {"sensor_name": "Temp1", "start_time": "май", "end_time": "2023-06-01 00:00:00"},
+        "batch",
+        ["TemperatureSensor1", "HumiditySensor2"],
+        {"start_time": "2023-01-01 00:00:00", "end_time": "2023-12-31 23:59:59"}
+    )
+    assert mock_error_corrector.correct.await_count == 1
+    by_field = {r["original_field"]: r for r in results}
+    assert by_field["sensor_name"]["corrected_name"] == "TemperatureSensor1"
+    assert by_field["start_time"]["corrected_date"] == "2023-05-01 00:00:00"
+    assert by_field["end_time"]["is_valid"]
+
+@pytest.mark.asyncio
+async def test_validate_action_batch_falls_back_per_field(action_executor, mock_error_corrector):
+    field_reply = json.dumps({"is_valid": False, "reason": "per-field", "message": ""})
+    mock_error_corrector.correct.side_effect = ["not json", field_reply, field_reply]
+    results = await action_executor._validate_action(
+        "plot_selected_sensor",
+        {"sensor_name": "Temp1", "start_time": "май", "end_time": "2023-06-01 00:00:00"},
+        "fallback",
+        ["TemperatureSensor1", "HumiditySensor2"],
+        {"start_time": "2023-01-01 00:00:00", "end_time": "2023-12-31 23:59:59"}
+    )
+    assert mock_error_corrector.correct.await_count == 3
+    assert sorted(r["original_field"] for r in results if r.get("reason") == "per-field") == ["sensor_name", "start_time"]
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import threading
+import pytest
+from Bot_core.report_jobs import ReportJobQueue, JobLimitError, CANCELLED, DONE, FAILED
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "jobs.db")
+
+def run_jobs(queue, expected, timeout=5.0):
+    """Запускает воркеры и ждёт expected завершённых задач; возвращает их и события прогресса."""
+    async def scenario():
+        finished, progress = [], []
+        done = asyncio.Event()
+
+        async def on_progress(job, stage, current, total):
+            progress.append((job["id"], stage, current, total))
+
+        async def on_finished(job):
+            finished.append(job)
+            if len(finished) >= expected:
+                done.set()
+
+        await queue.start(on_progress, on_finished)
+        await asyncio.wait_for(done.wait(), timeout)
+        await asyncio.sleep(0)
+        await queue.stop()
+        return finished, progress
+    return asyncio.run(scenario())
+
+def test_job_runs_and_reports_progress(db_path):
+    def runner(params, progress):
+        for i in range(1, 4):
+            progress("plot", i, 3)
+        progress("report", 1, 1)
+        return {"result": {"files": [], "period": params["start_time"]}}
+
+    queue = ReportJobQueue(db_path, runner)
+    job_id = queue.submit(1, 100, {"start_time": "2025-05-01"})
+    finished, progress = run_jobs(queue, 1)
+    assert finished[0]["id"] == job_id and finished[0]["status"] == DONE
+    assert json.loads(finished[0]["result"]) == {"result": {"files": [], "period": "2025-05-01"}}
+    assert ("plot", 3, 3) in [p[1:] for p in progress]
+    assert ("report", 1, 1) in [p[1:] for p in progress]
+
+def test_failed_job_records_error(db_path):
+    def runner(params, progress):
+        raise RuntimeError("нет данных")
+
+    queue = ReportJobQueue(db_path, runner)
+    queue.submit(1, 100, {})
+    finished, _ = run_jobs(queue, 1)
+    assert finished[0]["status"] == FAILED and finished[0]["error"] == "нет данных"
+
+def test_cancel_queued_and_running(db_path):
+    started = threading.Event()
+
+    def runner(params, progress):
+        started.set()
+        while True:
+            progress("plot", 1, 5)
+
+    queue = ReportJobQueue(db_path, runner, max_active_per_user=3)
+    first = queue.submit(1, 100, {})
+    second = queue.submit(1, 100, {})
+
+    async def scenario():
+        finished = []
+        done = asyncio.Event()
+
+        async def on_finished(job):
+            finished.append(job)
+            done.set()
+
+        async def on_progress(*args):
+            pass
+
+        await queue.start(on_progress, on_finished)
+        await asyncio.to_thread(started.wait, 5)
+        assert queue.cancel(1, second) == [second]
+        assert queue.cancel(1) == [first]
+        await asyncio.wait_for(done.wait(), 5)
+        await queue.stop()
+        return finished
+
+    finished = asyncio.run(scenario())
+    assert [job["id"] for job in finished] == [first]
+    assert queue.get(first)["status"] == CANCELLED
+    assert queue.get(second)["status"] == CANCELLED
+    assert queue.active_jobs(1) == []
+
+def test_per_user_limit(db_path):
+    queue = ReportJobQueue(db_path, lambda params, progress: {}, max_active_per_user=1)
+    queue.submit(1, 100, {})
+    with pytest.raises(JobLimitError):
+        queue.submit(1, 100, {})
+    queue.submit(2, 200, {})
+
+def test_per_user_limit_across_instances(db_path):
+    queues = [ReportJobQueue(db_path, lambda params, progress: {}, max_active_per_user=1) for _ in range(4)]
+    for _ in range(20):
+        barrier = threading.Barrier(len(queues))
+        accepted = []
+
+        def submit(queue):
+            barrier.wait()
+            try:
+                accepted.append(queue.submit(1, 100, {}))
+            except JobLimitError:
+                pass
+        threads = [threading.Thread(target=submit, args=(queue,)) for queue in queues]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(accepted) == 1
+        assert queues[0].cancel(1) == accepted
+
+def test_jobs_survive_restart(db_path):
+    calls = []
+    first = ReportJobQueue(db_path, lambda params, progress: calls.append(params) or {})
+    job_id = first.submit(1, 100, {"n": 1})
+    # Задача, прерванная остановкой бота посреди выполнения
+    interrupted = first.submit(2, 200, {"n": 2})
+    first._update(interrupted, status="running")
+
+    restarted = ReportJobQueue(db_path, lambda params, progress: calls.append(params) or {})
+    finished, _ = run_jobs(restarted, 2)
+    assert sorted(job["id"] for job in finished) == sorted([job_id, interrupted])
+    assert sorted(p["n"] for p in calls) == [1, 2]
+    assert all(job["status"] == DONE for job in finished)
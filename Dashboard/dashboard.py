@@ -2,12 +2,14 @@
 # dashboard.py
 
 import logging
+import os
 from pathlib import Path
 from typing import Dict, List, Any
 from datetime import datetime, timedelta
 from quart import Quart, render_template, request, jsonify
 import json
 import html
+import hmac
 
 logging.basicConfig(
     level=logging.INFO,
@@ -22,6 +24,13 @@ CONFIG = {
     "host": "127.0.0.1",
     "port": 8000,
     "page_size": 10,
+    # Повтор обновлений для тестов: только с локального адреса и с токеном в заголовке X-Replay-Token.
+    # За обратным прокси все запросы приходят с localhost, поэтому одной проверки адреса мало.
+    # Без replay_token используется секрет вебхука; если нет ни того ни другого, маршрут не включается
+    "replay_path": "/telegram/replay",
+    "replay_enabled": False,
+    "replay_token": os.getenv("DASHBOARD_REPLAY_TOKEN", ""),
+    "local_addresses": ("127.0.0.1", "::1"),
 }
 
 DASHBOARD_HTML_CONTENT = """
@@ -168,6 +177,16 @@ DASHBOARD_HTML_CONTENT = """
 </html>
 """
 
+async def serve_dashboard(dashboard: "Dashboard", shutdown_trigger=None) -> None:
+    """Запускает приложение дашборда (и вебхук бота) на hypercorn в текущем событийном цикле."""
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config as HyperConfig
+
+    hypercorn_config = HyperConfig()
+    hypercorn_config.bind = [f"{dashboard.config['host']}:{dashboard.config['port']}"]
+    hypercorn_config.use_reloader = False
+    await serve(dashboard.app, hypercorn_config, shutdown_trigger=shutdown_trigger)
+
 class Dashboard:
     """Модуль дашборда для мониторинга активности пользователей."""
 
@@ -178,6 +197,8 @@ class Dashboard:
         self.app = Quart(__name__, template_folder=str(self.config["template_dir"]))
         self._setup_template()
         self._setup_routes()
+        if getattr(self.bot, "webhook_enabled", False):
+            self._setup_webhook_routes()
         logger.info("Дашборд инициализирован")
 
     def _setup_template(self) -> None:
@@ -226,6 +247,52 @@ class Dashboard:
                 logger.error("Ошибка при получении данных пользователя %s: %s", user_id, str(e))
                 return jsonify({"error": "Internal server error"}), 500
 
+    def _setup_webhook_routes(self) -> None:
+        """Приём обновлений Telegram вебхуком на том же сервере, что и дашборд."""
+        @self.app.route(self.bot.webhook_path, methods=["POST"])
+        async def webhook_route():
+            secret = self.bot.webhook_secret
+            header = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+            if not secret or not hmac.compare_digest(header, secret):
+                logger.warning("Вебхук: неверный секретный токен от %s", request.remote_addr)
+                return jsonify({"error": "Forbidden"}), 403
+            return await self._feed_updates([await request.get_json(force=True, silent=True)])
+
+        if not self.config.get("replay_enabled"):
+            return
+        replay_token = self.config.get("replay_token") or self.bot.webhook_secret
+        if not replay_token:
+            logger.warning("Повтор обновлений не включён: не задан ни DASHBOARD_REPLAY_TOKEN, ни секрет вебхука")
+            return
+
+        @self.app.route(self.config["replay_path"], methods=["POST"])
+        async def replay_route():
+            header = request.headers.get("X-Replay-Token", "")
+            if request.remote_addr not in self.config["local_addresses"] or not hmac.compare_digest(header, replay_token):
+                logger.warning("Повтор обновлений: доступ запрещён для %s", request.remote_addr)
+                return jsonify({"error": "Forbidden"}), 403
+            data = await request.get_json(force=True, silent=True)
+            return await self._feed_updates(data if isinstance(data, list) else [data])
+
+        logger.info("Повтор обновлений доступен: %s", self.config["replay_path"])
+
+    async def _feed_updates(self, updates: List[Any]):
+        """Передаёт обновления боту; 503 заставляет Telegram повторить доставку позже."""
+        accepted = duplicates = 0
+        try:
+            for data in updates:
+                if await self.bot.feed_update(data):
+                    accepted += 1
+                else:
+                    duplicates += 1
+        except ValueError as e:
+            logger.warning("Вебхук: некорректное обновление: %s", str(e))
+            return jsonify({"error": "Bad request", "accepted": accepted, "duplicates": duplicates}), 400
+        except RuntimeError as e:
+            logger.warning("Вебхук: обновление не принято: %s", str(e))
+            return jsonify({"error": "Service unavailable"}), 503
+        return jsonify({"ok": True, "accepted": accepted, "duplicates": duplicates})
+
     def _get_stats(self) -> Dict[str, int]:
         """Считает общую статистику для дашборда через HistoryManager."""
         try:
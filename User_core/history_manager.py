@@ -1,127 +1,515 @@
 # -*- coding: utf-8 -*-
 import sqlite3
 import logging
+import asyncio
+import queue
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import Future
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from threading import Lock
-from typing import Dict, List, Any, Optional
+from typing import Callable, Dict, List, Any, Optional
 import json
+import re
 import traceback
 
+from Utils.cache_codec import CacheCodec, CodecError
+
+CONFIG = {
+    "reader_pool_size": 4,      # Соединений только для чтения
+    "busy_timeout": 5.0,        # Секунд ожидания блокировки SQLite
+    "flush_interval": 0.05,     # Секунд до сброса буфера истории на диск
+    "flush_rows": 200,          # Строк в буфере, после которых сброс выполняется сразу
+    "max_cached_users": 1000,   # Пользователей, чья история держится в памяти
+    "sweep_interval": 60.0,     # Секунд между проходами фоновой очистки устаревших записей
+    "sweep_chunk_rows": 500,    # Строк, удаляемых одной транзакцией при очистке
+    "sweep_vacuum_pages": 200,  # Страниц, возвращаемых ОС за проход (PRAGMA incremental_vacuum)
+    "memory_cache_size": 256,   # Ключей кеша, которые держатся в памяти декодированными (L1)
+    "clear_history_on_start": False,  # True — стирать всю историю при запуске (в том числе только что перенесённую)
+}
+
+SCHEMA_VERSION = 2  # v2: время в мс (INTEGER), user_info в таблице users, FTS5 по сообщениям
+
+_ROW = object()  # Маркер задания «строка истории» в очереди писателя
+_WORDS = re.compile(r"\w+", re.UNICODE)
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _ms_to_iso(ms: int) -> str:
+    return datetime.utcfromtimestamp(ms / 1000).isoformat()
+
+
+def _iso_to_ms(value: str) -> int:
+    return int((datetime.fromisoformat(value) - datetime(1970, 1, 1)).total_seconds() * 1000)
+
+
+class HistoryRecord:
+    """Компактная запись истории в памяти."""
+    __slots__ = ("ts", "timestamp", "message", "is_bot", "user_info")
+
+    def __init__(self, ts: int, message: str, is_bot: bool, user_info: Dict[str, Any]):
+        self.ts = ts
+        self.timestamp = _ms_to_iso(ts)
+        self.message = message
+        self.is_bot = is_bot
+        self.user_info = user_info
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"timestamp": self.timestamp, "message": self.message, "is_bot": self.is_bot, "user_info": self.user_info}
+
+
 class HistoryManager:
-    """Управляет персистентной историей переписки пользователей и файловым кешем с таймаутом и безопасным многопоточным доступом."""
+    """Управляет персистентной историей переписки пользователей и файловым кешем.
 
-    def __init__(self, db_path: str, timeout_hours: int, max_history_size: int, logger: logging.Logger = None):
+    Все записи выполняет один долгоживущий поток-писатель со своим соединением (задания приходят
+    через очередь), чтения идут через пул соединений; асинхронные методы не блокируют event loop.
+    Строки истории пишутся отложенно: писатель копит их и сбрасывает одной транзакцией, а до сброса
+    они видны в get_history через буфер в памяти. Последние max_history_size записей активных
+    пользователей держатся в кольцевых буферах, так что повторный get_history не обращается к БД.
+    Время хранится в миллисекундах UTC (индексы по user_id+ts и ts), user_info — один раз на
+    пользователя в таблице users, поиск по тексту сообщений идёт через FTS5, если он доступен.
+    Устаревшие записи удаляет фоновый поток небольшими порциями; чтения только фильтруют по TTL.
+    Перед таблицей cache стоит LRU в памяти с тем же TTL (запись сквозная), так что повторный
+    get_cache возвращает уже декодированный объект без обращения к SQLite.
+    """
+
+    def __init__(self, db_path: str, timeout_hours: int, max_history_size: int, logger: logging.Logger = None,
+                 reader_pool_size: int = CONFIG["reader_pool_size"], sweep_interval: float = CONFIG["sweep_interval"],
+                 codec: Optional[CacheCodec] = None):
         self.db_path = db_path
         self.timeout = timedelta(hours=timeout_hours)
+        self._timeout_ms = int(self.timeout.total_seconds() * 1000)
         self.max_history_size = max_history_size
-        self._lock = Lock()
         self.logger = logger or logging.getLogger(__name__)
+        self._write_queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._pending: Dict[int, deque] = defaultdict(deque)  # Ещё не сброшенные строки по пользователям
+        self._pending_lock = threading.Lock()
+        self._rings: "OrderedDict[int, deque]" = OrderedDict()  # LRU кольцевых буферов по пользователям
+        self._rings_lock = threading.Lock()
+        self._loading: Dict[int, List[List[HistoryRecord]]] = defaultdict(list)  # Записи, добавленные во время загрузки
+        self._users: Dict[int, Dict[str, Any]] = {}  # Последний известный user_info по пользователям
+        self.codec = codec or CacheCodec()  # Формат значений в таблице cache
+        self._memory_cache: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (value, expire_at)
+        self._memory_cache_lock = threading.Lock()
+        self._cache_stats = {"memory_hits": 0, "db_hits": 0, "misses": 0, "evictions": 0}
+        self._cache_hooks: List[Callable[[Optional[str]], None]] = []
+        self._task_counts: Dict[int, int] = {}  # Счётчики задач живут только в памяти процесса
+        self._task_lock = threading.Lock()
+        self._fts = False
+        self._writer = threading.Thread(target=self._writer_loop, name="HistoryManagerWriter", daemon=True)
+        self._writer.start()
+        self._readers: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        self._closed = False
+        self._sweep_stats = {"runs": 0, "history_rows": 0, "cache_rows": 0, "vacuumed_pages": 0,
+                             "errors": 0, "last_run": None, "last_duration": 0.0}
+        self._sweep_lock = threading.Lock()
+        self._stop_sweeper = threading.Event()
+        self._sweeper = threading.Thread(target=self._sweeper_loop, args=(sweep_interval,),
+                                         name="HistoryManagerSweeper", daemon=True)
         try:
-            with self._get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("PRAGMA journal_mode=WAL;")
-                cursor.execute(
-                    """
-                    CREATE TABLE IF NOT EXISTS user_history (
-                        user_id INTEGER,
-                        timestamp TEXT,
-                        message TEXT,
-                        is_bot INTEGER,
-                        user_info TEXT,
-                        PRIMARY KEY (user_id, timestamp)
-                    )
-                    """
-                )
-                cursor.execute(
-                    """
-                    CREATE TABLE IF NOT EXISTS user_task_count (
-                        user_id INTEGER PRIMARY KEY,
-                        task_count INTEGER DEFAULT 0
-                    )
-                    """
-                )
-                cursor.execute(
-                    """
-                    CREATE TABLE IF NOT EXISTS cache (
-                        key TEXT PRIMARY KEY,
-                        value TEXT,
-                        expire_at INTEGER
-                    )
-                    """
-                )
-                conn.commit()
+            self._write(self._create_schema)
+            for _ in range(reader_pool_size):
+                self._readers.put(self._get_connection())
 
             self.clear_all_cache()  # Очистка кеша при запуске
-            self.clear_all_history()  # Очистка всей истории при запуске
+            if CONFIG["clear_history_on_start"]:
+                self.clear_all_history()  # Очистка всей истории при запуске
             self.clean_old_histories(inactivity_hours=3)  # Очистка истории неактивных пользователей
-            self.logger.debug("Кеш и история очищены при инициализации")
+            self.logger.debug("Кеш и устаревшая история очищены при инициализации")
+            self._sweeper.start()
         except Exception as e:
             self.logger.error("Ошибка инициализации HistoryManager: %s", e)
             self.logger.error("Трассировка стека: %s", traceback.format_exc())
 
+    def _create_schema(self, conn: sqlite3.Connection) -> None:
+        """Создаёт схему v2 и при необходимости переносит данные из схемы v1."""
+        self._enable_incremental_vacuum(conn)
+        cursor = conn.cursor()
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(user_history)")}
+        legacy = "timestamp" in columns
+        has_fts = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'user_history_fts'"
+        ).fetchone() is not None
+        cursor.execute("BEGIN")
+        if legacy:
+            cursor.execute("ALTER TABLE user_history RENAME TO user_history_v1")
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS user_history (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                ts INTEGER NOT NULL,
+                message TEXT,
+                is_bot INTEGER
+            )
+            """
+        )
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_history_user_ts ON user_history(user_id, ts)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_history_ts ON user_history(ts)")
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                user_info TEXT NOT NULL
+            )
+            """
+        )
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value TEXT,
+                expire_at INTEGER
+            )
+            """
+        )
+        try:
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS user_history_fts"
+                " USING fts5(message, content='user_history', content_rowid='id')"
+            )
+            cursor.execute(
+                """
+                CREATE TRIGGER IF NOT EXISTS user_history_fts_insert AFTER INSERT ON user_history BEGIN
+                    INSERT INTO user_history_fts(rowid, message) VALUES (new.id, new.message);
+                END
+                """
+            )
+            cursor.execute(
+                """
+                CREATE TRIGGER IF NOT EXISTS user_history_fts_delete AFTER DELETE ON user_history BEGIN
+                    INSERT INTO user_history_fts(user_history_fts, rowid, message) VALUES ('delete', old.id, old.message);
+                END
+                """
+            )
+            if not has_fts:
+                cursor.execute("INSERT INTO user_history_fts(user_history_fts) VALUES ('rebuild')")
+            self._fts = True
+        except sqlite3.OperationalError as e:
+            self.logger.warning("FTS5 недоступен, поиск по сообщениям через LIKE: %s", e)
+        if legacy:
+            self._migrate_v1(cursor)
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _enable_incremental_vacuum(self, conn: sqlite3.Connection) -> None:
+        """Включает auto_vacuum=INCREMENTAL, чтобы очистка могла возвращать место порциями."""
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # Для существующей БД режим применяется только после полного VACUUM (однократно)
+            self.logger.info("Перестройка БД для auto_vacuum=INCREMENTAL: %s", self.db_path)
+            conn.execute("VACUUM")
+
+    def _migrate_v1(self, cursor: sqlite3.Cursor) -> None:
+        """Переносит историю из схемы v1 (ISO-строки, user_info в каждой строке) в v2."""
+        cursor.execute(
+            """
+            INSERT INTO user_history (user_id, ts, message, is_bot)
+            SELECT user_id, CAST(ROUND((julianday(timestamp) - 2440587.5) * 86400000) AS INTEGER), message, is_bot
+            FROM user_history_v1
+            WHERE julianday(timestamp) IS NOT NULL
+            ORDER BY user_id, timestamp
+            """
+        )
+        migrated = cursor.rowcount
+        # Для каждого пользователя берём последний непустой user_info
+        cursor.execute(
+            """
+            INSERT OR REPLACE INTO users (user_id, user_info)
+            SELECT v.user_id, v.user_info FROM user_history_v1 v
+            WHERE v.user_info NOT IN ('', '{}') AND v.timestamp = (
+                SELECT MAX(timestamp) FROM user_history_v1
+                WHERE user_id = v.user_id AND user_info NOT IN ('', '{}')
+            )
+            """
+        )
+        cursor.execute("DROP TABLE user_history_v1")
+        self.logger.info("История перенесена в схему v%d: строк=%d", SCHEMA_VERSION, migrated)
+
     def _get_connection(self) -> sqlite3.Connection:
-        """Создаёт новое соединение для безопасного параллельного доступа."""
+        """Создаёт соединение с БД (писатель и пул читателей держат их всё время работы)."""
         self.logger.debug("Создание нового соединения с БД: %s", self.db_path)
-        return sqlite3.connect(self.db_path, check_same_thread=False)
+        return sqlite3.connect(self.db_path, check_same_thread=False, timeout=CONFIG["busy_timeout"])
+
+    # --- Поток-писатель и пул читателей -------------------------------------------------
+
+    def _writer_loop(self) -> None:
+        """Единственный поток, который пишет в БД; выполняет задания из очереди по порядку."""
+        conn = self._get_connection()
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        batch: List[tuple] = []
+        deadline = 0.0
+        try:
+            while True:
+                try:
+                    job = self._write_queue.get(timeout=max(0.0, deadline - time.monotonic()) if batch else None)
+                except queue.Empty:
+                    self._flush_rows(conn, batch)
+                    continue
+                if job is None:
+                    break
+                func, payload = job
+                if func is _ROW:
+                    if not batch:
+                        deadline = time.monotonic() + CONFIG["flush_interval"]
+                    batch.append(payload)
+                    if len(batch) >= CONFIG["flush_rows"]:
+                        self._flush_rows(conn, batch)
+                    continue
+                # Прочие записи выполняются после уже поставленных строк, чтобы сохранить порядок
+                self._flush_rows(conn, batch)
+                future = payload
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    result = func(conn)
+                    conn.commit()
+                    future.set_result(result)
+                except BaseException as e:
+                    conn.rollback()
+                    future.set_exception(e)
+        finally:
+            self._flush_rows(conn, batch)
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+            conn.close()
+            self.logger.debug("Поток записи HistoryManager остановлен")
+
+    def _flush_rows(self, conn: sqlite3.Connection, batch: List[tuple]) -> None:
+        """Записывает накопленные строки истории одной транзакцией и убирает их из буфера в памяти."""
+        if not batch:
+            return
+        try:
+            conn.executemany(
+                """
+                INSERT INTO user_history (user_id, ts, message, is_bot)
+                VALUES (?, ?, ?, ?)
+                """,
+                batch
+            )
+            conn.commit()
+            self.logger.debug("Сброшено строк истории: %d", len(batch))
+        except Exception as e:
+            conn.rollback()
+            self.logger.error("Ошибка записи истории (%d строк потеряно): %s", len(batch), e)
+            self.logger.error("Трассировка стека: %s", traceback.format_exc())
+        finally:
+            with self._pending_lock:
+                for row in batch:
+                    pending = self._pending.get(row[0])
+                    if pending:
+                        pending.popleft()
+                        if not pending:
+                            del self._pending[row[0]]
+            batch.clear()
+
+    def _submit_write(self, func: Callable[[sqlite3.Connection], Any]) -> Future:
+        if self._closed:
+            raise RuntimeError("HistoryManager закрыт")
+        future: Future = Future()
+        self._write_queue.put((func, future))
+        return future
+
+    def _write(self, func: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Выполняет запись в потоке-писателе и ждёт результата."""
+        return self._submit_write(func).result()
+
+    @contextmanager
+    def _reader(self):
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    def _read(self, func: Callable[[sqlite3.Connection], Any]) -> Any:
+        with self._reader() as conn:
+            return func(conn)
+
+    def flush(self) -> None:
+        """Дожидается записи на диск всех поставленных в очередь строк истории."""
+        self._write(lambda conn: None)
+
+    def close(self) -> None:
+        """Сбрасывает буфер истории, дожидается выполнения поставленных записей и закрывает соединения."""
+        if self._closed:
+            return
+        self._stop_sweeper.set()
+        if self._sweeper.is_alive():
+            self._sweeper.join()
+        self._closed = True
+        self._write_queue.put(None)
+        self._writer.join()
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
+        self.logger.debug("HistoryManager закрыт")
+
+    # --- Фоновая очистка -------------------------------------------------------------------
+
+    def _sweeper_loop(self, interval: float) -> None:
+        while not self._stop_sweeper.wait(interval):
+            self.sweep()
+
+    def _delete_chunked(self, sql: str, params: tuple) -> int:
+        """Удаляет строки порциями по sweep_chunk_rows; между порциями писатель успевает выполнить другие записи."""
+        deleted = 0
+        while True:
+            count = self._write(lambda conn: conn.execute(sql, params + (CONFIG["sweep_chunk_rows"],)).rowcount)
+            deleted += count
+            if count < CONFIG["sweep_chunk_rows"] or self._stop_sweeper.is_set():
+                break
+        return deleted
+
+    def _sweep_history(self, cutoff: int) -> int:
+        return self._delete_chunked(
+            "DELETE FROM user_history WHERE id IN (SELECT id FROM user_history WHERE ts < ? LIMIT ?)", (cutoff,)
+        )
+
+    def _sweep_cache(self, now: int) -> int:
+        return self._delete_chunked(
+            "DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache WHERE expire_at < ? LIMIT ?)", (now,)
+        )
+
+    def _incremental_vacuum(self) -> int:
+        def vacuum(conn: sqlite3.Connection) -> int:
+            before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            conn.execute(f"PRAGMA incremental_vacuum({int(CONFIG['sweep_vacuum_pages'])})").fetchall()
+            return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return self._write(vacuum)
+
+    def sweep(self) -> Dict[str, int]:
+        """Один проход очистки: устаревшая история и кеш порциями, затем incremental_vacuum."""
+        started = time.monotonic()
+        result = {"history_rows": 0, "cache_rows": 0, "vacuumed_pages": 0}
+        try:
+            result["history_rows"] = self._sweep_history(_now_ms() - self._timeout_ms)
+            result["cache_rows"] = self._sweep_cache(int(datetime.utcnow().timestamp()))
+            result["vacuumed_pages"] = self._incremental_vacuum()
+            self.logger.debug("Очистка: история=%d, кеш=%d, страниц освобождено=%d",
+                              result["history_rows"], result["cache_rows"], result["vacuumed_pages"])
+        except Exception as e:
+            with self._sweep_lock:
+                self._sweep_stats["errors"] += 1
+            self.logger.error("Ошибка фоновой очистки: %s", e)
+            self.logger.error("Трассировка стека: %s", traceback.format_exc())
+        with self._sweep_lock:
+            stats = self._sweep_stats
+            stats["runs"] += 1
+            for name, value in result.items():
+                stats[name] += value
+            stats["last_run"] = datetime.utcnow().isoformat()
+            stats["last_duration"] = time.monotonic() - started
+        return result
+
+    def get_sweep_stats(self) -> Dict[str, Any]:
+        """Накопленные метрики фоновой очистки."""
+        with self._sweep_lock:
+            return dict(self._sweep_stats)
+
+    # --- Кеш ------------------------------------------------------------------------------
 
     def _clear_expired_cache(self) -> None:
         """Удаляет из кеша все устаревшие записи."""
         now = int(datetime.utcnow().timestamp())
         try:
-            with self._lock, self._get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("DELETE FROM cache WHERE expire_at IS NOT NULL AND expire_at < ?", (now,))
-                conn.commit()
-            self.logger.debug("Удалены устаревшие записи кеша")
+            deleted = self._sweep_cache(now)
+            self.logger.debug("Удалены устаревшие записи кеша: %d", deleted)
         except Exception as e:
             self.logger.error("Ошибка очистки устаревшего кеша: %s", e)
             self.logger.error("Трассировка стека: %s", traceback.format_exc())
 
+    def _remember_cache(self, key: str, value: Any, expire_at: Optional[int]) -> None:
+        with self._memory_cache_lock:
+            self._memory_cache[key] = (value, expire_at)
+            self._memory_cache.move_to_end(key)
+            while len(self._memory_cache) > CONFIG["memory_cache_size"]:
+                self._memory_cache.popitem(last=False)
+                self._cache_stats["evictions"] += 1
+
+    def _invalidate_cache(self, key: Optional[str]) -> None:
+        """Сбрасывает ключ (или весь кеш при key=None) в памяти и уведомляет подписчиков."""
+        with self._memory_cache_lock:
+            if key is None:
+                self._memory_cache.clear()
+            else:
+                self._memory_cache.pop(key, None)
+        for hook in list(self._cache_hooks):
+            try:
+                hook(key)
+            except Exception as e:
+                self.logger.error("Ошибка обработчика инвалидации кеша: %s", e)
+                self.logger.error("Трассировка стека: %s", traceback.format_exc())
+
+    def add_cache_invalidation_hook(self, hook: Callable[[Optional[str]], None]) -> None:
+        """Регистрирует hook(key), вызываемый при clear_cache(key) и clear_all_cache() (key=None)."""
+        self._cache_hooks.append(hook)
+
+    def get_cache_stats(self) -> Dict[str, int]:
+        """Счётчики попаданий в кеш: в памяти, в SQLite и промахов."""
+        with self._memory_cache_lock:
+            return dict(self._cache_stats, memory_size=len(self._memory_cache))
+
     def set_cache(self, key: str, value: Any, ttl_seconds: Optional[int] = None) -> None:
         """Сохраняет значение в кеш под заданным ключом с опциональным TTL."""
         expire_at = None
         if ttl_seconds is not None:
             expire_at = int(datetime.utcnow().timestamp()) + ttl_seconds
-        data = json.dumps(value, ensure_ascii=False)
         try:
-            with self._lock, self._get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    """
-                    INSERT INTO cache(key, value, expire_at)
-                    VALUES (?, ?, ?)
-                    ON CONFLICT(key) DO UPDATE SET value=excluded.value, expire_at=excluded.expire_at;
-                    """,
-                    (key, data, expire_at)
-                )
-                conn.commit()
-            self.logger.debug("Установлен кеш: key=%s, expire_at=%s", key, expire_at)
+            data = sqlite3.Binary(self.codec.encode(value))
+            self._write(lambda conn: conn.execute(
+                """
+                INSERT INTO cache(key, value, expire_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET value=excluded.value, expire_at=excluded.expire_at;
+                """,
+                (key, data, expire_at)
+            ))
+            self._remember_cache(key, value, expire_at)
+            self.logger.debug("Установлен кеш: key=%s, expire_at=%s, байт=%d", key, expire_at, len(data))
         except Exception as e:
+            with self._memory_cache_lock:
+                self._memory_cache.pop(key, None)
             self.logger.error("Ошибка при записи в кеш: %s", e)
             self.logger.error("Трассировка стека: %s", traceback.format_exc())
 
     def get_cache(self, key: str) -> Optional[Any]:
-        """Возвращает значение из кеша или None, если нет или истек."""
+        """Возвращает значение из кеша или None, если нет или истек.
+
+        Значение из памяти возвращается без копирования — изменять его нельзя.
+        """
         now = int(datetime.utcnow().timestamp())
+        with self._memory_cache_lock:
+            entry = self._memory_cache.get(key)
+            if entry is not None:
+                value, expire_at = entry
+                if expire_at is None or expire_at >= now:
+                    self._memory_cache.move_to_end(key)
+                    self._cache_stats["memory_hits"] += 1
+                    return value
+                del self._memory_cache[key]
         try:
-            with self._lock, self._get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT value, expire_at FROM cache WHERE key = ?", (key,))
-                row = cursor.fetchone()
-                if not row:
-                    self.logger.debug("Кеш не найден для ключа: %s", key)
-                    return None
-                data, expire_at = row
-                if expire_at is not None and now > expire_at:
-                    cursor.execute("DELETE FROM cache WHERE key = ?", (key,))
-                    conn.commit()
-                    self.logger.debug("Кеш истек для ключа: %s", key)
-                    return None
-                result = json.loads(data)
-                self.logger.debug("Получено значение из кеша для ключа: %s", key)
-                return result
-        except json.JSONDecodeError as e:
-            self.logger.error("Ошибка декодирования JSON из кеша: %s", e)
+            # Устаревшие записи не удаляются здесь — их уберёт фоновая очистка
+            row = self._read(lambda conn: conn.execute(
+                "SELECT value, expire_at FROM cache WHERE key = ? AND (expire_at IS NULL OR expire_at >= ?)", (key, now)
+            ).fetchone())
+            if not row:
+                with self._memory_cache_lock:
+                    self._cache_stats["misses"] += 1
+                self.logger.debug("Кеш не найден или истек для ключа: %s", key)
+                return None
+            result = self.codec.decode(row[0])
+            self._remember_cache(key, result, row[1])
+            with self._memory_cache_lock:
+                self._cache_stats["db_hits"] += 1
+            self.logger.debug("Получено значение из кеша для ключа: %s", key)
+            return result
+        except CodecError as e:
+            self.logger.error("Ошибка декодирования записи кеша %s: %s", key, e)
             self.logger.error("Трассировка стека: %s", traceback.format_exc())
             return None
         except Exception as e:
@@ -132,9 +520,8 @@ class HistoryManager:
     def clear_cache(self, key: str) -> None:
         """Удаляет запись кеша по ключу."""
         try:
-            with self._lock, self._get_connection() as conn:
-                conn.execute("DELETE FROM cache WHERE key = ?", (key,))
-                conn.commit()
+            self._write(lambda conn: conn.execute("DELETE FROM cache WHERE key = ?", (key,)))
+            self._invalidate_cache(key)
             self.logger.debug("Кеш очищен для ключа: %s", key)
         except Exception as e:
             self.logger.error("Ошибка очистки кеша: %s", e)
@@ -143,67 +530,119 @@ class HistoryManager:
     def clear_all_cache(self) -> None:
         """Очищает весь кеш."""
         try:
-            with self._lock, self._get_connection() as conn:
-                conn.execute("DELETE FROM cache")
-                conn.commit()
+            self._write(lambda conn: conn.execute("DELETE FROM cache"))
+            self._invalidate_cache(None)
             self.logger.debug("Весь кеш очищен")
         except Exception as e:
             self.logger.error("Ошибка полной очистки кеша: %s", e)
             self.logger.error("Трассировка стека: %s", traceback.format_exc())
 
+    # --- История --------------------------------------------------------------------------
+
     def add_message(self, user_id: int, message: str, is_bot: bool, user_info: Dict[str, Any]) -> None:
-        """Добавляет запись в историю пользователя."""
-        timestamp = datetime.utcnow().isoformat()
-        user_info_json = json.dumps(user_info, ensure_ascii=False)
+        """Добавляет запись в историю пользователя (на диск она попадёт со следующим сбросом буфера)."""
         try:
-            with self._lock, self._get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    """
-                    INSERT OR REPLACE INTO user_history
-                      (user_id, timestamp, message, is_bot, user_info)
-                    VALUES (?, ?, ?, ?, ?)
-                    """,
-                    (user_id, timestamp, message, int(is_bot), user_info_json)
-                )
-                conn.commit()
+            if self._closed:
+                raise RuntimeError("HistoryManager закрыт")
+            row = (user_id, _now_ms(), message, int(is_bot))
+            self._remember_user(user_id, user_info)
+            with self._rings_lock:
+                ring = self._rings.get(user_id)
+                record = HistoryRecord(row[1], message, bool(is_bot), self._users.get(user_id, {}))
+                if ring is not None:
+                    ring.append(record)
+                for added in self._loading.get(user_id, ()):
+                    added.append(record)
+                with self._pending_lock:
+                    self._pending[user_id].append(row)
+                    self._write_queue.put((_ROW, row))
             self.logger.debug("Добавлено сообщение: user_id=%d, message=%s, is_bot=%s", user_id, message[:50], is_bot)
         except Exception as e:
             self.logger.error("Ошибка добавления сообщения: %s", e)
             self.logger.error("Трассировка стека: %s", traceback.format_exc())
 
+    def _remember_user(self, user_id: int, user_info: Dict[str, Any]) -> None:
+        """Записывает user_info в таблицу users, только если он изменился."""
+        if not user_info or self._users.get(user_id) == user_info:
+            return
+        self._users[user_id] = user_info
+        data = json.dumps(user_info, ensure_ascii=False)
+        self._submit_write(lambda conn: conn.execute(
+            "INSERT INTO users(user_id, user_info) VALUES (?, ?)"
+            " ON CONFLICT(user_id) DO UPDATE SET user_info = excluded.user_info",
+            (user_id, data)
+        ))
+
+    async def add_message_async(self, user_id: int, message: str, is_bot: bool, user_info: Dict[str, Any]) -> None:
+        """Асинхронная версия add_message; постановка в буфер не блокирует event loop."""
+        self.add_message(user_id, message, is_bot, user_info)
+
+    def _load_ring(self, user_id: int, cutoff: int) -> deque:
+        """Загружает из БД (и буфера записи) последние записи пользователя в кольцевой буфер."""
+        def read(conn: sqlite3.Connection):
+            rows = conn.execute(
+                "SELECT ts, message, is_bot FROM user_history"
+                " WHERE user_id = ? AND ts >= ? ORDER BY ts DESC, id DESC LIMIT ?",
+                (user_id, cutoff, self.max_history_size)
+            ).fetchall()
+            info = conn.execute("SELECT user_info FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            return rows, info
+
+        # Буфер снимается до чтения БД: строка, сброшенная между ними, окажется хотя бы в одном из снимков
+        with self._pending_lock:
+            pending = [row[1:] for row in self._pending.get(user_id, ())]
+        rows, info_row = self._read(read)
+        rows.reverse()
+        if pending:
+            seen = set(rows)
+            rows = rows + [row for row in pending if row not in seen]
+            rows.sort(key=lambda row: row[0])
+        if user_id not in self._users and info_row:
+            try:
+                self._users[user_id] = json.loads(info_row[0])
+            except json.JSONDecodeError as e:
+                self.logger.error("Ошибка декодирования user_info: %s", e)
+                self.logger.error("Трассировка стека: %s", traceback.format_exc())
+        info = self._users.get(user_id, {})
+        ring = deque(maxlen=self.max_history_size)
+        for ts, msg, is_bot in rows:
+            if ts >= cutoff:
+                ring.append(HistoryRecord(ts, msg, bool(is_bot), info))
+        self.logger.debug("История пользователя %d загружена в память: записей=%d", user_id, len(ring))
+        return ring
+
     def get_history(self, user_id: int) -> List[Dict[str, Any]]:
         """Возвращает историю за период timeout и ограниченную по max_history_size."""
-        now = datetime.utcnow()
-        cutoff = (now - self.timeout).isoformat()
+        cutoff = _now_ms() - self._timeout_ms
         try:
-            with self._lock, self._get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("DELETE FROM user_history WHERE user_id = ? AND timestamp < ?", (user_id, cutoff))
-                conn.commit()
-                cursor.execute(
-                    "SELECT timestamp, message, is_bot, user_info"
-                    " FROM user_history WHERE user_id = ? ORDER BY timestamp ASC",
-                    (user_id,)
-                )
-                rows = cursor.fetchall()
-            records: List[Dict[str, Any]] = []
-            for ts, msg, is_bot, ui in rows:
-                dt = datetime.fromisoformat(ts)
-                if now - dt <= self.timeout:
-                    info = {}
-                    try:
-                        info = json.loads(ui)
-                    except json.JSONDecodeError as e:
-                        self.logger.error("Ошибка декодирования user_info: %s", e)
-                        self.logger.error("Трассировка стека: %s", traceback.format_exc())
-                    records.append({
-                        "timestamp": dt.isoformat(),
-                        "message": msg,
-                        "is_bot": bool(is_bot),
-                        "user_info": info
-                    })
-            result = records[-self.max_history_size:]
+            with self._rings_lock:
+                ring = self._rings.get(user_id)
+                if ring is not None:
+                    self._rings.move_to_end(user_id)
+                else:
+                    added: List[HistoryRecord] = []
+                    self._loading[user_id].append(added)
+            if ring is None:
+                # Чтение БД идёт без _rings_lock, чтобы не блокировать add_message и тёплые чтения;
+                # записи, добавленные за время загрузки, собираются в added и дописываются ниже
+                loaded = None
+                try:
+                    loaded = self._load_ring(user_id, cutoff)
+                finally:
+                    with self._rings_lock:
+                        self._loading[user_id].remove(added)
+                        if not self._loading[user_id]:
+                            del self._loading[user_id]
+                        if loaded is not None:
+                            seen = {(r.ts, r.message, r.is_bot) for r in loaded}
+                            loaded.extend(r for r in added if (r.ts, r.message, r.is_bot) not in seen)
+                            ring = self._rings.setdefault(user_id, loaded)
+                            if len(self._rings) > CONFIG["max_cached_users"]:
+                                self._rings.popitem(last=False)
+            with self._rings_lock:
+                while ring and ring[0].ts < cutoff:
+                    ring.popleft()
+                result = [record.to_dict() for record in ring]
             self.logger.debug("Получена история: user_id=%d, записей=%d", user_id, len(result))
             return result
         except Exception as e:
@@ -211,64 +650,70 @@ class HistoryManager:
             self.logger.error("Трассировка стека: %s", traceback.format_exc())
             return []
 
+    async def get_history_async(self, user_id: int) -> List[Dict[str, Any]]:
+        """Асинхронная версия get_history: из памяти отвечает сразу, загрузку из БД выполняет вне event loop."""
+        if user_id in self._rings:
+            return self.get_history(user_id)
+        return await asyncio.to_thread(self.get_history, user_id)
 
     def get_all_users_history(self, search="", language="", date_from="", date_to="", message_type="") -> List[Dict[str, Any]]:
-        now = datetime.utcnow()
-        cutoff = (now - self.timeout).isoformat()
+        cutoff = _now_ms() - self._timeout_ms
         query = """
-            SELECT user_id, timestamp, message, is_bot, user_info
-            FROM user_history
-            WHERE timestamp >= ?
+            SELECT h.user_id, h.ts, h.message, h.is_bot, u.user_info
+            FROM user_history h LEFT JOIN users u ON u.user_id = h.user_id
+            WHERE h.ts >= ?
         """
-        params = [cutoff]
-    
+        params: List[Any] = [cutoff]
+
         if search:
-            query += " AND (user_id LIKE ? OR message LIKE ? OR user_info LIKE ?)"
+            conditions = ["CAST(h.user_id AS TEXT) LIKE ?", "u.user_info LIKE ?"]
             search_term = f"%{search}%"
-            params.extend([search_term, search_term, search_term])
+            params.extend([search_term, search_term])
+            words = _WORDS.findall(search)
+            if self._fts and words:
+                conditions.append("h.id IN (SELECT rowid FROM user_history_fts WHERE user_history_fts MATCH ?)")
+                params.append(" ".join(f'"{word}"*' for word in words))
+            else:
+                conditions.append("h.message LIKE ?")
+                params.append(search_term)
+            query += " AND (" + " OR ".join(conditions) + ")"
         if language:
-            query += " AND user_info LIKE ?"
-            params.append(f"%\"language_code\":\"{language}%\"")
+            query += " AND json_extract(u.user_info, '$.language_code') LIKE ?"
+            params.append(f"{language}%")
         if date_from:
-            query += " AND timestamp >= ?"
-            params.append(datetime.strptime(date_from, "%Y-%m-%d").isoformat())
+            query += " AND h.ts >= ?"
+            params.append(_iso_to_ms(datetime.strptime(date_from, "%Y-%m-%d").isoformat()))
         if date_to:
             date_to_dt = datetime.strptime(date_to, "%Y-%m-%d") + timedelta(days=1)
-            query += " AND timestamp < ?"
-            params.append(date_to_dt.isoformat())
+            query += " AND h.ts < ?"
+            params.append(_iso_to_ms(date_to_dt.isoformat()))
         if message_type:
-            query += " AND is_bot = ?"
+            query += " AND h.is_bot = ?"
             params.append(1 if message_type == "bot" else 0)
-    
-        query += " ORDER BY user_id, timestamp ASC"
-    
+
+        query += " ORDER BY h.user_id, h.ts ASC, h.id ASC"
+
         try:
-            with self._lock, self._get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("DELETE FROM user_history WHERE timestamp < ?", (cutoff,))
-                conn.commit()
-                cursor.execute(query, params)
-                rows = cursor.fetchall()
+            rows = self._read(lambda conn: conn.execute(query, params).fetchall())
             records: List[Dict[str, Any]] = []
             user_records: Dict[int, List[Dict[str, Any]]] = {}
+            infos: Dict[int, Dict[str, Any]] = {}
             for user_id, ts, msg, is_bot, ui in rows:
-                dt = datetime.fromisoformat(ts)
-                if now - dt <= self.timeout:
+                if user_id not in infos:
                     info = {}
-                    try:
-                        info = json.loads(ui)
-                    except json.JSONDecodeError as e:
-                        self.logger.error("Ошибка декодирования user_info: %s", e)
-                    record = {
-                        "user_id": user_id,
-                        "timestamp": dt.isoformat(),
-                        "message": msg,
-                        "is_bot": bool(is_bot),
-                        "user_info": info
-                    }
-                    if user_id not in user_records:
-                        user_records[user_id] = []
-                    user_records[user_id].append(record)
+                    if ui:
+                        try:
+                            info = json.loads(ui)
+                        except json.JSONDecodeError as e:
+                            self.logger.error("Ошибка декодирования user_info: %s", e)
+                    infos[user_id] = info
+                user_records.setdefault(user_id, []).append({
+                    "user_id": user_id,
+                    "timestamp": _ms_to_iso(ts),
+                    "message": msg,
+                    "is_bot": bool(is_bot),
+                    "user_info": infos[user_id]
+                })
             for user_id in user_records:
                 records.extend(user_records[user_id][-self.max_history_size:])
             self.logger.debug("Получена отфильтрованная история всех пользователей: записей=%d", len(records))
@@ -279,48 +724,28 @@ class HistoryManager:
 
 
     def get_task_count(self, user_id: int) -> int:
-        """Возвращает текущее число задач пользователя."""
-        try:
-            with self._lock, self._get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT task_count FROM user_task_count WHERE user_id = ?", (user_id,))
-                row = cursor.fetchone()
-                count = row[0] if row else 0
-                self.logger.debug("Получено количество задач: user_id=%d, count=%d", user_id, count)
-                return count
-        except Exception as e:
-            self.logger.error("Ошибка получения количества задач: %s", e)
-            self.logger.error("Трассировка стека: %s", traceback.format_exc())
-            return 0
+        """Возвращает текущее число задач пользователя (счётчик в памяти)."""
+        with self._task_lock:
+            count = self._task_counts.get(user_id, 0)
+        self.logger.debug("Получено количество задач: user_id=%d, count=%d", user_id, count)
+        return count
 
     def update_task_count(self, user_id: int, increment: bool) -> None:
         """Инкремент/декремент счётчика задач пользователя."""
-        delta = 1 if increment else -1
-        try:
-            with self._lock, self._get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    """
-                    INSERT INTO user_task_count(user_id, task_count)
-                    VALUES (?, COALESCE((SELECT task_count FROM user_task_count WHERE user_id = ?), 0) + ?)
-                    ON CONFLICT(user_id) DO UPDATE SET task_count = task_count + ?;
-                    """,
-                    (user_id, user_id, delta, delta)
-                )
-                conn.commit()
-            self.logger.debug("Обновлено количество задач: user_id=%d, действие=%s", user_id, "увеличено" if increment else "уменьшено")
-        except Exception as e:
-            self.logger.error("Ошибка обновления счётчика задач: %s", e)
-            self.logger.error("Трассировка стека: %s", traceback.format_exc())
+        with self._task_lock:
+            count = self._task_counts.get(user_id, 0) + (1 if increment else -1)
+            if count > 0:
+                self._task_counts[user_id] = count
+            else:
+                self._task_counts.pop(user_id, None)
+        self.logger.debug("Обновлено количество задач: user_id=%d, действие=%s", user_id, "увеличено" if increment else "уменьшено")
 
     def clear_old_history(self):
         """Очищает старую историю по timeout."""
-        cutoff = (datetime.utcnow() - self.timeout).isoformat()
+        cutoff = _now_ms() - self._timeout_ms
         try:
-            with self._lock, self._get_connection() as conn:
-                conn.execute("DELETE FROM user_history WHERE timestamp < ?", (cutoff,))
-                conn.commit()
-            self.logger.debug("Старая история очищена до %s", cutoff)
+            deleted = self._sweep_history(cutoff)
+            self.logger.debug("Старая история очищена до %s: строк=%d", _ms_to_iso(cutoff), deleted)
         except Exception as e:
             self.logger.error("Ошибка очистки старой истории: %s", e)
             self.logger.error("Трассировка стека: %s", traceback.format_exc())
@@ -328,9 +753,10 @@ class HistoryManager:
     def clear_all_history(self) -> None:
         """Полностью очищает всю историю всех пользователей."""
         try:
-            with self._lock, self._get_connection() as conn:
-                conn.execute("DELETE FROM user_history")
-                conn.commit()
+            with self._rings_lock:
+                self._write(lambda conn: (conn.execute("DELETE FROM user_history"), conn.execute("DELETE FROM users")))
+                self._rings.clear()
+                self._users.clear()
             self.logger.debug("Вся история пользователей очищена")
         except Exception as e:
             self.logger.error("Ошибка очистки всей истории: %s", e)
@@ -338,22 +764,28 @@ class HistoryManager:
 
     def clean_old_histories(self, inactivity_hours: int) -> None:
         """Очищает историю пользователей, неактивных более inactivity_hours часов."""
-        cutoff = datetime.utcnow() - timedelta(hours=inactivity_hours)
-        cutoff_iso = cutoff.isoformat()
+        cutoff = _now_ms() - inactivity_hours * 3600 * 1000
+
+        def clean(conn: sqlite3.Connection) -> List[int]:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT user_id, MAX(ts) as last_msg_time
+                FROM user_history
+                GROUP BY user_id
+                HAVING last_msg_time < ?
+            """, (cutoff,))
+            users_to_clear = [row[0] for row in cursor.fetchall()]
+            for user_id in users_to_clear:
+                cursor.execute("DELETE FROM user_history WHERE user_id = ?", (user_id,))
+            return users_to_clear
+
         try:
-            with self._lock, self._get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT user_id, MAX(timestamp) as last_msg_time
-                    FROM user_history
-                    GROUP BY user_id
-                    HAVING last_msg_time < ?
-                """, (cutoff_iso,))
-                users_to_clear = [row[0] for row in cursor.fetchall()]
-                for user_id in users_to_clear:
-                    cursor.execute("DELETE FROM user_history WHERE user_id = ?", (user_id,))
-                    self.logger.debug("История очищена для user_id=%d (неактивен > %d часов)", user_id, inactivity_hours)
-                conn.commit()
+            with self._rings_lock:
+                cleared = self._write(clean)
+                for user_id in cleared:
+                    self._rings.pop(user_id, None)
+            for user_id in cleared:
+                self.logger.debug("История очищена для user_id=%d (неактивен > %d часов)", user_id, inactivity_hours)
         except Exception as e:
             self.logger.error("Ошибка очистки неактивных историй: %s", e)
             self.logger.error("Трассировка стека: %s", traceback.format_exc())
\ No newline at end of file
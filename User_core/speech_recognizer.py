@@ -5,122 +5,340 @@ import os
 import io
 import asyncio
 import json
+import threading
 import time
+from typing import AsyncIterator, Iterator, Optional, Union
 from dotenv import load_dotenv
-from pydub import AudioSegment
+
+from Utils.audio_segmenter import split_on_silence
+from Utils.transcription_cache import TranscriptionCache, file_key, pcm_key
+
+try:
+    import av  # Декодер libavcodec внутри процесса, без запуска ffmpeg
+except ImportError:
+    av = None
+
+try:
+    from pydub import AudioSegment
+except ImportError:
+    AudioSegment = None
 
 load_dotenv()
 
+CONFIG = {
+    "sample_rate": 16000,
+    "stream_chunk_bytes": 32000,  # 1 с PCM 16 кГц/16 бит: столько накапливается перед отправкой в STT
+    "iam_url": "https://iam.api.cloud.yandex.net/iam/v1/tokens",
+    "stt_url": "https://stt.api.cloud.yandex.net/speech/v1/stt:recognize",
+    "token_lifetime": 3600,         # Секунд; срок жизни JWT и считающийся срок IAM-токена
+    "token_refresh_margin": 600,    # За сколько секунд до истечения токен обновляется в фоне
+    "token_retry_interval": 30,     # Пауза перед повтором неудачного фонового обновления
+    "pool_size": 10,                # Соединений в пуле сессии
+    "keepalive_timeout": 60,
+    "max_parallel_segments": 4,     # Сегментов длинного сообщения, распознаваемых одновременно
+}
+
 FOLDER_ID = os.getenv("FolderID")
-if not FOLDER_ID:
-    raise ValueError("Переменная окружения FolderID не задана")
 
-try:
-    with open('authorized_key.json', 'r') as f:
-        service_account_key = json.load(f)
-    required_keys = ['service_account_id', 'private_key', 'id']
-    missing_keys = [key for key in required_keys if key not in service_account_key]
-    if missing_keys:
-        raise ValueError(f"Отсутствуют обязательные ключи в authorized_key.json: {missing_keys}")
-except Exception as e:
-    raise ValueError(f"Ошибка при загрузке authorized_key.json: {str(e)}")
+
+def load_service_account_key(path: str = 'authorized_key.json') -> dict:
+    try:
+        with open(path, 'r') as f:
+            service_account_key = json.load(f)
+        required_keys = ['service_account_id', 'private_key', 'id']
+        missing_keys = [key for key in required_keys if key not in service_account_key]
+        if missing_keys:
+            raise ValueError(f"Отсутствуют обязательные ключи в authorized_key.json: {missing_keys}")
+        return service_account_key
+    except Exception as e:
+        raise ValueError(f"Ошибка при загрузке authorized_key.json: {str(e)}")
+
+
+def decode_ogg_to_pcm(ogg_file: bytes, chunk_bytes: int = CONFIG["stream_chunk_bytes"]) -> Iterator[bytes]:
+    """Декодирует OGG/Opus в PCM 16 кГц моно 16 бит и отдаёт его кусками по chunk_bytes по мере декодирования."""
+    if av is None:
+        # Запасной путь: pydub запускает ffmpeg и декодирует файл целиком
+        if AudioSegment is None:
+            raise ValueError("Для декодирования голосовых сообщений нужен пакет av (или pydub с ffmpeg)")
+        audio = AudioSegment.from_file(io.BytesIO(bytes(ogg_file)), format="ogg")
+        raw_pcm = audio.set_frame_rate(CONFIG["sample_rate"]).set_channels(1).set_sample_width(2).raw_data
+        for start in range(0, len(raw_pcm), chunk_bytes):
+            yield raw_pcm[start:start + chunk_bytes]
+        return
+
+    buffer = bytearray()
+    with av.open(io.BytesIO(bytes(ogg_file)), format="ogg") as container:
+        resampler = av.AudioResampler(format="s16", layout="mono", rate=CONFIG["sample_rate"])
+        frames = container.decode(audio=0)
+        for frame in frames:
+            for out in resampler.resample(frame):
+                # Плоскость может быть дополнена выравниванием: берём ровно samples * 2 байта
+                buffer += bytes(out.planes[0])[:out.samples * 2]
+            while len(buffer) >= chunk_bytes:
+                yield bytes(buffer[:chunk_bytes])
+                del buffer[:chunk_bytes]
+        for out in resampler.resample(None):
+            buffer += bytes(out.planes[0])[:out.samples * 2]
+    for start in range(0, len(buffer), chunk_bytes):
+        yield bytes(buffer[start:start + chunk_bytes])
+
+
+async def iterate_in_thread(iterator_factory, *args) -> AsyncIterator:
+    """Выполняет синхронный генератор в рабочем потоке и отдаёт его элементы в событийный цикл по мере готовности."""
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+    done = object()
+
+    def produce():
+        try:
+            for item in iterator_factory(*args):
+                if stop.is_set():
+                    return
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    loop.run_in_executor(None, produce)
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Потребитель прервался (ошибка отправки, тайм-аут): поток завершится на следующем куске
+        stop.set()
+
+
+def decode_voice_segments(ogg_file: bytes) -> Iterator[bytes]:
+    """Сегменты голосового сообщения по паузам, по мере декодирования."""
+    return split_on_silence(decode_ogg_to_pcm(ogg_file))
 
 
 class SpeechRecognizer:
-    def __init__(self, logger: logging.Logger):
+    def __init__(self, logger: logging.Logger, folder_id: str = None, service_account_key: dict = None,
+                 cache: TranscriptionCache = None):
         self.logger = logger
+        self.cache = cache
+        self.folder_id = folder_id or FOLDER_ID
+        if not self.folder_id:
+            raise ValueError("Переменная окружения FolderID не задана")
+        self.service_account_key = service_account_key or load_service_account_key()
         self._iam_token = None
         self._token_expiry = 0
+        self._token_lock = None
+        self._session = None
+        self._refresher = None
         self.logger.debug("SpeechRecognizer инициализирован")
 
+    async def start(self):
+        """Открывает пул соединений и запускает фоновое обновление IAM-токена."""
+        self._get_session()
+        if self._refresher is None or self._refresher.done():
+            self._refresher = asyncio.create_task(self._token_refresher())
+            self.logger.debug("Фоновое обновление IAM-токена запущено")
+
+    async def close(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+            await asyncio.gather(self._refresher, return_exceptions=True)
+            self._refresher = None
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self.logger.debug("SpeechRecognizer закрыт")
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Долгоживущая сессия с пулом keep-alive соединений к IAM и STT."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=CONFIG["pool_size"], keepalive_timeout=CONFIG["keepalive_timeout"])
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def _token_refresher(self):
+        """Обновляет токен за token_refresh_margin до истечения, чтобы запросы его не ждали."""
+        while True:
+            delay = self._token_expiry - CONFIG["token_refresh_margin"] - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                await self._refresh_token()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Фоновое обновление IAM-токена не удалось: {e}", exc_info=True)
+                await asyncio.sleep(CONFIG["token_retry_interval"])
+
     async def get_iam_token(self):
         self.logger.debug("Вход в get_iam_token")
+        if self._iam_token and self._token_expiry - 60 > time.time():
+            self.logger.debug("Возврат кэшированного IAM-токена")
+            return self._iam_token
+        # Сюда попадаем только до первого обновления или если фоновое обновление не справилось
         try:
-            now = int(time.time())
-            if self._iam_token and self._token_expiry - 60 > now:
-                self.logger.debug("Возврат кэшированного IAM-токена")
-                return self._iam_token
+            return await self._refresh_token()
+        except Exception as e:
+            self.logger.error(f"Ошибка при получении IAM-токена: {e}", exc_info=True)
+            raise ValueError(f"Не удалось получить IAM-токен: {str(e)}")
 
+    async def _refresh_token(self):
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        async with self._token_lock:
+            now = int(time.time())
+            if self._iam_token and self._token_expiry - CONFIG["token_refresh_margin"] > now:
+                return self._iam_token  # Обновил параллельный вызов
             self.logger.debug("Генерация нового JWT-токена")
-            payload = {
-                'aud': 'https://iam.api.cloud.yandex.net/iam/v1/tokens',
-                'iss': service_account_key['service_account_id'],
-                'iat': now,
-                'exp': now + 3600
-            }
-            jwt_token = jwt.encode(
-                payload,
-                service_account_key['private_key'],
-                algorithm='PS256',
-                headers={'kid': service_account_key['id']}
-            )
+            # Подпись PS256 — заметная работа CPU, выполняется вне событийного цикла
+            jwt_token = await asyncio.to_thread(self._sign_jwt, now)
             self.logger.debug("Отправка запроса на получение IAM-токена")
-            timeout = aiohttp.ClientTimeout(total=10)
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.post(
-                    'https://iam.api.cloud.yandex.net/iam/v1/tokens',
-                    json={'jwt': jwt_token}
-                ) as response:
-                    response.raise_for_status()
-                    data = await response.json()
-                    self._iam_token = data['iamToken']
-                    self._token_expiry = now + 3600
-                    self.logger.debug(f"IAM-токен получен, срок действия: {self._token_expiry}")
-                    return self._iam_token
+            async with self._get_session().post(
+                CONFIG["iam_url"],
+                json={'jwt': jwt_token},
+                timeout=aiohttp.ClientTimeout(total=10)
+            ) as response:
+                response.raise_for_status()
+                data = await response.json()
+            self._iam_token = data['iamToken']
+            self._token_expiry = now + CONFIG["token_lifetime"]
+            self.logger.debug(f"IAM-токен получен, срок действия: {self._token_expiry}")
+            return self._iam_token
+
+    def _sign_jwt(self, now: int) -> str:
+        service_account_key = self.service_account_key
+        payload = {
+            'aud': CONFIG["iam_url"],
+            'iss': service_account_key['service_account_id'],
+            'iat': now,
+            'exp': now + CONFIG["token_lifetime"]
+        }
+        return jwt.encode(
+            payload,
+            service_account_key['private_key'],
+            algorithm='PS256',
+            headers={'kid': service_account_key['id']}
+        )
+
+    async def stream_pcm(self, ogg_file: bytes) -> AsyncIterator[bytes]:
+        """Асинхронный поток кусков PCM 16 кГц моно; декодирование идёт в рабочем потоке."""
+        self.logger.debug(f"Потоковое декодирование OGG ({'av' if av else 'pydub'}), размер: {len(ogg_file)} байт")
+        decoded = 0
+        try:
+            async for chunk in iterate_in_thread(decode_ogg_to_pcm, ogg_file):
+                decoded += len(chunk)
+                yield chunk
         except Exception as e:
-            self.logger.error(f"Ошибка при получении IAM-токена: {e}", exc_info=True)
-            raise ValueError(f"Не удалось получить IAM-токен: {str(e)}")
+            self.logger.error(f"Ошибка декодирования OGG: {e}", exc_info=True)
+            raise ValueError(f"Ошибка при декодировании голосового сообщения: {str(e)}")
+        self.logger.debug(f"Декодирование завершено, размер raw PCM: {decoded} байт")
 
     async def convert_ogg_to_wav(self, ogg_file: bytes) -> bytes:
-        self.logger.debug("Конвертация через pydub")
+        """PCM целиком (без WAV-заголовка, имя сохранено для совместимости)."""
+        return b"".join([chunk async for chunk in self.stream_pcm(ogg_file)])
+
+    async def cached_transcription(self, file_unique_id: str) -> Optional[str]:
+        """Текст уже распознанного файла Telegram: при попадании не нужны ни загрузка, ни декодирование."""
+        if not self.cache or not file_unique_id:
+            return None
+        text = await asyncio.to_thread(self.cache.get, file_key(file_unique_id))
+        if text is not None:
+            self.logger.debug(f"Голосовое сообщение {file_unique_id} найдено в кеше распознавания")
+        return text
+
+    async def recognize_voice(self, ogg_file: bytes, timeout: float = 30.0, file_unique_id: str = None) -> str:
+        """Распознаёт голосовое сообщение: сегменты по паузам уходят в STT, пока декодируется остальное."""
+        self.logger.debug(f"Распознавание голосового сообщения, размер OGG: {len(ogg_file)} байт")
+        # Ошибки STT приходят из recognize_speech со своим текстом; как ошибки декодирования оборачиваются
+        # только исключения самого декодера
+        segments = self._decode_errors(iterate_in_thread(decode_voice_segments, bytes(ogg_file)))
+        text = await self.recognize_segments(segments, timeout=timeout)
+        if self.cache and file_unique_id and text:
+            await asyncio.to_thread(self.cache.set, file_key(file_unique_id), text)
+        return text
+
+    async def _decode_errors(self, segments: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """Пропускает сегменты декодера, превращая его исключения в ValueError с понятным текстом."""
         try:
-            audio = AudioSegment.from_file(io.BytesIO(ogg_file), format="ogg")
-            audio = audio.set_frame_rate(16000).set_channels(1).set_sample_width(2)  # 2 байта = 16 бит
-            raw_pcm = audio.raw_data
-            self.logger.debug(f"Конвертация завершена, размер raw PCM: {len(raw_pcm)} байт")
-            return raw_pcm
+            async for pcm in segments:
+                yield pcm
         except Exception as e:
-            self.logger.error(f"Ошибка конвертации через pydub: {e}", exc_info=True)
-            raise ValueError(f"Ошибка при конвертации через pydub: {str(e)}")
+            self.logger.error(f"Ошибка декодирования OGG: {e}", exc_info=True)
+            raise ValueError(f"Ошибка при декодировании голосового сообщения: {str(e)}")
+
+    async def recognize_segments(self, segments: AsyncIterator[bytes], timeout: float = 30.0) -> str:
+        """Распознаёт сегменты параллельно (не больше max_parallel_segments) и склеивает текст по порядку."""
+        semaphore = asyncio.Semaphore(CONFIG["max_parallel_segments"])
 
+        async def recognize(pcm: bytes) -> str:
+            # Тот же звук, загруженный заново (другой file_unique_id), даёт те же сегменты PCM
+            key = pcm_key(pcm) if self.cache else None
+            if key:
+                text = await asyncio.to_thread(self.cache.get, key)
+                if text is not None:
+                    return text
+            async with semaphore:
+                text = await self.recognize_speech(pcm, timeout=timeout)
+            if key and text:
+                await asyncio.to_thread(self.cache.set, key, text)
+            return text
 
-    async def recognize_speech(self, audio_data: bytes, timeout: float = 30.0) -> str:
-        self.logger.debug(f"Вход в recognize_speech (HTTP), размер аудио: {len(audio_data)} байт")
+        tasks = []
+        try:
+            async for pcm in segments:
+                tasks.append(asyncio.create_task(recognize(pcm)))
+            texts = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        self.logger.debug(f"Распознано сегментов: {len(tasks)}")
+        return " ".join(text.strip() for text in texts if text.strip())
+
+
+    async def recognize_speech(self, audio_data: Union[bytes, AsyncIterator[bytes]], timeout: float = 30.0) -> str:
+        """Распознаёт PCM 16 кГц моно; поток кусков уходит в тело запроса chunked-загрузкой."""
+        size = f"{len(audio_data)} байт" if isinstance(audio_data, (bytes, bytearray)) else "поток"
+        self.logger.debug(f"Вход в recognize_speech (HTTP), размер аудио: {size}")
         try:
             token = await self.get_iam_token()
             headers = {
                 'Authorization': f'Bearer {token}',
-                'Folder-Id': FOLDER_ID,
+                'Folder-Id': self.folder_id,
                 'Content-Type': 'application/octet-stream'
             }
 
             params = {
                 'lang': 'ru-RU',
                 'format': 'lpcm',
-                'sampleRateHertz': '16000',
+                'sampleRateHertz': str(CONFIG["sample_rate"]),
                 'audioChannelCount': '1',
                 'profanityFilter': 'false',
                 'partialResults': 'false'
             }
 
-            timeout_obj = aiohttp.ClientTimeout(total=timeout)
-            async with aiohttp.ClientSession(timeout=timeout_obj) as session:
-                async with session.post(
-                    'https://stt.api.cloud.yandex.net/speech/v1/stt:recognize',
-                    params=params,
-                    data=audio_data,
-                    headers=headers
-                ) as response:
-                    response.raise_for_status()
-                    result = await response.json()
-                    self.logger.debug(f"Ответ от HTTP STT: {result}")
-
-                    text = result.get('result', '')
-                    if text.strip():
-                        return text
-
-                    self.logger.warning("Транскрипция не получена от сервиса STT")
-                    return ""
+            async with self._get_session().post(
+                CONFIG["stt_url"],
+                params=params,
+                data=audio_data,
+                headers=headers,
+                timeout=aiohttp.ClientTimeout(total=timeout)
+            ) as response:
+                response.raise_for_status()
+                result = await response.json()
+                self.logger.debug(f"Ответ от HTTP STT: {result}")
+
+                text = result.get('result', '')
+                if text.strip():
+                    return text
+
+                self.logger.warning("Транскрипция не получена от сервиса STT")
+                return ""
 
         except asyncio.TimeoutError:
             self.logger.error(f"Тайм-аут распознавания речи после {timeout:.1f} секунд", exc_info=True)
@@ -1,4 +1,5 @@
 import logging
+import os
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler, ContextTypes
 from telegram.constants import ParseMode
@@ -9,16 +10,43 @@ from typing import Dict, Any
 import asyncio
 import traceback
 from telegram.ext import (
-    ApplicationBuilder, CommandHandler, MessageHandler,
+    ApplicationBuilder, BaseUpdateProcessor, CommandHandler, MessageHandler,
     CallbackQueryHandler, ContextTypes, filters
 )
 from telegram.request import HTTPXRequest
 from telegram.error import NetworkError, RetryAfter, TelegramError
 import re
+import secrets
+
+from Bot_core.report_jobs import ReportJobQueue, JobLimitError, DONE, CANCELLED
+from Utils.chat_queue import ChatOrderedExecutor
+from Utils.sensor_index import SensorIndex
+from Utils.task_scheduler import TaskScheduler, QueueFullError
+from Utils.update_dedup import UpdateDeduplicator
 
 CONFIG = {
     "telegram": {"timeout": 10},
     "bot": {"default_lang": "ru", "max_message_length": 4096},
+    # max_concurrent — обновлений разных чатов, обрабатываемых одновременно;
+    # max_pending — принятых в работу вместе с ожидающими своей очереди в чате
+    "updates": {"max_concurrent": 16, "max_pending": 1024},
+    "webhook": {
+        # Публичный адрес сервера дашборда; если задан, бот получает обновления вебхуком вместо polling
+        "public_url": os.getenv("TELEGRAM_WEBHOOK_URL", ""),
+        "path": "/telegram/webhook",
+        "secret_token": os.getenv("TELEGRAM_WEBHOOK_SECRET", ""),
+        "dedup_window": 10000,
+    },
+    "scheduler": {
+        # Класс ресурсов планировщика для каждого действия ActionExecutor
+        "action_resources": {
+            "plot_selected_sensor": "render",
+            "plot_random_sensor": "render",
+            "generate_report": "report",
+            "clarify": "llm",
+        },
+        "default_resource": "sql",
+    },
 }
 
 MESSAGES = {
@@ -33,24 +61,38 @@ MESSAGES = {
             "- Построить график для датчика за указанный период\n"
             "- Показать список доступных датчиков\n"
             "- Показать информацию о датчике\n"
-            "- Показать доступный период данных\n\n"
+            "- Показать доступный период данных\n"
+            "- Показать найденные события: глюки, переходы, аномалии\n\n"
             "Просто напиши запрос, например: 'Нарисуй график для T01 с 2023-04-03 по 2023-04-09'.\n"
-            "Или отправь голосовое сообщение с запросом."
+            "Или отправь голосовое сообщение с запросом.\n"
+            "Отчёты собираются в фоне; /cancel отменяет текущий отчёт."
         ),
         "error": "❌ Произошла ошибка: {reason}",
         "voice_processing": "Обработка голосового сообщения...",
         "voice_error": "Не удалось распознать голосовое сообщение: {reason}",
+        "queued": "⏳ Запрос поставлен в очередь, позиция: {position}",
+        "busy": "Слишком много запросов в очереди, дождитесь выполнения предыдущих",
+        "report_queued": "📄 Отчёт поставлен в очередь (задача {job_id}). Отменить: /cancel",
+        "report_progress": {
+            "plot": "📊 Отчёт {job_id}: графики {done}/{total}",
+            "report": "📝 Отчёт {job_id}: сборка PDF и DOCX",
+        },
+        "report_done": "✅ Отчёт {job_id} готов",
+        "report_cancelled": "Отчёт {job_id} отменён",
+        "report_failed": "❌ Не удалось собрать отчёт {job_id}: {reason}",
+        "report_limit": "У вас уже есть отчёты в работе, дождитесь их завершения или отмените: /cancel",
+        "cancel_done": "Отменено задач: {count}",
+        "cancel_none": "Нет активных задач для отмены",
     }
 }
 
-def normalize_sensor_name(sensor: str, available_sensors: list) -> str:
-    """Нормализует имя датчика, например, 'т6' -> 'T06'."""
-    sensor = sensor.strip().lower()
-    sensor = re.sub(r'[^a-z0-9]', '', sensor)
-    for s in available_sensors:
-        if sensor == s.lower() or sensor == s.lower().replace('t', ''):
-            return s
-    return sensor.upper() if sensor.startswith('t') else f"T{sensor.upper()}"
+def normalize_sensor_name(sensor: str, available_sensors: list, sensor_index: SensorIndex = None) -> str:
+    """Нормализует имя датчика, например, 'т6' -> 'T06 (T32)'.
+
+    Неизвестное имя возвращается как есть: его проверит валидация LLM, а не подмена на похожий датчик.
+    """
+    index = sensor_index or SensorIndex(available_sensors)
+    return index.resolve(sensor) or sensor
 
 def escape_markdown_v2(text: str) -> str:
     """Экранирует специальные символы для MarkdownV2."""
@@ -135,7 +177,15 @@ class ResultProcessor:
                 await update.message.reply_text(response, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN_V2)
                 self.logger.debug("Отправлен запрос на уточнение: %s", response)
 
-            # === 6. ОТЧЁТ: 7 файлов как документы (PDF, DOCX, 5 PNG) ===
+            # === 6. События потокового анализа ===
+            elif isinstance(result_data, dict) and "events" in result_data:
+                message = result_data.get("message", "")
+                if len(message) > self.max_message_length:
+                    message = message[:self.max_message_length - 3] + "..."
+                await update.message.reply_text(escape_markdown_v2(message), parse_mode=ParseMode.MARKDOWN_V2)
+                self.logger.debug("Отправлены события: %d", len(result_data["events"]))
+
+            # === 7. ОТЧЁТ: 7 файлов как документы (PDF, DOCX, 5 PNG) ===
             elif isinstance(result_data, dict) and "files" in result_data:
                 files = result_data["files"]
                 message = result_data.get("message", "Отчёт готов")
@@ -203,6 +253,47 @@ class ResultProcessor:
 
 
 
+class ChatTarget:
+    """Замена Update для ResultProcessor, когда ответ уходит в чат без исходного сообщения
+    (результаты фоновых задач, в том числе возобновлённых после перезапуска)."""
+
+    def __init__(self, bot, chat_id: int):
+        self.message = self
+        self._bot = bot
+        self._chat_id = chat_id
+
+    async def reply_text(self, text, **kwargs):
+        return await self._bot.send_message(chat_id=self._chat_id, text=text, **kwargs)
+
+    async def reply_photo(self, photo, **kwargs):
+        return await self._bot.send_photo(chat_id=self._chat_id, photo=photo, **kwargs)
+
+    async def reply_document(self, document, **kwargs):
+        return await self._bot.send_document(chat_id=self._chat_id, document=document, **kwargs)
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений: разные чаты одновременно, внутри чата — по порядку."""
+
+    def __init__(self, max_concurrent_updates: int, max_pending_updates: int = CONFIG["updates"]["max_pending"],
+                 logger: logging.Logger = None):
+        # Семафор базового класса (process_update помечен @final) занимается ещё до очереди чата,
+        # поэтому ему дан высокий лимит, а настоящий лимит обработки — у executor: его слот берётся
+        # только когда подошла очередь чата, и сообщения одного чата не держат слоты других
+        super().__init__(max(max_pending_updates, max_concurrent_updates))
+        self.executor = ChatOrderedExecutor(max_concurrent_updates, logger=logger)
+
+    async def do_process_update(self, update, coroutine) -> None:
+        chat = update.effective_chat if isinstance(update, Update) else None
+        await self.executor.run(chat.id if chat else None, coroutine)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
 class TelegramBot:
     def __init__(
         self,
@@ -215,7 +306,9 @@ class TelegramBot:
         action_executor,
         speech_recognizer,
         debug_mode: bool = False,
-        logger: logging.Logger = None
+        logger: logging.Logger = None,
+        scheduler: TaskScheduler = None,
+        report_jobs: ReportJobQueue = None
     ):
         self.token = token
         self.debug_mode = debug_mode
@@ -227,6 +320,18 @@ class TelegramBot:
         self.action_executor = action_executor
         self.speech_recognizer = speech_recognizer
         self.logger = logger or logging.getLogger(__name__)
+        self.scheduler = scheduler or TaskScheduler(logger=self.logger)
+        self.report_jobs = report_jobs
+        self.update_processor = PerChatUpdateProcessor(CONFIG["updates"]["max_concurrent"], logger=self.logger)
+        self.webhook_url = CONFIG["webhook"]["public_url"].rstrip("/") + CONFIG["webhook"]["path"] \
+            if CONFIG["webhook"]["public_url"] else ""
+        self.webhook_path = CONFIG["webhook"]["path"]
+        self.webhook_secret = CONFIG["webhook"]["secret_token"]
+        if self.webhook_url and not self.webhook_secret:
+            # Без секрета вебхук принимал бы поддельные обновления от кого угодно
+            self.webhook_secret = secrets.token_urlsafe(32)
+            self.logger.warning("TELEGRAM_WEBHOOK_SECRET не задан, для вебхука создан случайный секрет")
+        self.update_dedup = UpdateDeduplicator(CONFIG["webhook"]["dedup_window"])
         self.result_processor = ResultProcessor(
             CONFIG["bot"]["default_lang"],
             CONFIG["bot"]["max_message_length"],
@@ -244,21 +349,143 @@ class TelegramBot:
             read_timeout=120.0,
             write_timeout=120.0,
             pool_timeout=30.0,
-            connection_pool_size=8,
+            connection_pool_size=max(8, CONFIG["updates"]["max_concurrent"]),
             http_version="2",
         )
         return (
             ApplicationBuilder()
             .token(self.token)
             .request(request)
+            .concurrent_updates(self.update_processor)
             .build()
         )
 
+    def get_update_stats(self) -> Dict[str, Any]:
+        """Счётчики обработки обновлений и времени их ожидания в очереди."""
+        return dict(self.update_processor.executor.get_stats(), dedup=self.update_dedup.get_stats())
+
+    @property
+    def webhook_enabled(self) -> bool:
+        return bool(self.webhook_url)
+
+    async def feed_update(self, data: Dict[str, Any]) -> bool:
+        """Передаёт обновление из вебхука (или повтора) в очередь приложения.
+
+        Возвращает False для уже полученного update_id. RuntimeError — приложение ещё не запущено,
+        ValueError — тело не является обновлением Telegram.
+        """
+        if self.app is None or not self.app.running:
+            raise RuntimeError("Приложение Telegram не запущено")
+        if not isinstance(data, dict) or not isinstance(data.get("update_id"), int):
+            raise ValueError("Ожидается объект обновления с update_id")
+        if data["update_id"] in self.update_dedup:
+            self.update_dedup.add(data["update_id"])
+            self.logger.debug("Повторное обновление %s пропущено", data["update_id"])
+            return False
+        update = Update.de_json(data, self.app.bot)
+        if update is None:
+            raise ValueError("Не удалось разобрать обновление")
+        self.update_dedup.add(update.update_id)
+        await self.app.update_queue.put(update)
+        return True
+
+    async def _start_receiving(self) -> None:
+        """Включает получение обновлений: вебхук, если задан публичный адрес, иначе long polling."""
+        if self.webhook_enabled:
+            self.logger.debug("Регистрация вебхука: %s", self.webhook_url)
+            await self.app.bot.set_webhook(
+                url=self.webhook_url,
+                secret_token=self.webhook_secret,
+                allowed_updates=Update.ALL_TYPES,
+            )
+            self.logger.info("Вебхук зарегистрирован, обновления принимает сервер дашборда")
+        else:
+            self.logger.debug("Запуск polling")
+            await self.app.updater.start_polling()
+
+    def _queue_notifier(self, message, lang: str):
+        """Колбэк для планировщика: один раз сообщает пользователю позицию его запроса в очереди."""
+        sent = False
+
+        async def notify(position: int):
+            nonlocal sent
+            if sent:
+                return
+            sent = True
+            await message.reply_text(MESSAGES[lang]["queued"].format(position=position))
+        return notify
+
+    async def _formalize(self, user_id: int, notify, *args):
+        async with self.scheduler.slot(user_id, "llm", on_queued=notify):
+            return await self.request_formalizer.formalize(*args)
+
+    async def _execute(self, user_id: int, formalized: Dict[str, Any], notify):
+        resources = CONFIG["scheduler"]["action_resources"]
+        resource = resources.get(formalized.get("action"), CONFIG["scheduler"]["default_resource"])
+        async with self.scheduler.slot(user_id, resource, on_queued=notify):
+            return await self.action_executor.execute(formalized)
+
+    async def _submit_report(self, message, user_id: int, result: Dict[str, Any]) -> bool:
+        """Ставит отчёт в очередь задач, если execute() вернул параметры задачи; True — результат обработан."""
+        result_data = result.get("result") if isinstance(result, dict) else None
+        if not self.report_jobs or not isinstance(result_data, dict) or "report_job" not in result_data:
+            return False
+        lang = CONFIG["bot"]["default_lang"]
+        try:
+            job_id = self.report_jobs.submit(user_id, message.chat_id, result_data["report_job"])
+        except JobLimitError as e:
+            self.logger.debug("Отчёт пользователя %s не поставлен в очередь: %s", user_id, e)
+            await message.reply_text(MESSAGES[lang]["report_limit"])
+            return True
+        text = MESSAGES[lang]["report_queued"].format(job_id=job_id)
+        status_message = await message.reply_text(text)
+        self.report_jobs.set_status_message(job_id, status_message.message_id)
+        await self.history_manager.add_message_async(user_id, text, is_bot=True, user_info={})
+        return True
+
+    async def _edit_job_status(self, job: Dict[str, Any], text: str) -> None:
+        if not job.get("status_message_id"):
+            return
+        try:
+            await self.app.bot.edit_message_text(text=text, chat_id=job["chat_id"], message_id=job["status_message_id"])
+        except TelegramError as e:
+            # В том числе «message is not modified» и удалённое пользователем сообщение
+            self.logger.debug("Не удалось обновить статус задачи %s: %s", job["id"], e)
+
+    async def _on_report_progress(self, job: Dict[str, Any], stage: str, done: int, total: int) -> None:
+        template = MESSAGES[CONFIG["bot"]["default_lang"]]["report_progress"].get(stage)
+        if template:
+            await self._edit_job_status(job, template.format(job_id=job["id"], done=done, total=total))
+
+    async def _on_report_finished(self, job: Dict[str, Any]) -> None:
+        lang = CONFIG["bot"]["default_lang"]
+        if job["status"] == DONE:
+            result = json.loads(job["result"])
+            await self._edit_job_status(job, MESSAGES[lang]["report_done"].format(job_id=job["id"]))
+            await self.result_processor.process(ChatTarget(self.app.bot, job["chat_id"]), result)
+            await self.history_manager.add_message_async(job["user_id"], job["result"], is_bot=True, user_info={})
+        elif job["status"] == CANCELLED:
+            await self._edit_job_status(job, MESSAGES[lang]["report_cancelled"].format(job_id=job["id"]))
+        else:
+            await self._edit_job_status(job, MESSAGES[lang]["report_failed"].format(job_id=job["id"], reason=job["error"]))
+
+    async def cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        lang = CONFIG["bot"]["default_lang"]
+        user_id = update.effective_user.id
+        job_id = context.args[0] if context.args else None
+        self.logger.debug("Команда /cancel от пользователя %s: %s", user_id, job_id)
+        cancelled = self.report_jobs.cancel(user_id, job_id) if self.report_jobs else []
+        if cancelled:
+            await update.message.reply_text(MESSAGES[lang]["cancel_done"].format(count=len(cancelled)))
+        else:
+            await update.message.reply_text(MESSAGES[lang]["cancel_none"])
+
     def _register_handlers(self):
         self.logger.debug("Регистрация обработчиков сообщений")
         self.app.add_handler(CommandHandler("start", self.start))
         self.app.add_handler(CommandHandler("help", self.help))
         self.app.add_handler(CommandHandler("sensors", self.sensors))
+        self.app.add_handler(CommandHandler("cancel", self.cancel))
         self.app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
         self.app.add_handler(MessageHandler(filters.VOICE, self.handle_voice_message))
         self.app.add_handler(MessageHandler(filters.COMMAND, self.unknown_command))
@@ -312,11 +539,16 @@ class TelegramBot:
                 parse_mode=ParseMode.MARKDOWN_V2
             )
 
-            voice = await update.message.voice.get_file()
-            ogg_data = await voice.download_as_bytearray()
+            file_unique_id = update.message.voice.file_unique_id
+            transcribed_text = await self.speech_recognizer.cached_transcription(file_unique_id)
+            if transcribed_text is None:
+                voice = await update.message.voice.get_file()
+                ogg_data = await voice.download_as_bytearray()
 
-            wav_data = await self.speech_recognizer.convert_ogg_to_wav(ogg_data)
-            transcribed_text = await self.speech_recognizer.recognize_speech(wav_data)
+                # Декодирование и отправка в STT идут одновременно, PCM уходит кусками
+                transcribed_text = await self.speech_recognizer.recognize_voice(
+                    bytes(ogg_data), file_unique_id=file_unique_id
+                )
         
             if not transcribed_text:
                 await processing_message.edit_text(
@@ -354,8 +586,9 @@ class TelegramBot:
         lang = CONFIG["bot"]["default_lang"]
         self.logger.debug("Получено сообщение от пользователя %s: %s", user_id, message)
 
+        notify = self._queue_notifier(update.message, lang)
         try:
-            history = self.history_manager.get_history(user_id)[-50:]
+            history = (await self.history_manager.get_history_async(user_id))[-50:]
             available_sensors = [s["sensor_name"] for s in self.data_reader.get_sensor_info().values()]
             time_period = self.data_reader.get_time_period()
             self.logger.debug("Формализация запроса для пользователя %s: %s", user_id, message)
@@ -364,7 +597,7 @@ class TelegramBot:
             sensor_match = re.search(r'т\d+', message, re.IGNORECASE)
             if sensor_match:
                 sensor = sensor_match.group(0)
-                normalized_sensor = normalize_sensor_name(sensor, available_sensors)
+                normalized_sensor = normalize_sensor_name(sensor, available_sensors, self.data_reader.get_sensor_index())
                 normalized_message = message.replace(sensor, normalized_sensor)
                 self.logger.debug("Нормализовано имя датчика: %s -> %s", sensor, normalized_sensor)
 
@@ -372,8 +605,8 @@ class TelegramBot:
                 normalized_message += " с 2025-05-01 по 2025-05-31"
                 self.logger.debug("Добавлен период по умолчанию: %s", normalized_message)
 
-            formalized = await self.request_formalizer.formalize(normalized_message, history, lang, available_sensors, time_period)
-            self.history_manager.add_message(user_id, message, is_bot=False, user_info={})
+            formalized = await self._formalize(user_id, notify, normalized_message, history, lang, available_sensors, time_period)
+            await self.history_manager.add_message_async(user_id, message, is_bot=False, user_info={})
             self.logger.debug("Сообщение пользователя %s добавлено в историю: %s", user_id, message)
 
             if not formalized or "action" not in formalized:
@@ -389,12 +622,12 @@ class TelegramBot:
                 if len(response) > CONFIG["bot"]["max_message_length"]:
                     response = response[:CONFIG["bot"]["max_message_length"] - 3] + "..."
                 await update.message.reply_text(escape_markdown_v2(response), parse_mode=ParseMode.MARKDOWN_V2)
-                self.history_manager.add_message(user_id, response, is_bot=True, user_info={})
+                await self.history_manager.add_message_async(user_id, response, is_bot=True, user_info={})
                 self.logger.debug("Отправлен свободный ответ пользователю %s: %s", user_id, response)
                 return
 
             if formalized["action"] == "clarify":
-                result = await self.action_executor.execute(formalized)
+                result = await self._execute(user_id, formalized, notify)
                 if "validation_results" in result:
                     for vr in result["validation_results"]:
                         if vr.get("corrected_name"):
@@ -402,13 +635,15 @@ class TelegramBot:
                                 formalized["parameters"].get("sensor_name", ""), vr["corrected_name"]
                             )
                             self.logger.debug("Повторная формализация с датчиком %s: %s", vr["corrected_name"], new_message)
-                            formalized = await self.request_formalizer.formalize(
-                                new_message, history, lang, available_sensors, time_period
+                            formalized = await self._formalize(
+                                user_id, notify, new_message, history, lang, available_sensors, time_period
                             )
                             if formalized["action"] != "clarify":
-                                result = await self.action_executor.execute(formalized)
+                                result = await self._execute(user_id, formalized, notify)
+                                if await self._submit_report(update.message, user_id, result):
+                                    return
                                 await self.result_processor.process(update, result)
-                                self.history_manager.add_message(
+                                await self.history_manager.add_message_async(
                                     user_id, json.dumps(result, ensure_ascii=False), is_bot=True, user_info={}
                                 )
                                 return
@@ -423,12 +658,12 @@ class TelegramBot:
                 except TelegramError as te:
                     self.logger.error("Ошибка Telegram при отправке ответа: %s", te)
                     await update.message.reply_text(response)
-                self.history_manager.add_message(user_id, response, is_bot=True, user_info={})
+                await self.history_manager.add_message_async(user_id, response, is_bot=True, user_info={})
                 self.logger.debug("Отправлен запрос на уточнение пользователю %s: %s", user_id, response)
                 return
 
             self.logger.debug("Выполнение действия для пользователя %s: %s", user_id, formalized["action"])
-            result = await self.action_executor.execute(formalized)
+            result = await self._execute(user_id, formalized, notify)
     
             if not result or "result" not in result:
                 error_message = MESSAGES[lang]["error"].format(
@@ -438,10 +673,15 @@ class TelegramBot:
                 self.logger.error("Некорректный результат действия: %s", result)
                 return
 
+            if await self._submit_report(update.message, user_id, result):
+                return
             await self.result_processor.process(update, result)
-            self.history_manager.add_message(user_id, json.dumps(result, ensure_ascii=False), is_bot=True, user_info={})
+            await self.history_manager.add_message_async(user_id, json.dumps(result, ensure_ascii=False), is_bot=True, user_info={})
             self.logger.debug("Результат действия отправлен пользователю %s: %s", user_id, json.dumps(result))
 
+        except QueueFullError as qe:
+            self.logger.debug("Запрос пользователя %s отклонён планировщиком: %s", user_id, qe)
+            await update.message.reply_text(MESSAGES[lang]["busy"])
         except json.JSONDecodeError as je:
             self.logger.error("Ошибка JSON при обработке сообщения от пользователя %s: %s", user_id, je)
             error_message = MESSAGES[lang]["error"].format(
@@ -471,18 +711,24 @@ class TelegramBot:
         try:
             if data.startswith("clarify:"):
                 clarified_request = data.replace("clarify:", "")
-                history = self.history_manager.get_history(user_id)[-50:]
+                history = (await self.history_manager.get_history_async(user_id))[-50:]
                 available_sensors = [s["sensor_name"] for s in self.data_reader.get_sensor_info().values()]
                 time_period = self.data_reader.get_time_period()
-                formalized = await self.request_formalizer.formalize(clarified_request, history, lang, available_sensors, time_period)
+                notify = self._queue_notifier(query.message, lang)
+                formalized = await self._formalize(user_id, notify, clarified_request, history, lang, available_sensors, time_period)
             
-                self.history_manager.add_message(user_id, clarified_request, is_bot=False, user_info={})
+                await self.history_manager.add_message_async(user_id, clarified_request, is_bot=False, user_info={})
                 self.logger.debug("Callback запрос пользователя %s добавлен в историю: %s", user_id, clarified_request)
 
-                result = await self.action_executor.execute(formalized)
+                result = await self._execute(user_id, formalized, notify)
+                if await self._submit_report(query.message, user_id, result):
+                    return
                 await self.result_processor.process(update, result)
-                self.history_manager.add_message(user_id, json.dumps(result, ensure_ascii=False), is_bot=True, user_info={})
+                await self.history_manager.add_message_async(user_id, json.dumps(result, ensure_ascii=False), is_bot=True, user_info={})
                 self.logger.debug("Результат callback действия отправлен пользователю %s: %s", user_id, json.dumps(result))
+        except QueueFullError as qe:
+            self.logger.debug("Callback пользователя %s отклонён планировщиком: %s", user_id, qe)
+            await query.message.reply_text(MESSAGES[lang]["busy"])
         except Exception as e:
             self.logger.error("Ошибка обработки callback от пользователя %s: %s", user_id, e)
             self.logger.error("Трассировка стека: %s", traceback.format_exc())
@@ -515,18 +761,23 @@ class TelegramBot:
             try:
                 self.logger.debug("Инициализация приложения Telegram")
                 await self.app.initialize()
-                self.logger.debug("Запуск polling")
                 await self.app.start()
-                await self.app.updater.start_polling()
+                await self._start_receiving()
+                if self.report_jobs:
+                    await self.report_jobs.start(self._on_report_progress, self._on_report_finished)
+                await self.speech_recognizer.start()
                 self.logger.info("Бот успешно запущен")
                 while True:
                     await asyncio.sleep(3600)
+                    self.logger.info("Статистика обработки обновлений: %s", self.get_update_stats())
             except (NetworkError, RetryAfter, TelegramError) as e:
                 self.logger.error("Сетевая ошибка %s: %s", type(e).__name__, traceback.format_exc())
                 await asyncio.sleep(10)
                 self.logger.info("Пытаюсь перезапустить бота...")
                 try:
-                    await self.app.updater.shutdown()
+                    if self.app.updater.running:
+                        await self.app.updater.stop()
+                    await self.app.stop()
                     await self.app.shutdown()
                 except:
                     pass
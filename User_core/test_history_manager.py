@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import sqlite3
+import threading
+import time
+import pytest
+
+import User_core.history_manager as hm_mod
+from User_core.history_manager import HistoryManager, SCHEMA_VERSION
+
+@pytest.fixture
+def history_manager(tmp_path):
+    hm = HistoryManager(str(tmp_path / "history.db"), timeout_hours=24, max_history_size=5)
+    yield hm
+    hm.close()
+
+def test_add_and_get_history(history_manager):
+    for i in range(8):
+        history_manager.add_message(1, f"msg {i}", is_bot=i % 2 == 1, user_info={"language_code": "ru"})
+    history = history_manager.get_history(1)
+    assert [r["message"] for r in history] == [f"msg {i}" for i in range(3, 8)]
+    assert history[-1]["is_bot"] is True
+    assert history[0]["user_info"] == {"language_code": "ru"}
+    assert history_manager.get_history(2) == []
+
+def test_cache_roundtrip_and_expiry(history_manager):
+    history_manager.set_cache("sensor_info", {"T01": {"index": 1}}, ttl_seconds=60)
+    assert history_manager.get_cache("sensor_info") == {"T01": {"index": 1}}
+    history_manager.set_cache("expired", 1, ttl_seconds=-1)
+    assert history_manager.get_cache("expired") is None
+    history_manager.clear_cache("sensor_info")
+    assert history_manager.get_cache("sensor_info") is None
+
+def test_task_count(history_manager):
+    history_manager.update_task_count(7, increment=True)
+    history_manager.update_task_count(7, increment=True)
+    history_manager.update_task_count(7, increment=False)
+    assert history_manager.get_task_count(7) == 1
+
+def test_writes_from_many_threads(history_manager):
+    def worker(user_id):
+        for i in range(10):
+            history_manager.add_message(user_id, f"{user_id}-{i}", is_bot=False, user_info={})
+    threads = [threading.Thread(target=worker, args=(uid,)) for uid in range(1, 5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    history_manager.flush()
+    assert len(history_manager.get_all_users_history()) == 4 * 5
+
+def test_closed_manager_rejects_writes(history_manager):
+    history_manager.close()
+    history_manager.add_message(1, "после закрытия", is_bot=False, user_info={})
+    with pytest.raises(RuntimeError):
+        history_manager._write(lambda conn: None)
+
+@pytest.mark.asyncio
+async def test_async_api(history_manager):
+    await asyncio.gather(*(history_manager.add_message_async(3, f"m{i}", False, {}) for i in range(3)))
+    history = await history_manager.get_history_async(3)
+    assert sorted(r["message"] for r in history) == ["m0", "m1", "m2"]
+
+def test_unflushed_rows_are_visible(history_manager, monkeypatch):
+    monkeypatch.setitem(hm_mod.CONFIG, "flush_interval", 60)
+    history_manager.add_message(9, "в буфере", is_bot=False, user_info={})
+    assert [r["message"] for r in history_manager.get_history(9)] == ["в буфере"]
+    history_manager.flush()
+    assert not history_manager._pending
+    assert [r["message"] for r in history_manager.get_history(9)] == ["в буфере"]
+
+def test_flush_between_buffer_and_db_reads_loses_nothing(history_manager, monkeypatch):
+    monkeypatch.setitem(hm_mod.CONFIG, "flush_interval", 60)
+    history_manager.add_message(9, "first", is_bot=False, user_info={})
+    history_manager.flush()
+    history_manager.add_message(9, "second", is_bot=False, user_info={})
+    read = history_manager._read
+
+    def read_then_flush(func):
+        result = read(func)
+        history_manager.flush()
+        return result
+    monkeypatch.setattr(history_manager, "_read", read_then_flush)
+    assert [r["message"] for r in history_manager.get_history(9)] == ["first", "second"]
+
+def test_cold_load_does_not_block_writers(history_manager, monkeypatch):
+    monkeypatch.setitem(hm_mod.CONFIG, "flush_interval", 60)
+    history_manager.add_message(9, "first", is_bot=False, user_info={})
+    history_manager.flush()
+    read = history_manager._read
+
+    def read_while_writing(func):
+        result = read(func)
+        writer = threading.Thread(target=history_manager.add_message, args=(9, "second", False, {}))
+        writer.start()
+        writer.join(timeout=2)
+        assert not writer.is_alive(), "add_message ждал загрузки истории"
+        history_manager.flush()
+        return result
+    monkeypatch.setattr(history_manager, "_read", read_while_writing)
+    assert [r["message"] for r in history_manager.get_history(9)] == ["first", "second"]
+    assert not history_manager._loading
+
+def test_close_flushes_buffer(tmp_path, monkeypatch):
+    monkeypatch.setitem(hm_mod.CONFIG, "flush_interval", 60)
+    db_path = str(tmp_path / "history.db")
+    hm = HistoryManager(db_path, timeout_hours=24, max_history_size=5)
+    for i in range(3):
+        hm.add_message(1, f"m{i}", is_bot=False, user_info={})
+    hm.close()
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM user_history").fetchone()[0] == 3
+
+def test_history_served_from_memory_after_first_read(history_manager, monkeypatch):
+    history_manager.add_message(4, "первое", is_bot=False, user_info={})
+    history_manager.flush()
+    assert [r["message"] for r in history_manager.get_history(4)] == ["первое"]
+
+    def fail(*args, **kwargs):
+        raise AssertionError("get_history обратился к БД")
+    monkeypatch.setattr(history_manager, "_read", fail)
+    monkeypatch.setattr(history_manager, "_submit_write", fail)
+    history_manager.add_message(4, "второе", is_bot=True, user_info={})
+    assert [r["message"] for r in history_manager.get_history(4)] == ["первое", "второе"]
+
+def test_memory_history_expires_and_is_bounded(history_manager):
+    history_manager.get_history(5)
+    for i in range(7):
+        history_manager.add_message(5, f"m{i}", is_bot=False, user_info={})
+    ring = history_manager._rings[5]
+    assert len(ring) == 5
+    ring[0].ts -= history_manager._timeout_ms + 1
+    assert [r["message"] for r in history_manager.get_history(5)] == ["m3", "m4", "m5", "m6"]
+
+def test_clear_all_history_drops_memory(history_manager):
+    history_manager.add_message(6, "m", is_bot=False, user_info={})
+    assert history_manager.get_history(6)
+    history_manager.clear_all_history()
+    assert history_manager.get_history(6) == []
+
+def test_user_info_stored_once_per_user(history_manager):
+    for i in range(3):
+        history_manager.add_message(7, f"m{i}", is_bot=False, user_info={"language_code": "ru"})
+    history_manager.add_message(7, "m3", is_bot=False, user_info={"language_code": "en"})
+    history_manager.flush()
+    with sqlite3.connect(history_manager.db_path) as conn:
+        assert conn.execute("SELECT user_info FROM users WHERE user_id = 7").fetchall() == [('{"language_code": "en"}',)]
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    assert {r["user_info"]["language_code"] for r in history_manager.get_all_users_history()} == {"en"}
+    assert len(history_manager.get_all_users_history(language="en")) == 4
+
+def test_search_matches_message_text(history_manager):
+    history_manager.add_message(8, "Покажи температуру датчика T01", is_bot=False, user_info={})
+    history_manager.add_message(8, "График построен", is_bot=True, user_info={})
+    history_manager.flush()
+    assert [r["message"] for r in history_manager.get_all_users_history(search="температур")] == \
+        ["Покажи температуру датчика T01"]
+    assert len(history_manager.get_all_users_history(search="8")) == 2
+    assert [r["message"] for r in history_manager.get_all_users_history(message_type="bot")] == ["График построен"]
+
+def test_migrates_v1_schema(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "legacy.db")
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(
+            "CREATE TABLE user_history (user_id INTEGER, timestamp TEXT, message TEXT, is_bot INTEGER,"
+            " user_info TEXT, PRIMARY KEY (user_id, timestamp))"
+        )
+        conn.executemany("INSERT INTO user_history VALUES (?, ?, ?, ?, ?)", [
+            (1, "2030-01-01T10:00:00.500000", "старое", 0, '{"language_code": "ru"}'),
+            (1, "2030-01-01T10:00:01", "ответ", 1, "{}"),
+        ])
+    # Без очистки неактивных при запуске, чтобы увидеть перенесённые строки
+    monkeypatch.setattr(HistoryManager, "clean_old_histories", lambda self, inactivity_hours: None)
+    monkeypatch.setattr(hm_mod, "_now_ms", lambda: 1893492000000)  # 2030-01-01T10:00:00
+    hm = HistoryManager(db_path, timeout_hours=24, max_history_size=5)
+    try:
+        history = hm.get_history(1)
+        assert [(r["timestamp"], r["message"], r["is_bot"]) for r in history] == [
+            ("2030-01-01T10:00:00.500000", "старое", False),
+            ("2030-01-01T10:00:01", "ответ", True),
+        ]
+        assert history[0]["user_info"] == {"language_code": "ru"}
+        assert [r["message"] for r in hm.get_all_users_history(search="старое")] == ["старое"]
+    finally:
+        hm.close()
+    with sqlite3.connect(db_path) as conn:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        assert "user_history_v1" not in tables
+
+def test_history_survives_restart(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "history.db")
+    hm = HistoryManager(db_path, timeout_hours=24, max_history_size=5)
+    hm.add_message(1, "до перезапуска", is_bot=False, user_info={})
+    hm.close()
+    hm = HistoryManager(db_path, timeout_hours=24, max_history_size=5)
+    try:
+        assert [r["message"] for r in hm.get_history(1)] == ["до перезапуска"]
+    finally:
+        hm.close()
+    monkeypatch.setitem(hm_mod.CONFIG, "clear_history_on_start", True)
+    hm = HistoryManager(db_path, timeout_hours=24, max_history_size=5)
+    try:
+        assert hm.get_history(1) == []
+    finally:
+        hm.close()
+
+def test_reads_do_not_write(history_manager, monkeypatch):
+    history_manager.set_cache("expired", 1, ttl_seconds=-5)
+    history_manager.add_message(9, "m", is_bot=False, user_info={})
+    history_manager.flush()
+
+    def fail(*args, **kwargs):
+        raise AssertionError("чтение выполнило запись")
+    monkeypatch.setattr(history_manager, "_submit_write", fail)
+    assert history_manager.get_cache("expired") is None
+    assert [r["message"] for r in history_manager.get_history(9)] == ["m"]
+    assert len(history_manager.get_all_users_history()) == 1
+
+def test_sweep_deletes_expired_in_chunks(history_manager, monkeypatch):
+    monkeypatch.setitem(hm_mod.CONFIG, "sweep_chunk_rows", 3)
+    stale = hm_mod._now_ms() - history_manager._timeout_ms - 1000
+    history_manager._write(lambda conn: conn.executemany(
+        "INSERT INTO user_history (user_id, ts, message, is_bot) VALUES (?, ?, ?, 0)",
+        [(10, stale + i, f"old {i}") for i in range(7)]
+    ))
+    history_manager.add_message(10, "new", is_bot=False, user_info={})
+    history_manager.set_cache("expired", 1, ttl_seconds=-5)
+    history_manager.set_cache("alive", 1, ttl_seconds=60)
+    history_manager.flush()
+
+    calls = []
+    write = history_manager._write
+    monkeypatch.setattr(history_manager, "_write", lambda func: calls.append(func) or write(func))
+    result = history_manager.sweep()
+    assert result["history_rows"] == 7
+    assert result["cache_rows"] == 1
+    assert len(calls) >= 4  # История удалялась несколькими транзакциями
+    with sqlite3.connect(history_manager.db_path) as conn:
+        assert conn.execute("SELECT message FROM user_history").fetchall() == [("new",)]
+        assert conn.execute("SELECT key FROM cache").fetchall() == [("alive",)]
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    stats = history_manager.get_sweep_stats()
+    assert stats["runs"] == 1 and stats["history_rows"] == 7 and stats["errors"] == 0
+
+def test_close_stops_sweeper(tmp_path):
+    hm = HistoryManager(str(tmp_path / "sweep.db"), timeout_hours=24, max_history_size=5, sweep_interval=0.01)
+    time.sleep(0.05)
+    hm.close()
+    assert not hm._sweeper.is_alive()
+    assert hm.get_sweep_stats()["runs"] >= 1
+
+def test_cache_served_from_memory(history_manager, monkeypatch):
+    sensors = {"T01": {"index": 1}, "T02": {"index": 2}}
+    history_manager.set_cache("sensor_info", sensors, ttl_seconds=60)
+    monkeypatch.setattr(history_manager, "_read", lambda func: pytest.fail("get_cache обратился к SQLite"))
+    assert history_manager.get_cache("sensor_info") is sensors
+    assert history_manager.get_cache_stats()["memory_hits"] == 1
+
+def test_cache_memory_miss_falls_back_to_db(history_manager):
+    history_manager.set_cache("k", {"a": 1}, ttl_seconds=60)
+    history_manager._memory_cache.clear()
+    assert history_manager.get_cache("k") == {"a": 1}
+    assert history_manager.get_cache("k") == {"a": 1}
+    assert history_manager.get_cache("missing") is None
+    stats = history_manager.get_cache_stats()
+    assert (stats["db_hits"], stats["memory_hits"], stats["misses"]) == (1, 1, 1)
+
+def test_cache_memory_respects_ttl_and_size(history_manager, monkeypatch):
+    monkeypatch.setitem(hm_mod.CONFIG, "memory_cache_size", 2)
+    history_manager.set_cache("expired", 1, ttl_seconds=-5)
+    assert history_manager.get_cache("expired") is None
+    for key in ("a", "b", "c"):
+        history_manager.set_cache(key, key)
+    assert list(history_manager._memory_cache) == ["b", "c"]
+    assert history_manager.get_cache("a") == "a"  # Вытесненный ключ читается из SQLite
+
+def test_cache_invalidation_hooks(history_manager):
+    seen = []
+    history_manager.add_cache_invalidation_hook(seen.append)
+    history_manager.set_cache("sensor_info", {"T01": {}})
+    history_manager.clear_cache("sensor_info")
+    assert history_manager.get_cache("sensor_info") is None
+    history_manager.clear_all_cache()
+    assert seen == ["sensor_info", None]
+
+def test_cache_stored_in_binary_codec(history_manager):
+    history_manager.set_cache("k", {"a": [1, 2]})
+    with sqlite3.connect(history_manager.db_path) as conn:
+        assert isinstance(conn.execute("SELECT value FROM cache WHERE key = 'k'").fetchone()[0], bytes)
+        conn.execute("INSERT INTO cache(key, value, expire_at) VALUES ('legacy', '{\"b\": 1}', NULL)")
+        conn.execute("INSERT INTO cache(key, value, expire_at) VALUES ('broken', X'00', NULL)")
+    history_manager._memory_cache.clear()
+    assert history_manager.get_cache("k") == {"a": [1, 2]}
+    assert history_manager.get_cache("legacy") == {"b": 1}
+    assert history_manager.get_cache("broken") is None
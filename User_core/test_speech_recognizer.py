@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import math
+import time
+from array import array
+
+from aiohttp import web
+
+import User_core.speech_recognizer as speech_recognizer
+from User_core.speech_recognizer import SpeechRecognizer, iterate_in_thread
+from Utils.audio_segmenter import split_on_silence
+from Utils.transcription_cache import TranscriptionCache, file_key
+
+RATE = 16000
+logger = logging.getLogger(__name__)
+
+
+def tone(seconds: float, amplitude: int) -> bytes:
+    n = int(RATE * seconds)
+    return array("h", (int(amplitude * math.sin(2 * math.pi * 440 * i / RATE)) for i in range(n))).tobytes()
+
+
+def silence(seconds: float) -> bytes:
+    return bytes(int(RATE * seconds) * 2)
+
+
+class StubSTT:
+    """Локальный сервер STT: отвечает «частьN» по амплитуде сегмента, ранние сегменты отвечают дольше."""
+
+    def __init__(self):
+        self.active = 0
+        self.max_active = 0
+        self.requests = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        assert request.headers["Authorization"] == "Bearer test-token"
+        body = await request.read()
+        self.requests += 1
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            part = round(max(abs(s) for s in array("h", body)) / 1000)
+            await asyncio.sleep((5 - part) * 0.05)
+            return web.json_response({"result": f"часть{part}"})
+        finally:
+            self.active -= 1
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/stt", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        return f"http://127.0.0.1:{port}/stt"
+
+
+def make_recognizer() -> SpeechRecognizer:
+    recognizer = SpeechRecognizer(logger, folder_id="test-folder", service_account_key={"id": "k"})
+    recognizer._iam_token = "test-token"
+    recognizer._token_expiry = time.time() + 3600
+    return recognizer
+
+
+def test_segments_recognised_in_parallel_and_stitched_in_order(monkeypatch):
+    monkeypatch.setitem(speech_recognizer.CONFIG, "max_parallel_segments", 2)
+    pcm = b"".join(tone(1.2, amplitude) + silence(0.5) for amplitude in (1000, 2000, 3000, 4000))
+
+    async def run():
+        stub = StubSTT()
+        monkeypatch.setitem(speech_recognizer.CONFIG, "stt_url", await stub.start())
+        recognizer = make_recognizer()
+        try:
+            segments = iterate_in_thread(split_on_silence, [pcm[i:i + 32000] for i in range(0, len(pcm), 32000)])
+            text = await recognizer.recognize_segments(segments)
+        finally:
+            await recognizer.close()
+            await stub.runner.cleanup()
+        return text, stub
+
+    text, stub = asyncio.run(run())
+    assert text == "часть1 часть2 часть3 часть4"
+    assert stub.requests == 4
+    assert stub.max_active == 2
+
+
+def test_session_reused_between_requests(monkeypatch):
+    async def run():
+        stub = StubSTT()
+        monkeypatch.setitem(speech_recognizer.CONFIG, "stt_url", await stub.start())
+        recognizer = make_recognizer()
+        try:
+            await recognizer.recognize_speech(tone(1, 1000))
+            session = recognizer._session
+            await recognizer.recognize_speech(tone(1, 2000))
+            return session is recognizer._session
+        finally:
+            await recognizer.close()
+            await stub.runner.cleanup()
+
+    assert asyncio.run(run())
+
+
+def test_cached_segments_skip_stt(monkeypatch, tmp_path):
+    pcm = tone(1.2, 1000) + silence(0.5) + tone(1.2, 2000)
+
+    async def run():
+        stub = StubSTT()
+        monkeypatch.setitem(speech_recognizer.CONFIG, "stt_url", await stub.start())
+        recognizer = make_recognizer()
+        recognizer.cache = TranscriptionCache(str(tmp_path / "cache.db"))
+        try:
+            texts = []
+            for _ in range(2):
+                segments = iterate_in_thread(split_on_silence, [pcm])
+                texts.append(await recognizer.recognize_segments(segments))
+        finally:
+            await recognizer.close()
+            await stub.runner.cleanup()
+        return texts, stub
+
+    texts, stub = asyncio.run(run())
+    assert texts == ["часть1 часть2", "часть1 часть2"]
+    assert stub.requests == 2
+
+
+def test_cached_transcription_by_file_id(tmp_path):
+    recognizer = make_recognizer()
+    assert asyncio.run(recognizer.cached_transcription("AgAD")) is None
+    recognizer.cache = TranscriptionCache(str(tmp_path / "cache.db"))
+    recognizer.cache.set(file_key("AgAD"), "график T01")
+    assert asyncio.run(recognizer.cached_transcription("AgAD")) == "график T01"
+
+
+def test_stt_errors_are_not_reported_as_decoding(monkeypatch):
+    async def failing_stt(request):
+        return web.Response(status=500)
+
+    async def run():
+        app = web.Application()
+        app.router.add_post("/stt", failing_stt)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        monkeypatch.setitem(speech_recognizer.CONFIG, "stt_url", f"http://127.0.0.1:{runner.addresses[0][1]}/stt")
+        monkeypatch.setattr(speech_recognizer, "decode_voice_segments", lambda ogg: iter([tone(1.0, 1000)]))
+        recognizer = make_recognizer()
+        try:
+            await recognizer.recognize_voice(b"ogg")
+        except ValueError as e:
+            return str(e)
+        finally:
+            await recognizer.close()
+            await runner.cleanup()
+
+    message = asyncio.run(run())
+    assert message.startswith("Ошибка при распознавании речи")
+
+
+def test_decoder_errors_are_wrapped(monkeypatch):
+    def broken_decoder(ogg):
+        raise RuntimeError("битый контейнер")
+        yield
+
+    monkeypatch.setattr(speech_recognizer, "decode_voice_segments", broken_decoder)
+
+    async def run():
+        recognizer = make_recognizer()
+        try:
+            await recognizer.recognize_voice(b"ogg")
+        except ValueError as e:
+            return str(e)
+        finally:
+            await recognizer.close()
+
+    assert asyncio.run(run()) == "Ошибка при декодировании голосового сообщения: битый контейнер"
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import math
+import sys
+from array import array
+from typing import Iterable, Iterator, List
+
+CONFIG = {
+    "sample_rate": 16000,       # PCM 16 бит моно
+    "frame_ms": 30,             # Окно оценки громкости
+    "silence_rms": 300,         # Окна тише этого уровня считаются паузой
+    "min_silence_ms": 300,      # Пауза, по которой можно резать
+    "min_segment_ms": 1000,     # Короче не режем: у коротких кусков хуже распознавание
+    "max_segment_ms": 20000,    # Предел STT — 30 с; дольше режем по самому тихому окну
+}
+
+
+def frame_rms(pcm: bytes) -> float:
+    """Среднеквадратичная амплитуда куска PCM 16 бит."""
+    samples = array("h")
+    samples.frombytes(pcm[:len(pcm) - len(pcm) % 2])
+    if sys.byteorder == "big":
+        samples.byteswap()
+    if not samples:
+        return 0.0
+    return math.sqrt(sum(s * s for s in samples) / len(samples))
+
+
+class SilenceSplitter:
+    """Режет поток PCM на сегменты по паузам по мере поступления данных.
+
+    Сегмент отдаётся, как только после него набралась пауза min_silence_ms (разрез посередине паузы),
+    либо при достижении max_segment_ms — по самому тихому окну. Сегменты из одной тишины отбрасываются.
+    """
+
+    def __init__(self, sample_rate: int = CONFIG["sample_rate"], frame_ms: int = CONFIG["frame_ms"],
+                 silence_rms: float = CONFIG["silence_rms"], min_silence_ms: int = CONFIG["min_silence_ms"],
+                 min_segment_ms: int = CONFIG["min_segment_ms"], max_segment_ms: int = CONFIG["max_segment_ms"]):
+        self.frame_bytes = sample_rate * frame_ms // 1000 * 2
+        self.silence_rms = silence_rms
+        self.min_silence_frames = max(1, min_silence_ms // frame_ms)
+        self.min_segment_frames = max(1, min_segment_ms // frame_ms)
+        self.max_segment_frames = max(self.min_segment_frames + 1, max_segment_ms // frame_ms)
+        self._buffer = bytearray()
+        self._rms: List[float] = []  # Громкость полных окон буфера
+        self._silent_run = 0
+
+    def feed(self, pcm: bytes) -> List[bytes]:
+        """Добавляет PCM и возвращает сегменты, которые уже можно распознавать."""
+        self._buffer += pcm
+        segments = []
+        while (len(self._rms) + 1) * self.frame_bytes <= len(self._buffer):
+            start = len(self._rms) * self.frame_bytes
+            rms = frame_rms(self._buffer[start:start + self.frame_bytes])
+            self._rms.append(rms)
+            self._silent_run = self._silent_run + 1 if rms < self.silence_rms else 0
+            frames = len(self._rms)
+            if self._silent_run >= self.min_silence_frames and frames - self._silent_run // 2 >= self.min_segment_frames:
+                self._cut(frames - self._silent_run // 2, segments)
+            elif frames >= self.max_segment_frames:
+                # Самое тихое окно после min_segment; при равенстве — самое позднее, чтобы сегменты были длиннее
+                tail = self._rms[self.min_segment_frames:]
+                quietest = min(range(len(tail)), key=lambda i: (tail[i], -i))
+                self._cut(self.min_segment_frames + quietest, segments)
+        return segments
+
+    def flush(self) -> List[bytes]:
+        """Возвращает остаток потока после его окончания."""
+        segments = []
+        if self._buffer:
+            partial = self._buffer[len(self._rms) * self.frame_bytes:]
+            if self._voiced(self._rms) or (partial and frame_rms(partial) >= self.silence_rms):
+                segments.append(bytes(self._buffer))
+        self._buffer = bytearray()
+        self._rms = []
+        self._silent_run = 0
+        return segments
+
+    def _cut(self, frames: int, segments: List[bytes]) -> None:
+        size = frames * self.frame_bytes
+        if self._voiced(self._rms[:frames]):
+            segments.append(bytes(self._buffer[:size]))
+        del self._buffer[:size]
+        del self._rms[:frames]
+        self._silent_run = 0
+
+    def _voiced(self, rms: List[float]) -> bool:
+        return any(value >= self.silence_rms for value in rms)
+
+
+def split_on_silence(chunks: Iterable[bytes], **options) -> Iterator[bytes]:
+    """Сегменты потока кусков PCM в исходном порядке; options — параметры SilenceSplitter."""
+    splitter = SilenceSplitter(**options)
+    for chunk in chunks:
+        yield from splitter.feed(chunk)
+    yield from splitter.flush()
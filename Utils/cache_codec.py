@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import json
+import pickle
+import struct
+import zlib
+from typing import Any, Callable, Dict, Tuple
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CONFIG = {
+    "codec": "pickle",              # pickle | msgpack | json
+    "compression": "zlib",          # zlib | zstd | none
+    "compress_threshold": 4096,     # Байт; значения меньше пишутся без сжатия
+    "compress_level": 6,
+}
+
+FORMAT_VERSION = 1  # Меняется при несовместимом изменении формата; старые записи считаются промахом
+
+_MAGIC = b"HC"
+_HEADER = struct.Struct("!2sBBB")  # magic, версия формата, кодек, сжатие
+
+
+class CodecError(Exception):
+    """Значение кеша не удалось закодировать или прочитать (чужой формат, другая версия, повреждение)."""
+
+
+def _msgpack_dumps(value: Any) -> bytes:
+    return msgpack.packb(value, use_bin_type=True, strict_types=False)
+
+
+def _msgpack_loads(data: bytes) -> Any:
+    # strict_map_key=False: ключи словарей могут быть числами (индексы датчиков)
+    return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+_CODECS: Dict[int, Tuple[str, Callable[[Any], bytes], Callable[[bytes], Any]]] = {
+    1: ("pickle", lambda value: pickle.dumps(value, protocol=5), pickle.loads),
+    2: ("json", lambda value: json.dumps(value, ensure_ascii=False).encode("utf-8"), json.loads),
+    3: ("msgpack", _msgpack_dumps, _msgpack_loads),
+}
+_COMPRESSIONS = {"none": 0, "zlib": 1, "zstd": 2}
+
+
+class CacheCodec:
+    """Кодирует значения кеша в компактный бинарный вид с заголовком (версия формата, кодек, сжатие).
+
+    Значения больше compress_threshold сжимаются. Читаются записи любого известного кодека, так что
+    смена настроек не делает старые записи нечитаемыми; текст JSON из прежних версий тоже понимается.
+    """
+
+    def __init__(self, codec: str = CONFIG["codec"], compression: str = CONFIG["compression"],
+                 compress_threshold: int = CONFIG["compress_threshold"],
+                 compress_level: int = CONFIG["compress_level"]):
+        codec_ids = {name: codec_id for codec_id, (name, _, _) in _CODECS.items()}
+        if codec not in codec_ids:
+            raise ValueError(f"Неизвестный кодек кеша: {codec}")
+        if codec == "msgpack" and msgpack is None:
+            raise ValueError("Кодек msgpack требует пакет msgpack")
+        if compression not in _COMPRESSIONS:
+            raise ValueError(f"Неизвестный тип сжатия: {compression}")
+        if compression == "zstd" and zstandard is None:
+            raise ValueError("Сжатие zstd требует пакет zstandard")
+        self.codec = codec
+        self.compression = compression
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+        self._codec_id = codec_ids[codec]
+
+    def encode(self, value: Any) -> bytes:
+        try:
+            payload = _CODECS[self._codec_id][1](value)
+        except Exception as e:
+            raise CodecError(f"Не удалось закодировать значение ({self.codec}): {e}") from e
+        compression = "none"
+        if self.compression != "none" and len(payload) >= self.compress_threshold:
+            compression = self.compression
+            if compression == "zlib":
+                payload = zlib.compress(payload, self.compress_level)
+            else:
+                payload = zstandard.ZstdCompressor(level=self.compress_level).compress(payload)
+        return _HEADER.pack(_MAGIC, FORMAT_VERSION, self._codec_id, _COMPRESSIONS[compression]) + payload
+
+    def decode(self, data: Any) -> Any:
+        if isinstance(data, str):
+            # Записи, сохранённые до появления бинарного формата
+            try:
+                return json.loads(data)
+            except json.JSONDecodeError as e:
+                raise CodecError(f"Повреждённая JSON-запись кеша: {e}") from e
+        data = bytes(data)
+        if len(data) < _HEADER.size:
+            raise CodecError("Запись кеша короче заголовка")
+        magic, version, codec_id, compression_id = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            raise CodecError("Неизвестный формат записи кеша")
+        if version != FORMAT_VERSION:
+            raise CodecError(f"Версия формата кеша {version}, ожидается {FORMAT_VERSION}")
+        if codec_id not in _CODECS or (codec_id == 3 and msgpack is None):
+            raise CodecError(f"Кодек {codec_id} недоступен")
+        payload = data[_HEADER.size:]
+        try:
+            if compression_id == 1:
+                payload = zlib.decompress(payload)
+            elif compression_id == 2:
+                if zstandard is None:
+                    raise CodecError("Запись сжата zstd, но пакет zstandard не установлен")
+                payload = zstandard.ZstdDecompressor().decompress(payload)
+            elif compression_id != 0:
+                raise CodecError(f"Неизвестный тип сжатия: {compression_id}")
+            return _CODECS[codec_id][2](payload)
+        except CodecError:
+            raise
+        except Exception as e:
+            raise CodecError(f"Не удалось декодировать запись кеша: {e}") from e
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+CONFIG = {
+    "max_concurrent": 16,   # Одновременно обрабатываемых обновлений во всём боте
+    "wait_window": 500,     # Сколько последних замеров ожидания хранить для перцентилей
+}
+
+
+class ChatOrderedExecutor:
+    """Выполняет корутины параллельно, но по порядку внутри одного чата.
+
+    Обновления одного чата ждут предыдущие (порядок поступления сохраняется), разные чаты
+    выполняются одновременно в пределах max_concurrent. Время от поступления до начала
+    обработки учитывается в статистике ожидания.
+    """
+
+    def __init__(self, max_concurrent: int = CONFIG["max_concurrent"], logger: logging.Logger = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_concurrent = max_concurrent
+        self.logger = logger or logging.getLogger(__name__)
+        self._clock = clock
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._chat_locks: Dict[Hashable, asyncio.Lock] = {}
+        self._chat_waiters: Dict[Hashable, int] = {}
+        self._waits = deque(maxlen=CONFIG["wait_window"])
+        self._stats = {"processed": 0, "failed": 0, "in_flight": 0, "waiting": 0, "max_wait": 0.0, "total_wait": 0.0}
+
+    async def run(self, chat_key: Optional[Hashable], coroutine: Awaitable[Any]) -> Any:
+        """Выполняет coroutine после предыдущих обновлений чата chat_key (None — без упорядочивания)."""
+        arrived = self._clock()
+        started = False
+        self._stats["waiting"] += 1
+        lock = None
+        if chat_key is not None:
+            lock = self._chat_locks.get(chat_key)
+            if lock is None:
+                lock = self._chat_locks[chat_key] = asyncio.Lock()
+            self._chat_waiters[chat_key] = self._chat_waiters.get(chat_key, 0) + 1
+        try:
+            if lock is not None:
+                await lock.acquire()
+            try:
+                async with self._semaphore:
+                    started = True
+                    self._started(chat_key, self._clock() - arrived)
+                    try:
+                        return await coroutine
+                    except Exception:
+                        self._stats["failed"] += 1
+                        raise
+                    finally:
+                        self._stats["in_flight"] -= 1
+                        self._stats["processed"] += 1
+            finally:
+                if lock is not None:
+                    lock.release()
+        finally:
+            if not started:
+                # Отменено, не дождавшись очереди: корутина так и не запускалась
+                self._stats["waiting"] -= 1
+                if asyncio.iscoroutine(coroutine):
+                    coroutine.close()
+            if chat_key is not None:
+                self._chat_waiters[chat_key] -= 1
+                if not self._chat_waiters[chat_key]:
+                    # Никто из чата больше не ждёт — блокировка не нужна
+                    del self._chat_waiters[chat_key]
+                    del self._chat_locks[chat_key]
+
+    def _started(self, chat_key: Optional[Hashable], waited: float) -> None:
+        self._stats["waiting"] -= 1
+        self._stats["in_flight"] += 1
+        self._stats["total_wait"] += waited
+        self._stats["max_wait"] = max(self._stats["max_wait"], waited)
+        self._waits.append(waited)
+        if waited >= 1.0:
+            self.logger.debug("Обновление чата %s ждало обработки %.2f с", chat_key, waited)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Счётчики обработки и ожидания (в секундах): среднее, p95 по окну последних замеров, максимум."""
+        waits = sorted(self._waits)
+        started = self._stats["processed"] + self._stats["in_flight"]
+        return dict(
+            self._stats,
+            max_concurrent=self.max_concurrent,
+            chats_waiting=len(self._chat_locks),
+            avg_wait=self._stats["total_wait"] / started if started else 0.0,
+            p95_wait=waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+        )
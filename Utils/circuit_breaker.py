@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+CONFIG = {
+    "failure_threshold": 3,     # Подряд неудачных вызовов до размыкания
+    "reset_timeout": 30,        # Секунд в разомкнутом состоянии до пробного запроса
+    "latency_window": 50,       # Сколько последних задержек учитывать
+    "min_samples": 5,           # До этого числа замеров используется max_timeout
+    "timeout_percentile": 0.95,
+    "timeout_multiplier": 2.0,
+    "min_timeout": 3.0,
+}
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Вызов отклонён: бэкенд признан недоступным."""
+
+
+class CircuitBreaker:
+    """Предохранитель для одного бэкенда LLM: размыкается после серии ошибок, пропускает пробный
+    запрос после reset_timeout и подбирает таймаут по перцентилю наблюдаемых задержек."""
+
+    def __init__(self, name: str, max_timeout: float, failure_threshold: int = CONFIG["failure_threshold"],
+                 reset_timeout: float = CONFIG["reset_timeout"], min_timeout: float = CONFIG["min_timeout"],
+                 logger: logging.Logger = None, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.max_timeout = max_timeout
+        self.min_timeout = min(min_timeout, max_timeout)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.logger = logger or logging.getLogger(__name__)
+        self._clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._latencies = deque(maxlen=CONFIG["latency_window"])
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == OPEN and self._clock() - self._opened_at < self.reset_timeout
+
+    def allow(self) -> bool:
+        """Можно ли выполнять вызов сейчас; в полуоткрытом состоянии пропускает один пробный запрос."""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if self._clock() - self._opened_at < self.reset_timeout:
+                return False
+            self.state = HALF_OPEN
+            self._probe_in_flight = False
+            self.logger.debug("Предохранитель %s: пробный запрос", self.name)
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def record_success(self, latency: float) -> None:
+        self._latencies.append(latency)
+        if self.state != CLOSED:
+            self.logger.debug("Предохранитель %s замкнут после успешного запроса", self.name)
+        self.state = CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.logger.error("Предохранитель %s разомкнут после %d ошибок", self.name, self.failures)
+            self.state = OPEN
+            self._opened_at = self._clock()
+
+    def timeout(self) -> float:
+        """Таймаут следующего вызова: перцентиль задержек с запасом, в пределах [min_timeout, max_timeout]."""
+        if len(self._latencies) < CONFIG["min_samples"]:
+            return self.max_timeout
+        ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * CONFIG["timeout_percentile"]))
+        estimate = ordered[index] * CONFIG["timeout_multiplier"]
+        return max(self.min_timeout, min(self.max_timeout, estimate))
+
+    async def call(self, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Выполняет func() под защитой предохранителя и с адаптивным таймаутом."""
+        if not self.allow():
+            raise CircuitOpenError(f"Бэкенд {self.name} временно недоступен")
+        # Пробный запрос получает полный таймаут: оценка по старым задержкам могла устареть вместе с бэкендом
+        timeout = self.max_timeout if self.state == HALF_OPEN else self.timeout()
+        started = self._clock()
+        try:
+            async with asyncio.timeout(timeout):
+                result = await func()
+        except asyncio.CancelledError:
+            # Отмена снаружи не говорит о состоянии бэкенда
+            self._probe_in_flight = False
+            raise
+        except TimeoutError:
+            # Цензурированный замер: задержка не меньше таймаута. Без него оценка по одним успешным
+            # вызовам не растёт, когда бэкенд замедлился, и все вызовы продолжают отваливаться
+            self._latencies.append(timeout)
+            self.record_failure()
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success(self._clock() - started)
+        return result
+
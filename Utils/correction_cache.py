@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+import hashlib
+import logging
+import time
+from contextlib import closing
+from threading import Lock
+from typing import Dict, Optional, Tuple
+import traceback
+
+CONFIG = {
+    "ttl_seconds": 7 * 24 * 3600,   # Успешные исправления
+    "negative_ttl_seconds": 120,    # Неудачные (None) — коротко, чтобы не долбить LLM повторами
+    "max_entries": 5000,
+    "access_batch": 100,            # Сколько попаданий копить перед записью last_access одним UPDATE
+}
+
+
+def make_key(*parts: str) -> str:
+    """Ключ кеша: SHA-256 от частей промпта."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class CorrectionCache:
+    """Персистентный кеш ответов ErrorCorrector в SQLite с TTL, вытеснением старых записей и негативным кешированием.
+
+    Чтение ничего не пишет: время последнего обращения копится в памяти и сохраняется пачкой
+    при записи в кеш или по накоплении access_batch попаданий. Методы синхронные — из асинхронного
+    кода их вызывают через asyncio.to_thread.
+    """
+
+    def __init__(self, db_path: str, ttl_seconds: int = CONFIG["ttl_seconds"],
+                 negative_ttl_seconds: int = CONFIG["negative_ttl_seconds"],
+                 max_entries: int = CONFIG["max_entries"], access_batch: int = CONFIG["access_batch"],
+                 logger: logging.Logger = None):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.max_entries = max_entries
+        self.access_batch = access_batch
+        self._lock = Lock()
+        self._pending_access: Dict[str, int] = {}
+        self.logger = logger or logging.getLogger(__name__)
+        try:
+            with closing(self._get_connection()) as conn:
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS correction_cache (
+                        key TEXT PRIMARY KEY,
+                        value TEXT,
+                        expire_at INTEGER,
+                        last_access INTEGER
+                    )
+                    """
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_correction_cache_access ON correction_cache(last_access)")
+                conn.execute("DELETE FROM correction_cache WHERE expire_at < ?", (int(time.time()),))
+                conn.commit()
+        except Exception as e:
+            self.logger.error("Ошибка инициализации CorrectionCache: %s", e)
+            self.logger.error("Трассировка стека: %s", traceback.format_exc())
+
+    def _get_connection(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, check_same_thread=False)
+
+    def _flush_access(self, conn: sqlite3.Connection) -> None:
+        """Записывает накопленные времена обращений; вызывается под self._lock, commit — у вызывающего."""
+        if self._pending_access:
+            conn.executemany("UPDATE correction_cache SET last_access = ? WHERE key = ?",
+                             [(ts, key) for key, ts in self._pending_access.items()])
+            self._pending_access.clear()
+
+    def get(self, key: str) -> Tuple[bool, Optional[str]]:
+        """Возвращает (найдено, значение); значение None при найденной записи — закешированная неудача."""
+        now = int(time.time())
+        try:
+            with self._lock, closing(self._get_connection()) as conn:
+                row = conn.execute("SELECT value, expire_at FROM correction_cache WHERE key = ?", (key,)).fetchone()
+                # Истёкшие записи не удаляем здесь: их вычищают set() и конструктор
+                if not row or row[1] < now:
+                    return False, None
+                self._pending_access[key] = now
+                if len(self._pending_access) >= self.access_batch:
+                    self._flush_access(conn)
+                    conn.commit()
+                return True, row[0]
+        except Exception as e:
+            self.logger.error("Ошибка чтения кеша коррекций: %s", e)
+            self.logger.error("Трассировка стека: %s", traceback.format_exc())
+            return False, None
+
+    def set(self, key: str, value: Optional[str]) -> None:
+        """Сохраняет ответ; None сохраняется с коротким negative_ttl_seconds."""
+        now = int(time.time())
+        ttl = self.ttl_seconds if value is not None else self.negative_ttl_seconds
+        try:
+            with self._lock, closing(self._get_connection()) as conn:
+                self._flush_access(conn)
+                conn.execute(
+                    """
+                    INSERT INTO correction_cache(key, value, expire_at, last_access)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(key) DO UPDATE SET value=excluded.value, expire_at=excluded.expire_at, last_access=excluded.last_access;
+                    """,
+                    (key, value, now + ttl, now)
+                )
+                count = conn.execute("SELECT COUNT(*) FROM correction_cache").fetchone()[0]
+                if count > self.max_entries:
+                    # Вытесняем истёкшие и давно не использованные записи
+                    conn.execute("DELETE FROM correction_cache WHERE expire_at < ?", (now,))
+                    conn.execute(
+                        """
+                        DELETE FROM correction_cache WHERE key IN (
+                            SELECT key FROM correction_cache ORDER BY last_access ASC, expire_at ASC, rowid ASC LIMIT
+                            max(0, (SELECT COUNT(*) FROM correction_cache) - ?)
+                        )
+                        """,
+                        (self.max_entries,)
+                    )
+                conn.commit()
+            self.logger.debug("Кеш коррекций обновлён: key=%s, ttl=%d", key[:12], ttl)
+        except Exception as e:
+            self.logger.error("Ошибка записи в кеш коррекций: %s", e)
+            self.logger.error("Трассировка стека: %s", traceback.format_exc())
+
+    def clear(self) -> None:
+        """Очищает кеш коррекций."""
+        try:
+            with self._lock, closing(self._get_connection()) as conn:
+                self._pending_access.clear()
+                conn.execute("DELETE FROM correction_cache")
+                conn.commit()
+        except Exception as e:
+            self.logger.error("Ошибка очистки кеша коррекций: %s", e)
+            self.logger.error("Трассировка стека: %s", traceback.format_exc())
@@ -5,6 +5,9 @@ import g4f
 from typing import Any, Optional, Dict
 import traceback
 
+from Utils.correction_cache import CorrectionCache, make_key
+from Utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+
 CONFIG = {
     "logging": {
         "level_debug": logging.DEBUG,
@@ -29,7 +32,9 @@ CONFIG = {
         "uncorrectable_input": "Не удалось исправить входные данные",
         "llm_attempt": "Попытка коррекции для пользователя [ID: {user_id}]",
         "llm_response": "Ответ от LLM",
-        "retry_attempt": "Повторная попытка {attempt}/{max} из-за ошибки: {error}"
+        "retry_attempt": "Повторная попытка {attempt}/{max} из-за ошибки: {error}",
+        "cache_hit": "Ответ взят из кеша коррекций",
+        "circuit_open": "LLM временно недоступна, коррекция пропущена"
     }
 }
 
@@ -45,7 +50,7 @@ def setup_logging(debug_mode: bool, logger: logging.Logger) -> None:
     logger.debug("Логирование настроено для ErrorCorrector с уровнем %s", "DEBUG" if debug_mode else "CRITICAL")
 
 class ErrorCorrector:
-    def __init__(self, debug_mode: bool = False, logger: logging.Logger = None):
+    def __init__(self, debug_mode: bool = False, logger: logging.Logger = None, cache: Optional[CorrectionCache] = None):
         self.debug_mode = debug_mode
         self.logger = logger or logging.getLogger(__name__)
         self.llm_timeout = CONFIG["llm"]["timeout"]
@@ -53,6 +58,8 @@ class ErrorCorrector:
         self.verify = CONFIG["llm"]["verify"]
         self.max_retries = CONFIG["retry"]["max_retries"]
         self.retry_interval = CONFIG["retry"]["retry_interval"]
+        self.cache = cache
+        self.breaker = CircuitBreaker(self.model, max_timeout=self.llm_timeout, logger=self.logger)
         setup_logging(debug_mode, self.logger)
         self.logger.debug("ErrorCorrector инициализирован")
 
@@ -60,21 +67,23 @@ class ErrorCorrector:
         self.logger.debug("Запрос к LLM: %s", prompt)
         for attempt in range(self.max_retries):
             try:
-                async with asyncio.timeout(self.llm_timeout):
-                    response = await asyncio.to_thread(
-                        g4f.ChatCompletion.create,
-                        model=self.model,
-                        messages=[{"role": "user", "content": prompt}],
-                        verify=self.verify,
-                    )
-                    self.logger.debug(CONFIG["error_messages"]["llm_response"] + ": %s", response)
-                    return response
+                response = await self.breaker.call(lambda: asyncio.to_thread(
+                    g4f.ChatCompletion.create,
+                    model=self.model,
+                    messages=[{"role": "user", "content": prompt}],
+                    verify=self.verify,
+                ))
+                self.logger.debug(CONFIG["error_messages"]["llm_response"] + ": %s", response)
+                return response
+            except CircuitOpenError:
+                self.logger.error(CONFIG["error_messages"]["circuit_open"])
+                return None
             except Exception as e:
                 error_msg = str(e)
                 trace = traceback.format_exc()
                 self.logger.error(CONFIG["error_messages"]["retry_attempt"].format(attempt=attempt + 1, max=self.max_retries, error=error_msg))
                 self.logger.error("Трассировка стека: %s", trace)
-                if attempt < self.max_retries - 1:
+                if attempt < self.max_retries - 1 and not self.breaker.is_open:
                     await asyncio.sleep(self.retry_interval)
                 else:
                     self.logger.critical("%s: Ошибка %s", CONFIG["error_messages"]["uncorrectable_input"], error_msg)
@@ -90,13 +99,25 @@ class ErrorCorrector:
 
         try:
             prompt = CONFIG["prompt"]["base"].format(input_data=input_data, prompt_addition=prompt_addition)
+            cache_key = make_key(self.model, prompt) if self.cache else None
+            if cache_key:
+                found, cached = await asyncio.to_thread(self.cache.get, cache_key)
+                if found:
+                    self.logger.debug(CONFIG["error_messages"]["cache_hit"] + ": %s", cached)
+                    return cached
+
             corrected = await self._llm_request(prompt)
 
             if corrected is None or "None" in corrected.strip():
                 self.logger.error(CONFIG["error_messages"]["uncorrectable_input"])
+                # Отказ из-за недоступности бэкенда не говорит о самом входе — не кешируем
+                if cache_key and not self.breaker.is_open:
+                    await asyncio.to_thread(self.cache.set, cache_key, None)
                 return None
 
             result = corrected.strip()
+            if cache_key:
+                await asyncio.to_thread(self.cache.set, cache_key, result)
             self.logger.debug("Исправленный результат: %s", result)
             return result
         except Exception as e:
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import re
+import logging
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from Utils.sensor_index import SensorIndex
+
+CONFIG = {
+    "chars_per_token": 3.0,      # Грубая оценка для смеси кириллицы, латиницы и JSON
+    "max_prompt_chars": 12000,   # Порог предупреждения о слишком большом промпте
+    "shortlist_size": 8,         # Сколько датчиков-кандидатов отправлять в LLM
+    "shortlist_min_score": 0.25,
+    "fallback_max_chars": 1500,  # Бюджет на список датчиков, если локальный поиск ничего не нашёл
+}
+
+_WORDS = re.compile(r"[\w()\-]+", re.UNICODE)
+
+
+def estimate_tokens(text: str) -> int:
+    """Оценка числа токенов по длине строки."""
+    return int(len(text) / CONFIG["chars_per_token"]) + 1 if text else 0
+
+
+class PromptBudget:
+    """Сборка промптов с учётом размера: короткий список датчиков, кеш статических частей, статистика."""
+
+    def __init__(self, logger: logging.Logger = None, shortlist_size: int = CONFIG["shortlist_size"]):
+        self.logger = logger or logging.getLogger(__name__)
+        self.shortlist_size = shortlist_size
+        self.stats: Dict[str, Dict[str, int]] = defaultdict(lambda: {"calls": 0, "chars": 0, "tokens": 0, "max_chars": 0})
+        self._static: Dict[Any, str] = {}
+        self._index: Optional[SensorIndex] = None
+        self._index_names: tuple = ()
+
+    def _get_index(self, sensors: Sequence[str]) -> SensorIndex:
+        names = tuple(sensors)
+        if self._index is None or names != self._index_names:
+            self._index = SensorIndex(names, logger=self.logger)
+            self._index_names = names
+        return self._index
+
+    def static(self, key: Any, factory: Callable[[], str]) -> str:
+        """Возвращает закешированную статическую часть промпта (список действий, описание функций и т.п.)."""
+        value = self._static.get(key)
+        if value is None:
+            value = factory()
+            self._static[key] = value
+        return value
+
+    def shortlist(self, query: str, sensors: Sequence[str], k: Optional[int] = None) -> List[str]:
+        """Top-k датчиков, похожих на запрос (целиком и по отдельным словам).
+
+        Если локальный поиск ничего не дал, возвращает начало полного списка в пределах fallback_max_chars.
+        """
+        k = k or self.shortlist_size
+        if not sensors:
+            return []
+        index = self._get_index(sensors)
+        scores: Dict[str, float] = {}
+        for part in [query, *_WORDS.findall(query or "")]:
+            for name, score in index.lookup(part, limit=k, min_score=CONFIG["shortlist_min_score"]):
+                if score > scores.get(name, 0.0):
+                    scores[name] = score
+        if scores:
+            ranked = sorted(scores, key=lambda name: (-scores[name], index.rank(name)))
+            return ranked[:k]
+
+        fallback, used = [], 0
+        for name in sensors:
+            used += len(name) + 2
+            if used > CONFIG["fallback_max_chars"]:
+                break
+            fallback.append(name)
+        self.logger.debug("Кандидаты для '%s' не найдены, в промпт уходит %d из %d датчиков", query, len(fallback), len(sensors))
+        return fallback
+
+    def measure(self, name: str, prompt: str) -> str:
+        """Учитывает размер промпта в статистике и возвращает его без изменений."""
+        chars = len(prompt)
+        tokens = estimate_tokens(prompt)
+        entry = self.stats[name]
+        entry["calls"] += 1
+        entry["chars"] += chars
+        entry["tokens"] += tokens
+        entry["max_chars"] = max(entry["max_chars"], chars)
+        if chars > CONFIG["max_prompt_chars"]:
+            self.logger.warning("Промпт '%s' превышает бюджет: %d символов (~%d токенов)", name, chars, tokens)
+        else:
+            self.logger.debug("Промпт '%s': %d символов (~%d токенов)", name, chars, tokens)
+        return prompt
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        return {name: dict(entry) for name, entry in self.stats.items()}
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+import re
+import logging
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+CONFIG = {
+    "limit": 5,
+    "min_score": 0.35,          # Порог для списков кандидатов и подсказок "возможно, вы имели в виду"
+    "resolve_min_score": 0.6,   # Порог автоматической подстановки имени (resolve)
+}
+
+# Кириллические буквы, визуально совпадающие с латинскими (Т/T, Р/P, С/C ...),
+# плюс 'п' -> 'p': операторы пишут 'п11' вместо 'P11'.
+HOMOGLYPHS = str.maketrans({
+    "а": "a", "в": "b", "е": "e", "ё": "e", "к": "k", "м": "m", "н": "h",
+    "о": "o", "р": "p", "с": "c", "т": "t", "у": "y", "х": "x", "п": "p",
+})
+
+_NON_ALNUM = re.compile(r"[^0-9a-zа-я]")
+_DIGITS = re.compile(r"\d+")
+_BRACKETS = re.compile(r"\(([^)]*)\)")
+
+
+def normalize_key(text: str) -> str:
+    """Приводит имя датчика к ключу поиска: 'т6' -> 't6', 'T06 (T32)' -> 't6t32'."""
+    if not text:
+        return ""
+    key = text.casefold().translate(HOMOGLYPHS)
+    key = _NON_ALNUM.sub("", key)
+    # Убираем ведущие нули, чтобы 'T6', 'T06' и 'T006' давали один ключ
+    return _DIGITS.sub(lambda m: str(int(m.group())), key)
+
+
+def split_aliases(name: str) -> List[str]:
+    """Возвращает имя и его алиасы из скобок: 'T08 (T34)' -> ['T08 (T34)', 'T08', 'T34']."""
+    aliases = [name]
+    outer = _BRACKETS.sub(" ", name).strip()
+    if outer and outer != name:
+        aliases.append(outer)
+    for inner in _BRACKETS.findall(name):
+        inner = inner.strip()
+        if inner:
+            aliases.append(inner)
+    return aliases
+
+
+def trigrams(key: str) -> set:
+    """Множество триграмм ключа с граничными маркерами."""
+    padded = f"^{key}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SensorIndex:
+    """Индекс имён датчиков: точные нормализованные ключи и инвертированный индекс триграмм.
+
+    Строится один раз из sensor_info (или списка имён) и отвечает на нечёткие запросы
+    без обхода всего списка датчиков.
+    """
+
+    def __init__(self, sensors: Union[Dict[str, Dict[str, Any]], Iterable[str]], logger: logging.Logger = None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.names: List[str] = list(sensors)
+        self._order: Dict[str, int] = {name: i for i, name in enumerate(self.names)}
+        self._exact: Dict[str, List[str]] = defaultdict(list)
+        self._name_keys: Dict[str, List[str]] = defaultdict(list)
+        self._key_ids: Dict[str, int] = {}
+        self._key_sensors: List[List[str]] = []
+        self._key_sizes: List[int] = []
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+
+        for name in self.names:
+            for alias in split_aliases(name):
+                key = normalize_key(alias)
+                if not key:
+                    continue
+                if name not in self._exact[key]:
+                    self._exact[key].append(name)
+                if key not in self._name_keys[name]:
+                    self._name_keys[name].append(key)
+                key_id = self._key_ids.get(key)
+                if key_id is None:
+                    key_id = len(self._key_sensors)
+                    self._key_ids[key] = key_id
+                    self._key_sensors.append([])
+                    grams = trigrams(key)
+                    self._key_sizes.append(len(grams))
+                    for gram in grams:
+                        self._postings[gram].append(key_id)
+                if name not in self._key_sensors[key_id]:
+                    self._key_sensors[key_id].append(name)
+
+        self.logger.debug("SensorIndex построен: датчиков=%d, ключей=%d, триграмм=%d",
+                          len(self.names), len(self._key_sensors), len(self._postings))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._order
+
+    def rank(self, name: str) -> int:
+        """Позиция датчика в исходном списке: порядок кандидатов с равной оценкой."""
+        return self._order[name]
+
+    def lookup(self, query: str, limit: int = CONFIG["limit"], min_score: float = CONFIG["min_score"]) -> List[Tuple[str, float]]:
+        """Возвращает до limit кандидатов [(имя, оценка)] по убыванию оценки (1.0 — точное совпадение)."""
+        key = normalize_key(query)
+        if not key:
+            return []
+
+        scores: Dict[str, float] = {}
+        for name in self._exact.get(key, ()):
+            scores[name] = 1.0
+
+        grams = trigrams(key)
+        overlap: Dict[int, int] = defaultdict(int)
+        for gram in grams:
+            for key_id in self._postings.get(gram, ()):
+                overlap[key_id] += 1
+
+        for key_id, common in overlap.items():
+            # Коэффициент Дайса по триграммам
+            score = 2.0 * common / (len(grams) + self._key_sizes[key_id])
+            if score < min_score:
+                continue
+            for name in self._key_sensors[key_id]:
+                if score > scores.get(name, 0.0):
+                    scores[name] = score
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], self.rank(item[0])))
+        return ranked[:limit]
+
+    def best(self, query: str, min_score: float = CONFIG["min_score"]) -> Optional[str]:
+        """Лучший нечёткий кандидат для запроса или None.
+
+        Годится только для подсказок: при низком пороге несуществующий T99 находит T09.
+        Для подстановки имени вместо пользовательского используйте resolve.
+        """
+        candidates = self.lookup(query, limit=1, min_score=min_score)
+        return candidates[0][0] if candidates else None
+
+    def exact(self, query: str) -> Optional[str]:
+        """Однозначное совпадение по нормализованному ключу или None."""
+        names = self._exact.get(normalize_key(query), ())
+        return names[0] if len(names) == 1 else None
+
+    def resolve(self, query: str, min_score: float = CONFIG["resolve_min_score"]) -> Optional[str]:
+        """Имя датчика, которое можно подставить вместо запроса без подтверждения, или None.
+
+        Принимается нормализованное точное совпадение ('т6' -> 'T06 (T32)') либо нечёткое
+        с высокой оценкой и теми же числами, что в одном из ключей датчика: 'T99' не станет 'T09'.
+        Ключ, общий для нескольких датчиков, неоднозначен — как и в exact, результат None.
+        """
+        key = normalize_key(query)
+        if not key:
+            return None
+        names = self._exact.get(key)
+        if names:
+            return names[0] if len(names) == 1 else None
+        numbers = _DIGITS.findall(key)
+        for name, _ in self.lookup(query, limit=CONFIG["limit"], min_score=min_score):
+            if any(_DIGITS.findall(alias) == numbers for alias in self._name_keys[name]):
+                return name
+        return None
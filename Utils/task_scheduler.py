@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import time
+import traceback
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+CONFIG = {
+    # Сколько задач каждого класса выполняется одновременно во всём боте
+    "global_limits": {"llm": 4, "sql": 8, "render": 2, "report": 1},
+    # Сколько задач каждого класса одновременно выполняется у одного пользователя
+    "per_user_limits": {"llm": 2, "sql": 3, "render": 2, "report": 1},
+    "max_queued_per_user": 5,   # Ожидающих задач одного пользователя в одном классе; дальше — отказ
+}
+
+
+class QueueFullError(Exception):
+    """У пользователя слишком много задач в очереди."""
+
+
+class _Resource:
+    """Состояние одного класса ресурсов: лимиты, выполняемые задачи и очереди по пользователям."""
+
+    def __init__(self, name: str, limit: int, per_user_limit: int):
+        self.name = name
+        self.limit = limit
+        self.per_user_limit = per_user_limit
+        self.in_flight = 0
+        self.per_user: Counter = Counter()
+        self.queues: "OrderedDict[int, deque]" = OrderedDict()  # Порядок ключей — очередь обхода по кругу
+        self.stats = {"started": 0, "completed": 0, "queued": 0, "rejected": 0, "total_wait": 0.0, "max_wait": 0.0}
+
+
+class TaskScheduler:
+    """Планировщик задач бота: лимиты на пользователя и на класс ресурсов, справедливая очередь.
+
+    Ожидающие задачи обслуживаются по кругу между пользователями, поэтому пользователь с десятком
+    отчётов в очереди не задерживает остальных дольше, чем на одну свою задачу. Все счётчики в памяти.
+    """
+
+    def __init__(self, global_limits: Optional[Dict[str, int]] = None, per_user_limits: Optional[Dict[str, int]] = None,
+                 max_queued_per_user: int = CONFIG["max_queued_per_user"], logger: logging.Logger = None,
+                 clock: Callable[[], float] = time.monotonic):
+        global_limits = global_limits or CONFIG["global_limits"]
+        per_user_limits = per_user_limits or CONFIG["per_user_limits"]
+        self.max_queued_per_user = max_queued_per_user
+        self.logger = logger or logging.getLogger(__name__)
+        self._clock = clock
+        self._resources = {
+            name: _Resource(name, limit, per_user_limits.get(name, limit)) for name, limit in global_limits.items()
+        }
+
+    def _resource(self, name: str) -> _Resource:
+        if name not in self._resources:
+            raise ValueError(f"Неизвестный класс ресурсов: {name}")
+        return self._resources[name]
+
+    @asynccontextmanager
+    async def slot(self, user_id: int, resource: str,
+                   on_queued: Optional[Callable[[int], Awaitable[Any]]] = None):
+        """Занимает слот класса resource для пользователя на время блока with.
+
+        Если слот сразу не свободен, вызывает on_queued(позиция в очереди) и ждёт своей очереди.
+        """
+        await self.acquire(user_id, resource, on_queued)
+        try:
+            yield
+        finally:
+            self.release(user_id, resource)
+
+    async def acquire(self, user_id: int, resource: str,
+                      on_queued: Optional[Callable[[int], Awaitable[Any]]] = None) -> None:
+        res = self._resource(resource)
+        if not res.queues and res.in_flight < res.limit and res.per_user[user_id] < res.per_user_limit:
+            self._start(res, user_id, 0.0)
+            return
+
+        queue = res.queues.get(user_id)
+        if queue is not None and len(queue) >= self.max_queued_per_user:
+            res.stats["rejected"] += 1
+            self.logger.debug("Очередь %s пользователя %s переполнена", resource, user_id)
+            raise QueueFullError(f"Слишком много запросов в очереди ({resource})")
+        if queue is None:
+            queue = res.queues[user_id] = deque()
+        future = asyncio.get_running_loop().create_future()
+        waiter = (future, self._clock())
+        queue.append(waiter)
+        res.stats["queued"] += 1
+        self._dispatch(res)
+
+        # Уведомление тоже под защитой: отмена во время отправки позиции не должна оставить ожидающего в очереди
+        try:
+            if not future.done():
+                position = self._position(res, user_id, len(queue) - 1)
+                self.logger.debug("Задача %s пользователя %s в очереди, позиция %d", resource, user_id, position)
+                if on_queued:
+                    try:
+                        await on_queued(position)
+                    except Exception as e:
+                        self.logger.error("Ошибка уведомления о позиции в очереди: %s", e)
+                        self.logger.error("Трассировка стека: %s", traceback.format_exc())
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Слот уже выдан, но задача отменена до начала работы — возвращаем его
+                self.release(user_id, resource)
+            else:
+                self._discard(res, user_id, waiter)
+            raise
+
+    def release(self, user_id: int, resource: str) -> None:
+        res = self._resource(resource)
+        res.in_flight -= 1
+        res.per_user[user_id] -= 1
+        if res.per_user[user_id] <= 0:
+            del res.per_user[user_id]
+        res.stats["completed"] += 1
+        self._dispatch(res)
+
+    def _start(self, res: _Resource, user_id: int, waited: float) -> None:
+        res.in_flight += 1
+        res.per_user[user_id] += 1
+        res.stats["started"] += 1
+        res.stats["total_wait"] += waited
+        res.stats["max_wait"] = max(res.stats["max_wait"], waited)
+
+    def _dispatch(self, res: _Resource) -> None:
+        """Раздаёт освободившиеся слоты ожидающим по кругу, пропуская пользователей на своём лимите."""
+        while res.in_flight < res.limit and res.queues:
+            user_id = next((uid for uid in res.queues if res.per_user[uid] < res.per_user_limit), None)
+            if user_id is None:
+                return
+            queue = res.queues[user_id]
+            future, enqueued = queue.popleft()
+            if queue:
+                res.queues.move_to_end(user_id)
+            else:
+                del res.queues[user_id]
+            if future.done():
+                continue
+            self._start(res, user_id, self._clock() - enqueued)
+            future.set_result(None)
+
+    def _discard(self, res: _Resource, user_id: int, waiter: tuple) -> None:
+        queue = res.queues.get(user_id)
+        if queue is None:
+            return
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            return
+        if not queue:
+            del res.queues[user_id]
+
+    @staticmethod
+    def _position(res: _Resource, user_id: int, index: int) -> int:
+        """Оценка позиции в очереди: при обходе по кругу каждый другой пользователь успеет до index+1 задач."""
+        ahead = index
+        for uid, queue in res.queues.items():
+            if uid != user_id:
+                ahead += min(len(queue), index + 1)
+        return ahead + 1
+
+    def user_in_flight(self, user_id: int) -> int:
+        """Сколько задач пользователя выполняется сейчас во всех классах."""
+        return sum(res.per_user[user_id] for res in self._resources.values() if user_id in res.per_user)
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        stats = {}
+        for name, res in self._resources.items():
+            started = res.stats["started"]
+            stats[name] = dict(
+                res.stats,
+                limit=res.limit,
+                in_flight=res.in_flight,
+                waiting=sum(len(queue) for queue in res.queues.values()),
+                avg_wait=res.stats["total_wait"] / started if started else 0.0,
+            )
+        return stats
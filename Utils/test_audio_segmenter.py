@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import math
+from array import array
+
+from Utils.audio_segmenter import SilenceSplitter, frame_rms, split_on_silence
+
+RATE = 16000
+
+
+def tone(seconds: float, amplitude: int) -> bytes:
+    n = int(RATE * seconds)
+    return array("h", (int(amplitude * math.sin(2 * math.pi * 440 * i / RATE)) for i in range(n))).tobytes()
+
+
+def silence(seconds: float) -> bytes:
+    return bytes(int(RATE * seconds) * 2)
+
+
+def chunked(pcm: bytes, size: int = 32000):
+    return [pcm[i:i + size] for i in range(0, len(pcm), size)]
+
+
+def test_frame_rms():
+    assert frame_rms(silence(0.03)) == 0.0
+    assert abs(frame_rms(tone(0.1, 1000)) - 1000 / math.sqrt(2)) < 20
+
+
+def test_split_on_pauses_in_order():
+    pcm = tone(1.2, 1000) + silence(0.5) + tone(1.2, 2000) + silence(0.5) + tone(1.2, 3000)
+    segments = list(split_on_silence(chunked(pcm)))
+    assert len(segments) == 3
+    peaks = [max(abs(s) for s in array("h", segment)) for segment in segments]
+    assert peaks[0] < peaks[1] < peaks[2]
+    # Разрезы проходят по паузам: сегменты вместе дают весь звук
+    assert b"".join(segments) == pcm
+
+
+def test_short_pause_does_not_split_short_segment():
+    pcm = tone(0.4, 1000) + silence(0.5) + tone(0.4, 1000)
+    assert len(list(split_on_silence(chunked(pcm)))) == 1
+
+
+def test_silence_only_dropped():
+    assert list(split_on_silence(chunked(silence(3)))) == []
+    segments = list(split_on_silence(chunked(silence(2) + tone(1.2, 1000) + silence(2))))
+    assert len(segments) == 1
+
+
+def test_long_speech_cut_at_max_segment():
+    splitter = SilenceSplitter(max_segment_ms=3000)
+    segments = splitter.feed(tone(7, 1000)) + splitter.flush()
+    assert len(segments) == 3
+    assert all(len(segment) <= 3000 * RATE // 1000 * 2 for segment in segments)
+    assert sum(len(segment) for segment in segments) == len(tone(7, 1000))
+
+
+def test_segments_emitted_while_streaming():
+    splitter = SilenceSplitter()
+    first = splitter.feed(tone(1.2, 1000) + silence(0.5))
+    assert len(first) == 1
+    assert splitter.feed(tone(1.2, 1000)) == []
+    assert len(splitter.flush()) == 1
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import json
+import pytest
+import Utils.cache_codec as codec_mod
+from Utils.cache_codec import CacheCodec, CodecError
+
+VALUE = {"T01": {"index": 1, "names": ["T01", "Темп."]}, "n": 3.5, "empty": None}
+
+@pytest.mark.parametrize("codec", ["pickle", "json"])
+def test_roundtrip(codec):
+    c = CacheCodec(codec=codec)
+    assert c.decode(c.encode(VALUE)) == VALUE
+
+def test_large_values_are_compressed():
+    c = CacheCodec(compress_threshold=100)
+    value = {f"sensor {i}": {"source_files": ["/data/merged.db"] * 5} for i in range(200)}
+    data = c.encode(value)
+    assert data[4] == 1  # zlib
+    assert len(data) < len(json.dumps(value)) / 5
+    assert c.decode(data) == value
+    assert CacheCodec(compression="none", compress_threshold=100).encode(value)[4] == 0
+
+def test_small_values_are_not_compressed():
+    assert CacheCodec(compress_threshold=4096).encode({"a": 1})[4] == 0
+
+def test_decodes_records_of_other_codecs_and_legacy_json():
+    data = CacheCodec(codec="json").encode(VALUE)
+    assert CacheCodec(codec="pickle").decode(data) == VALUE
+    assert CacheCodec().decode(json.dumps(VALUE)) == VALUE
+
+def test_version_mismatch_and_garbage(monkeypatch):
+    data = CacheCodec().encode(VALUE)
+    monkeypatch.setattr(codec_mod, "FORMAT_VERSION", codec_mod.FORMAT_VERSION + 1)
+    with pytest.raises(CodecError):
+        CacheCodec().decode(data)
+    with pytest.raises(CodecError):
+        CacheCodec().decode(b"xx")
+    with pytest.raises(CodecError):
+        CacheCodec().decode("{not json")
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        CacheCodec(codec="yaml")
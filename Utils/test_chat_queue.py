@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import pytest
+from Utils.chat_queue import ChatOrderedExecutor
+
+def test_same_chat_in_order_other_chats_in_parallel():
+    async def scenario():
+        executor = ChatOrderedExecutor(max_concurrent=4)
+        log = []
+        gate = asyncio.Event()
+
+        async def handle(chat, n, block=False):
+            log.append(("start", chat, n))
+            if block:
+                await gate.wait()
+            log.append(("end", chat, n))
+
+        tasks = [
+            asyncio.create_task(executor.run(1, handle(1, 0, block=True))),
+            asyncio.create_task(executor.run(1, handle(1, 1))),
+            asyncio.create_task(executor.run(2, handle(2, 0))),
+        ]
+        await asyncio.sleep(0.01)
+        snapshot = list(log)
+        gate.set()
+        await asyncio.gather(*tasks)
+        return snapshot, log, executor.get_stats()
+
+    snapshot, log, stats = asyncio.run(scenario())
+    # Чат 2 обработан, пока первое сообщение чата 1 ещё выполняется; второе сообщение чата 1 ждёт
+    assert snapshot == [("start", 1, 0), ("start", 2, 0), ("end", 2, 0)]
+    assert log[3:] == [("end", 1, 0), ("start", 1, 1), ("end", 1, 1)]
+    assert stats["processed"] == 3 and stats["in_flight"] == 0 and stats["waiting"] == 0
+    assert stats["chats_waiting"] == 0
+    assert stats["max_wait"] > 0
+
+def test_global_limit():
+    async def scenario():
+        executor = ChatOrderedExecutor(max_concurrent=2)
+        running = peak = 0
+
+        async def handle():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        await asyncio.gather(*(executor.run(chat, handle()) for chat in range(6)))
+        return peak
+
+    assert asyncio.run(scenario()) == 2
+
+def test_failures_and_cancellation_are_counted():
+    async def scenario():
+        executor = ChatOrderedExecutor(max_concurrent=1)
+
+        async def boom():
+            raise ValueError("x")
+
+        with pytest.raises(ValueError):
+            await executor.run(1, boom())
+        blocker = asyncio.create_task(executor.run(1, asyncio.sleep(1)))
+        waiter = asyncio.create_task(executor.run(1, asyncio.sleep(0)))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        blocker.cancel()
+        await asyncio.gather(blocker, waiter, return_exceptions=True)
+        return executor.get_stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["failed"] == 1
+    assert stats["waiting"] == 0 and stats["in_flight"] == 0 and stats["chats_waiting"] == 0
@@ -0,0 +1,90 @@
+import asyncio
+import pytest
+from Utils.circuit_breaker import CircuitBreaker, CONFIG, CLOSED, OPEN, HALF_OPEN
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker("test-model", max_timeout=30, failure_threshold=3, reset_timeout=10, clock=clock)
+
+def test_opens_after_threshold(breaker):
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.is_open
+    assert not breaker.allow()
+
+def test_success_resets_failures(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success(0.5)
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+def test_half_open_single_probe(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now = 10
+    assert not breaker.is_open
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()  # Второй запрос ждёт результата пробного
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    clock.now = 15
+    assert not breaker.allow()
+
+    clock.now = 20
+    assert breaker.allow()
+    breaker.record_success(1.0)
+    assert breaker.state == CLOSED
+    assert breaker.allow() and breaker.allow()
+
+def test_adaptive_timeout(breaker):
+    assert breaker.timeout() == 30
+    for _ in range(CONFIG["min_samples"]):
+        breaker.record_success(2.0)
+    assert breaker.timeout() == 2.0 * CONFIG["timeout_multiplier"]
+
+    for _ in range(CONFIG["latency_window"]):
+        breaker.record_success(0.1)
+    assert breaker.timeout() == CONFIG["min_timeout"]
+
+    for _ in range(CONFIG["latency_window"]):
+        breaker.record_success(100.0)
+    assert breaker.timeout() == 30
+
+def test_timeouts_raise_estimate_and_probe_gets_max_timeout():
+    async def scenario():
+        breaker = CircuitBreaker("slow", max_timeout=1.0, min_timeout=0.01, failure_threshold=3, reset_timeout=0)
+        for _ in range(CONFIG["latency_window"]):
+            breaker.record_success(0.01)
+        fast_timeout = breaker.timeout()
+
+        async def slow():
+            await asyncio.sleep(0.1)  # Бэкенд замедлился в 10 раз
+            return "ok"
+
+        for _ in range(3):
+            with pytest.raises(TimeoutError):
+                await breaker.call(slow)
+        assert breaker.state == OPEN
+        assert breaker.timeout() > fast_timeout  # Таймауты учтены как задержки не меньше таймаута
+        result = await breaker.call(slow)  # Пробный запрос с max_timeout проходит
+        return result, breaker.state
+
+    assert asyncio.run(scenario()) == ("ok", CLOSED)
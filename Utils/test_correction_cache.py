@@ -0,0 +1,58 @@
+import sqlite3
+import pytest
+from Utils.correction_cache import CorrectionCache, make_key
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "cache.db")
+
+def test_make_key_depends_on_all_parts():
+    assert make_key("a", "bc") != make_key("ab", "c")
+    assert make_key("model", "prompt") == make_key("model", "prompt")
+
+def test_set_and_get(db_path):
+    cache = CorrectionCache(db_path)
+    assert cache.get("k") == (False, None)
+    cache.set("k", '{"is_valid": true}')
+    assert cache.get("k") == (True, '{"is_valid": true}')
+
+def test_negative_entry(db_path):
+    cache = CorrectionCache(db_path)
+    cache.set("bad", None)
+    assert cache.get("bad") == (True, None)
+
+def test_expired_entries_are_misses(db_path):
+    cache = CorrectionCache(db_path, ttl_seconds=-1, negative_ttl_seconds=-1)
+    cache.set("ok", "value")
+    cache.set("bad", None)
+    assert cache.get("ok") == (False, None)
+    assert cache.get("bad") == (False, None)
+
+def test_size_bound(db_path):
+    cache = CorrectionCache(db_path, max_entries=3)
+    for i in range(10):
+        cache.set(f"k{i}", str(i))
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM correction_cache").fetchone()[0] == 3
+    assert cache.get("k9") == (True, "9")
+
+def test_survives_restart(db_path):
+    CorrectionCache(db_path).set("k", "v")
+    assert CorrectionCache(db_path).get("k") == (True, "v")
+
+def data_version(conn):
+    return conn.execute("PRAGMA data_version").fetchone()[0]
+
+def test_get_does_not_write(db_path):
+    cache = CorrectionCache(db_path, access_batch=3)
+    for key in ("a", "b", "c"):
+        cache.set(key, key)
+    with sqlite3.connect(db_path) as conn:
+        before = data_version(conn)
+        assert cache.get("a") == (True, "a")
+        assert cache.get("a") == (True, "a")
+        assert cache.get("b") == (True, "b")
+        assert cache.get("missing") == (False, None)
+        assert data_version(conn) == before
+        cache.get("c")  # Третий ключ — пачка обращений записывается
+        assert data_version(conn) != before
@@ -2,6 +2,7 @@ import pytest
 import logging
 from unittest.mock import patch
 from Utils.error_corrector import ErrorCorrector
+from Utils.correction_cache import CorrectionCache
 
 import asyncio
 
@@ -87,3 +88,22 @@ async def test_logging_no_debug_mode(corrector_nodebug, caplog):
         )
     assert result == mock_response
     assert any("Вызов коррекции" in record.message for record in caplog.records)
+
+@pytest.mark.asyncio
+async def test_correct_uses_cache(tmp_path):
+    corrector = ErrorCorrector(debug_mode=False, cache=CorrectionCache(str(tmp_path / "cache.db")))
+    with patch('g4f.ChatCompletion.create', return_value="2025-04-12") as create:
+        first = await corrector.correct(input_data="12.04.25", prompt_addition="Исправь дату")
+        second = await corrector.correct(input_data="12.04.25", prompt_addition="Исправь дату")
+    assert first == second == "2025-04-12"
+    assert create.call_count == 1
+
+@pytest.mark.asyncio
+async def test_failed_correction_is_negatively_cached(tmp_path):
+    corrector = ErrorCorrector(debug_mode=False, cache=CorrectionCache(str(tmp_path / "cache.db")))
+    corrector.retry_interval = 0
+    with patch('g4f.ChatCompletion.create', side_effect=ValueError("down")) as create:
+        assert await corrector.correct(input_data="плохо", prompt_addition="Исправь") is None
+        calls = create.call_count
+        assert await corrector.correct(input_data="плохо", prompt_addition="Исправь") is None
+    assert create.call_count == calls
@@ -0,0 +1,58 @@
+import logging
+import pytest
+from Utils.prompt_budget import CONFIG, PromptBudget, estimate_tokens
+
+SENSORS = [
+    "T01 (DT51)",
+    "T06 (T32)",
+    "T08 (T34)",
+    "P11 (ВД22)",
+    "GD01(UZ01)",
+    "Gm D3",
+    "Gm D4",
+] + [f"X{i:03d} (AUX{i})" for i in range(500)]
+
+@pytest.fixture
+def budget():
+    return PromptBudget(shortlist_size=5)
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("a" * 30) == int(30 / CONFIG["chars_per_token"]) + 1
+
+def test_shortlist_by_sensor_name(budget):
+    candidates = budget.shortlist("т6", SENSORS)
+    assert candidates[0] == "T06 (T32)"
+    assert len(candidates) <= 5
+
+def test_shortlist_by_words_of_message(budget):
+    candidates = budget.shortlist("покажи график т8 за вчера", SENSORS)
+    assert "T08 (T34)" in candidates
+    assert len(candidates) <= 5
+
+def test_shortlist_fallback_is_bounded(budget):
+    candidates = budget.shortlist("qqq", SENSORS)
+    assert candidates == SENSORS[:len(candidates)]
+    assert sum(len(name) + 2 for name in candidates) <= CONFIG["fallback_max_chars"]
+    assert budget.shortlist("т6", []) == []
+
+def test_shortlist_rebuilds_index_on_new_sensors(budget):
+    assert budget.shortlist("т6", SENSORS)[0] == "T06 (T32)"
+    assert budget.shortlist("т6", ["T06 (NEW)"])[0] == "T06 (NEW)"
+
+def test_static_is_computed_once(budget):
+    calls = []
+    factory = lambda: calls.append(1) or "static"
+    assert budget.static("key", factory) == "static"
+    assert budget.static("key", factory) == "static"
+    assert len(calls) == 1
+
+def test_measure_collects_stats(budget, caplog):
+    budget.measure("validate_sensor", "x" * 100)
+    budget.measure("validate_sensor", "x" * 50)
+    stats = budget.get_stats()["validate_sensor"]
+    assert stats == {"calls": 2, "chars": 150, "tokens": estimate_tokens("x" * 100) + estimate_tokens("x" * 50), "max_chars": 100}
+
+    with caplog.at_level(logging.WARNING):
+        budget.measure("huge", "x" * (CONFIG["max_prompt_chars"] + 1))
+    assert "превышает бюджет" in caplog.text
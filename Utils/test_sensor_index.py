@@ -0,0 +1,90 @@
+import pytest
+from Utils.sensor_index import SensorIndex, normalize_key, split_aliases
+
+SENSORS = [
+    "T01 (DT51)",
+    "T06 (T32)",
+    "T08 (T34)",
+    "P11 (ВД22)",
+    "DP0 (Д1-Дозатор)",
+    "GD01(UZ01)",
+    "Gm D3",
+    "Gm D4",
+    "SUM_BALLS",
+]
+
+@pytest.fixture
+def index():
+    return SensorIndex(SENSORS)
+
+def test_normalize_key_homoglyphs_and_padding():
+    assert normalize_key("т6") == normalize_key("T06") == normalize_key("T006") == "t6"
+    assert normalize_key("Р11") == normalize_key("P11")
+    assert normalize_key("п11") == "p11"
+    assert normalize_key("  ") == ""
+
+def test_split_aliases():
+    assert split_aliases("T08 (T34)") == ["T08 (T34)", "T08", "T34"]
+    assert split_aliases("GD01(UZ01)") == ["GD01(UZ01)", "GD01", "UZ01"]
+    assert split_aliases("SUM_BALLS") == ["SUM_BALLS"]
+
+@pytest.mark.parametrize("query,expected", [
+    ("т6", "T06 (T32)"),
+    ("Т06", "T06 (T32)"),
+    ("t32", "T06 (T32)"),
+    ("T08T34", "T08 (T34)"),
+    ("п11", "P11 (ВД22)"),
+    ("вд22", "P11 (ВД22)"),
+    ("uz01", "GD01(UZ01)"),
+    ("sum balls", "SUM_BALLS"),
+    ("дозатор", "DP0 (Д1-Дозатор)"),
+])
+def test_best(index, query, expected):
+    assert index.best(query) == expected
+
+def test_lookup_ranking(index):
+    candidates = index.lookup("gm d3", limit=3)
+    assert candidates[0] == ("Gm D3", 1.0)
+    assert "Gm D4" in [name for name, _ in candidates[1:]]
+    assert all(a[1] >= b[1] for a, b in zip(candidates, candidates[1:]))
+
+@pytest.mark.parametrize("query,expected", [
+    ("т6", "T06 (T32)"),
+    ("t32", "T06 (T32)"),
+    ("T08T34", "T08 (T34)"),
+    ("sum bals", "SUM_BALLS"),
+])
+def test_resolve(index, query, expected):
+    assert index.resolve(query) == expected
+
+@pytest.mark.parametrize("query", ["T99", "т25", "т30", "t100", "P12", "дозатор", ""])
+def test_resolve_rejects_other_sensors(query):
+    index = SensorIndex(SENSORS + [f"T{i:02d}" for i in range(2, 11)])
+    assert index.resolve(query) is None
+
+def test_resolve_rejects_ambiguous_key():
+    index = SensorIndex(["T06 (T32)", "T32"])
+    assert index.exact("т32") is None
+    assert index.resolve("т32") is None
+    assert index.resolve("т6") == "T06 (T32)"
+
+def test_best_is_only_a_suggestion():
+    index = SensorIndex([f"T{i:02d}" for i in range(1, 11)])
+    assert index.best("T99") == "T09"  # Нечёткий кандидат — для подсказки, не для подстановки
+    assert index.resolve("T99") is None
+
+def test_lookup_no_match(index):
+    assert index.lookup("") == []
+    assert index.best("ZZZ999") is None
+
+def test_exact_and_contains(index):
+    assert index.exact("т1") == "T01 (DT51)"
+    assert index.exact("qq") is None
+    assert "T06 (T32)" in index
+    assert "T06" not in index
+    assert len(index) == len(SENSORS)
+    assert [index.rank(name) for name in SENSORS] == list(range(len(SENSORS)))
+
+def test_build_from_sensor_info_dict():
+    sensor_info = {name: {"sensor_name": name, "index": i} for i, name in enumerate(SENSORS)}
+    assert SensorIndex(sensor_info).best("т8") == "T08 (T34)"
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import pytest
+from Utils.task_scheduler import TaskScheduler, QueueFullError
+
+def make_scheduler(**kwargs):
+    return TaskScheduler(global_limits={"report": 1}, per_user_limits={"report": 1}, **kwargs)
+
+def test_global_limit_and_fair_round_robin():
+    async def scenario():
+        scheduler = make_scheduler(max_queued_per_user=10)
+        order = []
+        gate = asyncio.Event()
+
+        async def job(user_id, n):
+            async with scheduler.slot(user_id, "report"):
+                order.append((user_id, n))
+                await gate.wait()
+
+        # Пользователь 1 ставит пять отчётов, пользователь 2 — два после него
+        tasks = [asyncio.create_task(job(1, n)) for n in range(5)]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(job(2, n)) for n in range(2)]
+        await asyncio.sleep(0)
+        assert scheduler.get_stats()["report"]["in_flight"] == 1
+        gate.set()
+        await asyncio.gather(*tasks)
+        return order, scheduler.get_stats()["report"]
+
+    order, stats = asyncio.run(scenario())
+    assert order == [(1, 0), (1, 1), (2, 0), (1, 2), (2, 1), (1, 3), (1, 4)]
+    assert stats["completed"] == 7 and stats["in_flight"] == 0 and stats["waiting"] == 0
+
+def test_per_user_limit_does_not_block_others():
+    async def scenario():
+        scheduler = TaskScheduler(global_limits={"sql": 3}, per_user_limits={"sql": 1})
+        gate = asyncio.Event()
+        running = []
+
+        async def job(user_id):
+            async with scheduler.slot(user_id, "sql"):
+                running.append(user_id)
+                await gate.wait()
+
+        tasks = [asyncio.create_task(job(uid)) for uid in (1, 1, 1, 2)]
+        await asyncio.sleep(0)
+        snapshot = sorted(running)
+        assert scheduler.user_in_flight(1) == 1
+        gate.set()
+        await asyncio.gather(*tasks)
+        return snapshot
+
+    assert asyncio.run(scenario()) == [1, 2]
+
+def test_queue_position_feedback_and_overflow():
+    async def scenario():
+        scheduler = make_scheduler(max_queued_per_user=1)
+        positions = []
+        gate = asyncio.Event()
+
+        async def notify(position):
+            positions.append(position)
+
+        async def job(user_id):
+            async with scheduler.slot(user_id, "report", on_queued=notify):
+                await gate.wait()
+
+        tasks = [asyncio.create_task(job(uid)) for uid in (1, 2, 3)]
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFullError):
+            await job(2)
+        gate.set()
+        await asyncio.gather(*tasks)
+        return positions, scheduler.get_stats()["report"]["rejected"]
+
+    assert asyncio.run(scenario()) == ([1, 2], 1)
+
+def test_cancelled_waiter_leaves_queue():
+    async def scenario():
+        scheduler = make_scheduler()
+        gate = asyncio.Event()
+
+        async def job(user_id):
+            async with scheduler.slot(user_id, "report"):
+                await gate.wait()
+
+        first = asyncio.create_task(job(1))
+        second = asyncio.create_task(job(2))
+        await asyncio.sleep(0)
+        second.cancel()
+        await asyncio.sleep(0)
+        stats = scheduler.get_stats()["report"]
+        gate.set()
+        await first
+        return stats["waiting"], scheduler.get_stats()["report"]["in_flight"]
+
+    assert asyncio.run(scenario()) == (0, 0)
+
+def test_cancelled_during_queue_notification():
+    async def scenario():
+        scheduler = make_scheduler()
+        gate = asyncio.Event()
+        notified = asyncio.Event()
+        done = []
+
+        async def slow_notify(position):
+            notified.set()
+            await asyncio.sleep(10)
+
+        async def job(user_id, on_queued=None):
+            async with scheduler.slot(user_id, "report", on_queued=on_queued):
+                await gate.wait()
+                done.append(user_id)
+
+        first = asyncio.create_task(job(1))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(job(2, slow_notify))
+        await notified.wait()
+        second.cancel()
+        await asyncio.gather(second, return_exceptions=True)
+        gate.set()
+        await first
+        await asyncio.wait_for(job(3), timeout=1)
+        return done, scheduler.get_stats()["report"]
+
+    done, stats = asyncio.run(scenario())
+    assert done == [1, 3]
+    assert stats["in_flight"] == 0 and stats["waiting"] == 0
+
+def test_unknown_resource():
+    with pytest.raises(ValueError):
+        asyncio.run(make_scheduler().acquire(1, "gpu"))
@@ -0,0 +1,49 @@
+import sqlite3
+import pytest
+from Utils.transcription_cache import TranscriptionCache, file_key, pcm_key
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "cache.db")
+
+def test_keys():
+    assert file_key("AgAD") == "file:AgAD"
+    assert pcm_key(b"\x00\x01") == pcm_key(b"\x00\x01")
+    assert pcm_key(b"\x00\x01") != pcm_key(b"\x00\x02")
+
+def test_set_and_get(db_path):
+    cache = TranscriptionCache(db_path)
+    assert cache.get("file:a") is None
+    cache.set("file:a", "график T01")
+    assert cache.get("file:a") == "график T01"
+    assert cache.get_stats() == {"hits": 1, "misses": 1}
+
+def test_expired_entries_are_misses(db_path):
+    cache = TranscriptionCache(db_path, ttl_seconds=-1)
+    cache.set("file:a", "текст")
+    assert cache.get("file:a") is None
+
+def test_size_bound(db_path):
+    cache = TranscriptionCache(db_path, max_entries=3)
+    for i in range(10):
+        cache.set(f"file:{i}", str(i))
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM transcription_cache").fetchone()[0] == 3
+    assert cache.get("file:9") == "9"
+
+def test_survives_restart(db_path):
+    TranscriptionCache(db_path).set("file:a", "текст")
+    assert TranscriptionCache(db_path).get("file:a") == "текст"
+
+def test_get_does_not_write(db_path):
+    cache = TranscriptionCache(db_path, access_batch=2)
+    cache.set("file:a", "a")
+    cache.set("file:b", "b")
+    with sqlite3.connect(db_path) as conn:
+        before = conn.execute("PRAGMA data_version").fetchone()[0]
+        assert cache.get("file:a") == "a"
+        assert cache.get("file:a") == "a"
+        assert cache.get("file:x") is None
+        assert conn.execute("PRAGMA data_version").fetchone()[0] == before
+        cache.get("file:b")
+        assert conn.execute("PRAGMA data_version").fetchone()[0] != before
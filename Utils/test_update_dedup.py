@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from Utils.update_dedup import UpdateDeduplicator
+
+
+def test_duplicate_rejected():
+    dedup = UpdateDeduplicator(window=10)
+    assert dedup.add(1)
+    assert dedup.add(2)
+    assert not dedup.add(1)
+    stats = dedup.get_stats()
+    assert stats["accepted"] == 2
+    assert stats["duplicates"] == 1
+    assert stats["tracked"] == 2
+
+
+def test_window_bounded():
+    dedup = UpdateDeduplicator(window=3)
+    for update_id in range(5):
+        assert dedup.add(update_id)
+    assert dedup.get_stats()["tracked"] == 3
+    assert 0 not in dedup
+    assert 4 in dedup
+    # Вышедший из окна идентификатор снова принимается
+    assert dedup.add(0)
+
+
+def test_recent_duplicate_kept_in_window():
+    dedup = UpdateDeduplicator(window=2)
+    dedup.add(1)
+    dedup.add(2)
+    assert not dedup.add(1)  # Повтор освежает запись
+    dedup.add(3)
+    assert 1 in dedup
+    assert 2 not in dedup
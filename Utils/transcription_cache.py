@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+import hashlib
+import logging
+import time
+from contextlib import closing
+from threading import Lock
+from typing import Dict, Optional
+import traceback
+
+CONFIG = {
+    "ttl_seconds": 30 * 24 * 3600,
+    "max_entries": 10000,
+    "access_batch": 100,    # Сколько попаданий копить перед записью last_access одним UPDATE
+}
+
+
+def file_key(file_unique_id: str) -> str:
+    """Ключ по file_unique_id Telegram: одинаков у пересланных копий одного файла."""
+    return f"file:{file_unique_id}"
+
+
+def pcm_key(pcm: bytes) -> str:
+    """Ключ по содержимому декодированного PCM (для повторно загруженного того же звука)."""
+    return "pcm:" + hashlib.sha256(pcm).hexdigest()
+
+
+class TranscriptionCache:
+    """Персистентный кеш распознанного текста голосовых сообщений в SQLite с TTL и ограничением размера.
+
+    Как и CorrectionCache, чтение ничего не пишет (last_access сохраняется пачкой),
+    а из асинхронного кода методы вызываются через asyncio.to_thread.
+    """
+
+    def __init__(self, db_path: str, ttl_seconds: int = CONFIG["ttl_seconds"],
+                 max_entries: int = CONFIG["max_entries"], access_batch: int = CONFIG["access_batch"],
+                 logger: logging.Logger = None):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.access_batch = access_batch
+        self._lock = Lock()
+        self._pending_access: Dict[str, int] = {}
+        self.logger = logger or logging.getLogger(__name__)
+        self.stats = {"hits": 0, "misses": 0}
+        try:
+            with closing(self._get_connection()) as conn:
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS transcription_cache (
+                        key TEXT PRIMARY KEY,
+                        text TEXT,
+                        expire_at INTEGER,
+                        last_access INTEGER
+                    )
+                    """
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_transcription_cache_access ON transcription_cache(last_access)")
+                conn.execute("DELETE FROM transcription_cache WHERE expire_at < ?", (int(time.time()),))
+                conn.commit()
+        except Exception as e:
+            self.logger.error("Ошибка инициализации TranscriptionCache: %s", e)
+            self.logger.error("Трассировка стека: %s", traceback.format_exc())
+
+    def _get_connection(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, check_same_thread=False)
+
+    def _flush_access(self, conn: sqlite3.Connection) -> None:
+        """Записывает накопленные времена обращений; вызывается под self._lock, commit — у вызывающего."""
+        if self._pending_access:
+            conn.executemany("UPDATE transcription_cache SET last_access = ? WHERE key = ?",
+                             [(ts, key) for key, ts in self._pending_access.items()])
+            self._pending_access.clear()
+
+    def get(self, key: str) -> Optional[str]:
+        """Возвращает распознанный текст или None, если записи нет или она истекла."""
+        now = int(time.time())
+        try:
+            with self._lock, closing(self._get_connection()) as conn:
+                row = conn.execute("SELECT text, expire_at FROM transcription_cache WHERE key = ?", (key,)).fetchone()
+                if not row or row[1] < now:
+                    self.stats["misses"] += 1
+                    return None
+                self.stats["hits"] += 1
+                self._pending_access[key] = now
+                if len(self._pending_access) >= self.access_batch:
+                    self._flush_access(conn)
+                    conn.commit()
+                return row[0]
+        except Exception as e:
+            self.logger.error("Ошибка чтения кеша распознавания: %s", e)
+            self.logger.error("Трассировка стека: %s", traceback.format_exc())
+            return None
+
+    def set(self, key: str, text: str) -> None:
+        now = int(time.time())
+        try:
+            with self._lock, closing(self._get_connection()) as conn:
+                self._flush_access(conn)
+                conn.execute(
+                    """
+                    INSERT INTO transcription_cache(key, text, expire_at, last_access)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(key) DO UPDATE SET text=excluded.text, expire_at=excluded.expire_at, last_access=excluded.last_access;
+                    """,
+                    (key, text, now + self.ttl_seconds, now)
+                )
+                count = conn.execute("SELECT COUNT(*) FROM transcription_cache").fetchone()[0]
+                if count > self.max_entries:
+                    # Вытесняем истёкшие и давно не использованные записи
+                    conn.execute("DELETE FROM transcription_cache WHERE expire_at < ?", (now,))
+                    conn.execute(
+                        """
+                        DELETE FROM transcription_cache WHERE key IN (
+                            SELECT key FROM transcription_cache ORDER BY last_access ASC, expire_at ASC, rowid ASC LIMIT
+                            max(0, (SELECT COUNT(*) FROM transcription_cache) - ?)
+                        )
+                        """,
+                        (self.max_entries,)
+                    )
+                conn.commit()
+            self.logger.debug("Кеш распознавания обновлён: key=%s", key[:20])
+        except Exception as e:
+            self.logger.error("Ошибка записи в кеш распознавания: %s", e)
+            self.logger.error("Трассировка стека: %s", traceback.format_exc())
+
+    def get_stats(self) -> Dict[str, int]:
+        return dict(self.stats)
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+from typing import Any, Dict
+
+CONFIG = {
+    "window": 10000,   # Сколько последних update_id помнить; повторы старше окна не распознаются
+}
+
+
+class UpdateDeduplicator:
+    """Отсекает повторно доставленные обновления Telegram по update_id.
+
+    Telegram повторяет доставку вебхука, если не получил ответ вовремя, а после перезапуска бота
+    может прислать уже обработанные обновления. Хранит окно последних идентификаторов в памяти.
+    """
+
+    def __init__(self, window: int = CONFIG["window"]):
+        self.window = window
+        self._seen: "OrderedDict[int, None]" = OrderedDict()
+        self._stats = {"accepted": 0, "duplicates": 0}
+
+    def add(self, update_id: int) -> bool:
+        """Запоминает update_id; возвращает False, если такое обновление уже было."""
+        if update_id in self._seen:
+            self._seen.move_to_end(update_id)
+            self._stats["duplicates"] += 1
+            return False
+        self._seen[update_id] = None
+        if len(self._seen) > self.window:
+            self._seen.popitem(last=False)
+        self._stats["accepted"] += 1
+        return True
+
+    def __contains__(self, update_id: int) -> bool:
+        return update_id in self._seen
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self._stats, tracked=len(self._seen), window=self.window)